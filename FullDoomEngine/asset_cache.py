@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from doomsettings import ASSET_CACHE_DIR
+
+
+class AssetCache:
+    """
+    On-disk cache of the decoded WAD assets, so that later launches map
+    the results instead of decoding every patch, texture and flat again.
+
+    One directory per WAD content hash and VERSION holds:
+    - index.json: name -> [offset, width, height] for each asset
+    - patch_pixels.npy / patch_masks.npy: palette-indexed patches and their
+      transparency masks (sprites, doomguy faces, status bar), flattened
+      and concatenated
+    - textures.npy: palette-indexed wall textures and flats, flattened and
+      concatenated
+    The .npy files are memory-mapped when loaded, and the assets are
+    views into them.
+    """
+    # bump whenever the decoded output changes, to invalidate old caches
+    VERSION = 2
+
+    def __init__(self, wad_path, cache_dir=ASSET_CACHE_DIR):
+        self.wad_hash = self.hash_file(wad_path)
+        self.path = os.path.join(cache_dir, f"{self.wad_hash}-v{self.VERSION}")
+        self.patches = None
+        self.textures = None
+
+    @staticmethod
+    def hash_file(path, chunk_size=1 << 20):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def load(self):
+        """
+        Map the cached assets, if there are any for this WAD.
+
+        Returns
+        =======
+            True if the cache was found, with the assets in self.patches
+            (group -> name -> (pixels, mask)) and self.textures (name -> pixels)
+        """
+        index_path = os.path.join(self.path, 'index.json')
+        if not os.path.exists(index_path):
+            return False
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index['version'] != self.VERSION or index['wad_hash'] != self.wad_hash:
+            return False
+
+        # np.asarray drops the memmap subclass, leaving plain (read-only) arrays
+        patch_pixels = np.asarray(self.load_array('patch_pixels.npy'))
+        patch_masks = np.asarray(self.load_array('patch_masks.npy'))
+        textures = np.asarray(self.load_array('textures.npy'))
+
+        self.patches = {}
+        for group, entries in index['patches'].items():
+            self.patches[group] = {}
+            for name, (offset, width, height) in entries.items():
+                size = width * height
+                self.patches[group][name] = (
+                    patch_pixels[offset: offset + size].reshape(width, height),
+                    patch_masks[offset: offset + size].reshape(width, height),
+                )
+        self.textures = {}
+        for name, (offset, width, height) in index['textures'].items():
+            self.textures[name] = textures[offset: offset + width * height].reshape(width, height)
+        return True
+
+    def load_array(self, file_name):
+        return np.load(os.path.join(self.path, file_name), mmap_mode='r')
+
+    def save(self, patches, textures):
+        """
+        Parameters
+        ==========
+        patches: dict, group -> name -> (pixels, mask) arrays of shape (width, height)
+        textures: dict, name -> palette-indexed array of shape (width, height)
+        """
+        index = {
+            'version': self.VERSION,
+            'wad_hash': self.wad_hash,
+            'patches': {},
+            'textures': {},
+        }
+        pixel_chunks, mask_chunks = [], []
+        offset = 0
+        for group, entries in patches.items():
+            index['patches'][group] = {}
+            for name, (pixels, mask) in entries.items():
+                width, height = pixels.shape
+                index['patches'][group][name] = [offset, width, height]
+                pixel_chunks.append(pixels.ravel())
+                mask_chunks.append(mask.ravel())
+                offset += width * height
+
+        texture_chunks = []
+        offset = 0
+        for name, image in textures.items():
+            width, height = image.shape
+            index['textures'][name] = [offset, width, height]
+            texture_chunks.append(image.ravel())
+            offset += width * height
+
+        # write to a temporary directory and rename it into place, so that
+        # an interrupted save never leaves a half-written cache behind
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, 'patch_pixels.npy'), self.concatenate(pixel_chunks, np.uint8))
+        np.save(os.path.join(tmp_path, 'patch_masks.npy'), self.concatenate(mask_chunks, bool))
+        np.save(os.path.join(tmp_path, 'textures.npy'), self.concatenate(texture_chunks, np.uint8))
+        with open(os.path.join(tmp_path, 'index.json'), 'w') as f:
+            json.dump(index, f)
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # another process saved the same cache first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @staticmethod
+    def concatenate(chunks, dtype):
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
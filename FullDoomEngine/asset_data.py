@@ -1,142 +1,302 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
 import pygame as pg
+from asset_cache import AssetCache
 from doomsettings import *
+from lazy_assets import AssetLRU, LazyAssets
+from lighting import build_colormaps
+from sounds import SoundBank
+from wad_reader import WADReader
+
+
+def indexed_to_rgb(palette_array, pixels, mask):
+    # palette-indexed pixels to an RGB array, transparent pixels set to COLOUR_KEY
+    image = palette_array[pixels]
+    image[~mask] = COLOUR_KEY
+    return image
+
+
+def make_patch_image(palette_array, pixels, mask, is_sprite=True):
+    image = pg.surfarray.make_surface(indexed_to_rgb(palette_array, pixels, mask))
+    image.set_colorkey(COLOUR_KEY)
+    if is_sprite:
+        width, height = pixels.shape
+        image = pg.transform.scale(image, (width * SCALE, height * SCALE))
+    return image
+
+
+def decode_patches_worker(wad_path, lump_names):
+    # runs in a worker process, reading the patches from its own mapping of the WAD
+    reader = WADReader(wad_path)
+    try:
+        patches = {}
+        for name in lump_names:
+            index = reader.get_lump_index(name)
+            if not index:
+                patches[name] = None
+                continue
+            _, pixels, mask = reader.read_patch_pixels(reader.directory[index]['lump_offset'])
+            patches[name] = pixels, mask
+        return patches
+    finally:
+        reader.close()
+
 
 class Patch:
     def __init__(self, asset_data, name, is_sprite=True):
         self.asset_data = asset_data
         self.name = name
         self.palette = asset_data.palette
+        self.is_sprite = is_sprite
+        self._image = None
         self.patch_index = self.asset_data.get_lump_index(name)
         if not self.patch_index:
             return
-        self.header, self.columns = self.load_patch_columns(name)
+        # palette-indexed pixels and their transparency mask, (width, height)
+        self.header, self.pixels, self.mask = self.load_patch_pixels()
         self.width = self.header.width
         self.height = self.header.height
-        self.image = self.get_image()
-        if is_sprite:
-            self.image = pg.transform.scale(
-                self.image, (
-                    self.width * SCALE, self.height * SCALE
-                )
 
+    @property
+    def image(self):
+        # the Surface is only built when something draws the patch
+        # directly, texture patches are composed from the pixel arrays
+        if self._image is None:
+            self._image = make_patch_image(
+                self.asset_data.palette_array, self.pixels, self.mask, self.is_sprite
             )
+        return self._image
 
-    def get_image(self):
-        image = pg.Surface([self.width, self.height])
-        image.fill(COLOUR_KEY)
-        image.set_colorkey(COLOUR_KEY)
-
-        ix = 0
-        for column in self.columns:
-            if column.top_delta == 0xFF:
-                ix += 1
-                continue
-            for iy in range(column.length):
-                colour_idx = column.data[iy]
-                colour = self.palette[colour_idx]
-                image.set_at([ix, iy+column.top_delta], colour)
-        return image
-
-    def load_patch_columns(self, patch_name):
+    def load_patch_pixels(self):
         reader = self.asset_data.reader
-        
         patch_offset = reader.directory[self.patch_index]['lump_offset']
-
-        patch_header = self.asset_data.reader.read_patch_header(patch_offset)
-        patch_columns = []
-
-        for i in range(patch_header.width):
-            offs = patch_offset + patch_header.column_offset[i]
-            while True:
-                patch_column, offs = reader.read_patch_column(offs)
-                patch_columns.append(patch_column)
-                if patch_column.top_delta == 0xFF:
-                    break
-        return patch_header, patch_columns
+        return reader.read_patch_pixels(patch_offset)
 
 class Texture:
-    def __init__(self, asset_data, tex_map):
+    def __init__(self, asset_data, tex_map, texture_patches=None):
         self.asset_data = asset_data
         self.tex_map = tex_map
+        # (pixels, mask) of each patch in PNAMES, None for missing ones
+        if texture_patches is None:
+            texture_patches = asset_data.texture_patches
+        self.pixels, self.mask = self.compose(texture_patches)
         self.image = self.get_image()
 
-    def get_image(self):
-        image = pg.Surface([self.tex_map.width, self.tex_map.height])
-        image.fill(COLOUR_KEY)
-        image.set_colorkey(COLOUR_KEY)
-        #
+    def compose(self, texture_patches):
+        # overlay the patches with array slicing, clipped to the texture,
+        # where transparent patch pixels leave what is underneath
+        width, height = self.tex_map.width, self.tex_map.height
+        pixels = np.zeros((width, height), dtype=np.uint8)
+        mask = np.zeros((width, height), dtype=bool)
         for patch_map in self.tex_map.patch_maps:
-            patch = self.asset_data.texture_patches[patch_map.p_name_index]
-            image.blit(patch.image, (patch_map.x_offset, patch_map.y_offset))
-        image = pg.surfarray.array3d(image)
-        
-        return image
-
-class Flat:
-    def __init__(self, asset_data, flat_data):
-        self.flat_data = flat_data
-        self.palette = asset_data.palette
-        self.image = self.get_image()
+            patch = texture_patches[patch_map.p_name_index]
+            if patch is None:
+                continue
+            patch_pixels, patch_mask = patch
+            patch_width, patch_height = patch_pixels.shape
+            x1, y1 = patch_map.x_offset, patch_map.y_offset
+            dx1, dy1 = max(x1, 0), max(y1, 0)
+            dx2, dy2 = min(x1 + patch_width, width), min(y1 + patch_height, height)
+            if dx1 >= dx2 or dy1 >= dy2:
+                continue
+            src = (slice(dx1 - x1, dx2 - x1), slice(dy1 - y1, dy2 - y1))
+            dst = (slice(dx1, dx2), slice(dy1, dy2))
+            patch_mask = patch_mask[src]
+            pixels[dst][patch_mask] = patch_pixels[src][patch_mask]
+            mask[dst] |= patch_mask
+        return pixels, mask
 
     def get_image(self):
-        image = pg.Surface([64, 64])
-        for i, color_idx in enumerate(self.flat_data):
-            ix = i % 64
-            iy = i // 64
-            color = self.palette[color_idx]
-            image.set_at([ix, iy], color)
-        image = pg.surfarray.array3d(image)
-        return image
+        # textures stay palette-indexed, they are lit through the colormaps
+        # when drawn. Transparent texels are left at index 0.
+        return self.pixels
 
+class AssetData:
+    """
+    WAD-wide assets (palettes, colormaps, sprites, textures, flats, sounds).
+    They don't depend on the map, so use AssetData.for_wad to share one
+    instance between all the maps loaded from a WAD.
+    """
+    FLAT_SIZE = 64
 
+    # wad path -> AssetData, shared by every map load in this process
+    _instances = {}
+    _instances_lock = threading.Lock()
 
-class AssetData:
-    def __init__(self, wad_data):
-        self.wad_data = wad_data
-        self.reader = wad_data.reader
-        self.get_lump_index = wad_data.get_lump_index
+    @classmethod
+    def for_wad(cls, wad_path):
+        with cls._instances_lock:
+            if wad_path not in cls._instances:
+                cls._instances[wad_path] = cls(wad_path)
+            return cls._instances[wad_path]
+
+    def __init__(self, wad_path):
+        # own reader, kept open to decode assets on demand
+        self.reader = WADReader(wad_path)
+        self.get_lump_index = self.reader.get_lump_index
 
-        self.palettes = self.wad_data.get_lump_data(
+        self.palettes = self.reader.read_lump_records(
             reader_func = self.reader.read_palette,
             lump_index = self.get_lump_index("PLAYPAL"),
             num_bytes = 256 * 3
         )
         self.palette_index = 0
         self.palette = self.palettes[self.palette_index]
+        # (256, 3) lookup table to convert palette indices to RGB in bulk
+        self.palette_array = np.array(self.palette, dtype=np.uint8)
+
+        # colormaps: (34, 256) palette index -> palette index, from bright
+        # to dark, and the same as RGB lookup tables (34, 256, 3) so that
+        # a texel is lit with light_palettes[colormap, texel]
+        colormap_index = self.get_lump_index('COLORMAP')
+        if colormap_index is not None:
+            self.colormaps = np.frombuffer(
+                self.reader.read_lump(colormap_index), dtype=np.uint8
+            )[:34 * 256].reshape(34, 256).copy()
+        else:
+            self.colormaps = build_colormaps(self.palette_array)
+        self.light_palettes = self.palette_array[self.colormaps]
 
-        self.sprites = self.get_sprites(start_marker="S_START", end_marker="S_END")
-        self.status_bar = self.get_status_bar()
-        self.doomguy_faces = self.get_doomguy()
-        # texture patch names
-        self.p_names = self.wad_data.get_lump_data(
+        # names of the texture patches, textures, flats and sprites in the WAD
+        self.p_names = self.reader.read_lump_records(
             self.reader.read_string,
             self.get_lump_index('PNAMES'),
             num_bytes=8,
             header_length=4
         )
-
-        # texture patches
-        self.texture_patches = []
-        for p_name in self.p_names:
-            patch = Patch(self, p_name, is_sprite=False)
-            if patch.patch_index:
-                self.texture_patches.append(patch)
-        # wall textures
-        texture_maps = self.load_texture_maps(texture_lump_name='TEXTURE1')
+        self.texture_maps = {
+            tex_map.name: tex_map for tex_map in self.load_texture_maps(texture_lump_name='TEXTURE1')
+        }
         if self.get_lump_index('TEXTURE2'):
-            texture_maps += self.load_texture_maps(texture_lump_name='TEXTURE2')
+            self.texture_maps |= {
+                tex_map.name: tex_map for tex_map in self.load_texture_maps(texture_lump_name='TEXTURE2')
+            }
+        self.flat_lumps = {
+            lump['lump_name']: lump for lump in self.get_flat_lumps(start_marker='F_START', end_marker='F_END')
+        }
+        self.sprite_lumps = self.get_lump_range(start_marker="S_START", end_marker="S_END")
 
-        self.textures = {
-            tex_map.name: Texture(self, tex_map).image for tex_map in texture_maps
+        # textures, flats and sprites are decoded on first access, and the
+        # least recently used ones dropped to stay within the memory budget
+        self.lru = AssetLRU(ASSET_MEMORY_BUDGET)
+        self.texture_patches = LazyAssets(range(len(self.p_names)), self.load_texture_patch, self.lru)
+
+        # decoded patches (pixels, mask) and textures are mapped from the
+        # on-disk cache when there is one, built in full on the first run
+        self.cache = AssetCache(self.reader.wad_path) if ASSET_CACHE_ENABLED else None
+        if self.cache is not None and not self.cache.load():
+            self.cache.save(*self.decode_assets())
+            self.cache.load()
+
+        self.textures = LazyAssets(
+            list(self.texture_maps) + list(self.flat_lumps), self.load_texture, self.lru
+        )
+        self.sprites = LazyAssets(
+            [lump['lump_name'] for lump in self.sprite_lumps], self.load_sprite, self.lru
+        )
+        # sprite frames pre-scaled to all sizes, keyed by sprite name base,
+        # filled in by Thing.pre_cache and kept across map loads
+        self.scaled_sprites = {}
+        self.status_bar = self.load_patch_image('status_bar', 'STBAR')
+        self.doomguy_faces = {
+            lump['lump_name']: self.load_patch_image('doomguy_faces', lump['lump_name'])
+            for lump in self.get_doomguy_lumps()
         }
-        # flat textures
-        self.textures |= self.get_flats()
 
         # sky
         self.sky_id = 'F_SKY1'
         self.sky_tex_name = 'SKY1'
         self.sky_tex = self.textures[self.sky_tex_name]
 
+        # every sound in the WAD, decoded on first play
+        self.sounds = SoundBank(self.reader)
+
+    def preload(self, texture_names=(), sprite_names=()):
+        """
+        Decode the assets a map is known to use up front, rather than
+        on first use while playing.
+        """
+        self.textures.preload(texture_names)
+        self.sprites.preload(sprite_names)
+
+    def close(self):
+        self.lru.clear()
+        self.reader.close()
+
+    def decode_assets(self):
+        # decode everything in the WAD, to fill the on-disk cache
+        sprite_names = [lump['lump_name'] for lump in self.sprite_lumps]
+        face_names = [lump['lump_name'] for lump in self.get_doomguy_lumps()]
+        decoded = self.decode_patches(sprite_names + face_names + ['STBAR'] + self.p_names)
+        patches = {
+            'sprites': {name: decoded[name] for name in sprite_names},
+            'status_bar': {'STBAR': decoded['STBAR']},
+            'doomguy_faces': {name: decoded[name] for name in face_names},
+        }
+        # the textures are composed here from the decoded patches
+        texture_patches = [decoded[p_name] for p_name in self.p_names]
+        textures = {
+            name: Texture(self, tex_map, texture_patches).image
+            for name, tex_map in self.texture_maps.items()
+        }
+        textures |= self.get_flats()
+        return patches, textures
+
+    def decode_patches(self, names):
+        """
+        Decode many patches, split over ASSET_DECODE_WORKERS processes
+        that each map the WAD themselves, or in this process if it's 0.
+
+        Returns
+        =======
+            dict, name -> (pixels, mask), or None for missing lumps
+        """
+        names = list(dict.fromkeys(names))
+        if ASSET_DECODE_WORKERS <= 0 or len(names) < 2:
+            return {name: self.decode_patch(name) for name in names}
+        # several chunks per worker, to even out the load
+        num_chunks = min(len(names), ASSET_DECODE_WORKERS * 4)
+        chunks = [names[i::num_chunks] for i in range(num_chunks)]
+        decoded = {}
+        with ProcessPoolExecutor(max_workers=ASSET_DECODE_WORKERS) as pool:
+            for patches in pool.map(decode_patches_worker, repeat(self.reader.wad_path), chunks):
+                decoded |= patches
+        return decoded
+
+    def load_sprite(self, name):
+        return self.load_patch_image('sprites', name)
+
+    def load_patch_image(self, group, name):
+        if self.cache is not None:
+            pixels, mask = self.cache.patches[group][name]
+            return make_patch_image(self.palette_array, pixels, mask)
+        return Patch(self, name).image
+
+    def load_texture(self, name):
+        if self.cache is not None:
+            return self.cache.textures[name]
+        return self.decode_texture(name)
+
+    def load_texture_patch(self, p_name_index):
+        return self.decode_patch(self.p_names[p_name_index])
+
+    def decode_patch(self, name):
+        patch = Patch(self, name, is_sprite=False)
+        return (patch.pixels, patch.mask) if patch.patch_index else None
+
+    def decode_texture(self, name):
+        if name in self.flat_lumps:
+            return self.decode_flat(self.flat_lumps[name])
+        return Texture(self, self.texture_maps[name]).image
+
+    def decode_flat(self, flat_lump):
+        flat_size = self.FLAT_SIZE
+        flat_pixels = self.reader.read_lumps_stacked([flat_lump], flat_size * flat_size)
+        return np.ascontiguousarray(flat_pixels.reshape(flat_size, flat_size).T)
+
     def load_texture_maps(self, texture_lump_name):
         tex_idx = self.get_lump_index(texture_lump_name)
         offset = self.reader.directory[tex_idx]['lump_offset']
@@ -151,43 +311,36 @@ class AssetData:
             texture_maps.append(tex_map)
         return texture_maps
 
-    def get_sprites(self, start_marker="S_START", end_marker="S_END"):
+    def get_lump_range(self, start_marker, end_marker):
+        # lumps between two markers, not including the markers
         idx1 = self.get_lump_index(start_marker) + 1
         idx2 = self.get_lump_index(end_marker)
-        lumps_info = self.reader.directory[idx1:idx2]
-        sprites = {
-            lump['lump_name'] : Patch(self, lump['lump_name']).image for lump in lumps_info
-        }
-        return sprites
-    
-    def get_doomguy(self, start_marker="STFST01", end_marker="STFDEAD0"):
+        return self.reader.directory[idx1:idx2]
+
+    def get_doomguy_lumps(self, start_marker="STFST01", end_marker="STFDEAD0"):
         idx1 = self.get_lump_index(start_marker)
         idx2 = self.get_lump_index(end_marker) + 1
-        lumps_info = self.reader.directory[idx1:idx2]
-        faces = {
-            lump["lump_name"] : Patch(self, lump["lump_name"]).image for lump in lumps_info
-        }
-        return faces
-
-    def get_status_bar(self, name="STBAR"):
-        idx = self.get_lump_index(name)
-        lump_info = self.reader.directory[idx]
-        return Patch(self, lump_info["lump_name"]).image
-    
-    def get_flats(self, start_marker='F_START', end_marker='F_END'):
-        idx1 = self.get_lump_index(start_marker) + 1
-        idx2 = self.get_lump_index(end_marker)
-        flat_lumps = self.reader.directory[idx1: idx2]
+        return self.reader.directory[idx1:idx2]
+
+    def get_flat_lumps(self, start_marker='F_START', end_marker='F_END'):
+        # skip the F1_START etc. markers nested in the range
+        flat_size = self.FLAT_SIZE
+        return [
+            lump for lump in self.get_lump_range(start_marker, end_marker)
+            if lump['lump_size'] == flat_size * flat_size
+        ]
 
-        flats = {}
-        for flat_lump in flat_lumps:
-            offset = flat_lump['lump_offset']
-            size = flat_lump['lump_size']  # 64 x 64
+    def get_flats(self):
+        flat_lumps = list(self.flat_lumps.values())
+        flat_size = self.FLAT_SIZE
 
-            flat_data = []
-            for i in range(size):
-                flat_data.append(self.reader.read_1_byte(offset + i, byte_format='B'))
+        # all flats in one go: rows of the 64 x 64 flats are stored y-major,
+        # so swap to the (x, y) layout of the other textures -> (count, 64, 64)
+        flat_pixels = self.reader.read_lumps_stacked(flat_lumps, flat_size * flat_size)
+        flat_pixels = flat_pixels.reshape(-1, flat_size, flat_size).transpose(0, 2, 1)
+        flat_stack = np.ascontiguousarray(flat_pixels)
 
-            flat_name = flat_lump['lump_name']
-            flats[flat_name] = Flat(self, flat_data).image
-        return flats
\ No newline at end of file
+        flats = {
+            flat_lump['lump_name']: flat_stack[i] for i, flat_lump in enumerate(flat_lumps)
+        }
+        return flats
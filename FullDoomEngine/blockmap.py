@@ -0,0 +1,161 @@
+import math
+
+import numpy as np
+
+BLOCK_SIZE = 128  # map units per block side (MAPBLOCKUNITS)
+BLOCK_LIST_END = 0xFFFF
+
+
+class Blockmap:
+    """
+    Grid of BLOCK_SIZE square blocks laid over the map, each listing the
+    linedefs that cross it: the broadphase Doom itself uses for collision
+    and line of sight/fire checks.
+
+    The lists are stored compressed, the linedefs of block (bx, by) being
+    block_linedefs[block_offsets[b]: block_offsets[b + 1]] with
+    b = by * columns + bx.
+    """
+    def __init__(self, origin_x, origin_y, columns, rows, block_offsets, block_linedefs):
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.columns = columns
+        self.rows = rows
+        self.block_offsets = block_offsets
+        self.block_linedefs = block_linedefs
+
+    @classmethod
+    def from_lump(cls, data):
+        """
+        Parameters
+        ==========
+            data: contents of a BLOCKMAP lump. It holds a header (origin x,
+            origin y, columns, rows), one offset per block (in 16 bit words
+            from the start of the lump) and the block lists, each one
+            starting with a 0 and ending with 0xFFFF.
+        """
+        words = np.frombuffer(data, dtype='<u2', count=len(data) // 2)
+        origin_x, origin_y = words[:2].view('<i2').tolist()
+        columns, rows = words[2:4].tolist()
+        num_blocks = columns * rows
+        starts = words[4: 4 + num_blocks].astype(np.int64)
+
+        # end of each list: the first 0xFFFF at or after its start, only
+        # looked for past the offsets so the header can't be mistaken for one
+        list_ends = np.flatnonzero(words[4 + num_blocks:] == BLOCK_LIST_END) + 4 + num_blocks
+        ends = list_ends[np.searchsorted(list_ends, starts)]
+        # skip the leading 0 of each list
+        starts += words[starts] == 0
+
+        counts = ends - starts
+        block_offsets = np.zeros(num_blocks + 1, dtype=np.int64)
+        np.cumsum(counts, out=block_offsets[1:])
+        # gather all the lists with a single fancy index
+        positions = np.repeat(starts - block_offsets[:-1], counts) + np.arange(block_offsets[-1])
+        block_linedefs = words[positions].astype(np.int32)
+        return cls(origin_x, origin_y, columns, rows, block_offsets, block_linedefs)
+
+    @classmethod
+    def build(cls, map_arrays):
+        # for maps without a BLOCKMAP lump: walk each linedef through the grid
+        vertexes = map_arrays.vertexes
+        origin_x = int(vertexes['x'].min())
+        origin_y = int(vertexes['y'].min())
+        columns = (int(vertexes['x'].max()) - origin_x) // BLOCK_SIZE + 1
+        rows = (int(vertexes['y'].max()) - origin_y) // BLOCK_SIZE + 1
+        blockmap = cls(origin_x, origin_y, columns, rows, None, None)
+
+        linedefs = map_arrays.linedefs
+        x1 = vertexes['x'][linedefs['start_vertex_id']].tolist()
+        y1 = vertexes['y'][linedefs['start_vertex_id']].tolist()
+        x2 = vertexes['x'][linedefs['end_vertex_id']].tolist()
+        y2 = vertexes['y'][linedefs['end_vertex_id']].tolist()
+        blocks, line_ids = [], []
+        for line_id in range(len(linedefs)):
+            for bx, by in blockmap.blocks_along_line(x1[line_id], y1[line_id], x2[line_id], y2[line_id]):
+                blocks.append(by * columns + bx)
+                line_ids.append(line_id)
+
+        # group by block, keeping the linedefs of each block in order
+        blocks = np.array(blocks, dtype=np.int64)
+        order = np.argsort(blocks, kind='stable')
+        blockmap.block_linedefs = np.array(line_ids, dtype=np.int32)[order]
+        blockmap.block_offsets = np.zeros(columns * rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(blocks, minlength=columns * rows), out=blockmap.block_offsets[1:])
+        return blockmap
+
+    def block_coords(self, x, y):
+        return (
+            math.floor((x - self.origin_x) / BLOCK_SIZE),
+            math.floor((y - self.origin_y) / BLOCK_SIZE),
+        )
+
+    def is_in_grid(self, bx, by):
+        return 0 <= bx < self.columns and 0 <= by < self.rows
+
+    def linedefs_in_block(self, bx, by):
+        if not self.is_in_grid(bx, by):
+            return
+        block = by * self.columns + bx
+        yield from self.block_linedefs[
+            self.block_offsets[block]: self.block_offsets[block + 1]
+        ].tolist()
+
+    def blocks_along_line(self, x1, y1, x2, y2):
+        """
+        Blocks crossed by the line from (x1, y1) to (x2, y2), in order
+        from its start, skipping those outside the grid.
+        """
+        bx, by = self.block_coords(x1, y1)
+        end_bx, end_by = self.block_coords(x2, y2)
+        dx, dy = x2 - x1, y2 - y1
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # distance along the line (0 at the start, 1 at the end) to the
+        # next vertical and horizontal block boundary, and between them
+        if dx:
+            boundary_x = self.origin_x + (bx + (step_x > 0)) * BLOCK_SIZE
+            t_max_x, t_delta_x = (boundary_x - x1) / dx, BLOCK_SIZE / abs(dx)
+        else:
+            t_max_x = t_delta_x = math.inf
+        if dy:
+            boundary_y = self.origin_y + (by + (step_y > 0)) * BLOCK_SIZE
+            t_max_y, t_delta_y = (boundary_y - y1) / dy, BLOCK_SIZE / abs(dy)
+        else:
+            t_max_y = t_delta_y = math.inf
+
+        for _ in range(abs(end_bx - bx) + abs(end_by - by) + 1):
+            if self.is_in_grid(bx, by):
+                yield bx, by
+            if t_max_x < t_max_y:
+                t_max_x += t_delta_x
+                bx += step_x
+            else:
+                t_max_y += t_delta_y
+                by += step_y
+
+    def linedefs_along_line(self, x1, y1, x2, y2):
+        # each linedef in a block crossed by the line, once, nearest blocks first
+        seen = set()
+        for bx, by in self.blocks_along_line(x1, y1, x2, y2):
+            for line_id in self.linedefs_in_block(bx, by):
+                if line_id not in seen:
+                    seen.add(line_id)
+                    yield line_id
+
+    def linedefs_in_box(self, left, bottom, right, top):
+        # each linedef in a block overlapping the box, once
+        bx1, by1 = self.block_coords(left, bottom)
+        bx2, by2 = self.block_coords(right, top)
+        bx1, by1 = max(bx1, 0), max(by1, 0)
+        bx2, by2 = min(bx2, self.columns - 1), min(by2, self.rows - 1)
+        seen = set()
+        for by in range(by1, by2 + 1):
+            for bx in range(bx1, bx2 + 1):
+                for line_id in self.linedefs_in_block(bx, by):
+                    if line_id not in seen:
+                        seen.add(line_id)
+                        yield line_id
+
+    def linedefs_in_circle(self, x, y, radius):
+        return self.linedefs_in_box(x - radius, y - radius, x + radius, y + radius)
@@ -1,5 +1,20 @@
+from numba import njit
+import numpy as np
 from pygame.math import Vector2 as vec2
 from doomsettings import *
+from viewport import VIEW_H_WIDTH, VIEW_SCREEN_DIST, VIEW_WIDTH
+
+
+@njit
+def angle_to_x(angle, view):
+    # view is the Viewport params
+    screen_dist, h_width = view[VIEW_SCREEN_DIST], view[VIEW_H_WIDTH]
+    if angle > 0:
+        x = screen_dist - math.tan(math.radians(angle)) * h_width
+    else:
+        x = -math.tan(math.radians(angle)) * h_width + screen_dist
+    return int(x)
+
 
 class BSP:
     SUB_SECTOR_IDENTIFIER = 0x8000
@@ -11,27 +26,141 @@ class BSP:
         self.segments = engine.wad_data.segments
         self.root_node_id = len(self.nodes) -1 
         self.is_traverse_bsp = True
+        map_arrays = engine.wad_data.map_arrays
+        self.sub_sector_sector = map_arrays.sub_sector_sector.tolist()
+        self.vertex_x = map_arrays.vertexes['x'].astype(np.float64)
+        self.vertex_y = map_arrays.vertexes['y'].astype(np.float64)
+        self.project_vertices()
+        if BSP_ITERATIVE:
+            self.pack_arrays(map_arrays)
+        # potentially visible set of the player's sub sector this frame
+        self.pvs_row = None
+        self.set_pvs(engine.wad_data.pvs)
+
+    def set_pvs(self, pvs):
+        # None turns PVS culling off, e.g. until the map's PVS has been built
+        self.pvs = pvs
+        nodes = self.engine.wad_data.map_arrays.nodes
+        if pvs is not None:
+            self.node_pvs_masks = pvs.subtree_masks(nodes, self.root_node_id)
+            # the subtree masks as words for traverse_bsp
+            self.node_pvs_words = pvs.to_words(self.node_pvs_masks)
+        else:
+            self.node_pvs_words = np.zeros((len(nodes), 0), dtype=np.uint64)
+
+    def pack_arrays(self, map_arrays):
+        # nodes, sub sectors and seg vertices as flat arrays for traverse_bsp
+        nodes = map_arrays.nodes
+        self.node_partitions = np.stack([
+            nodes[name] for name in ('x_partition', 'y_partition', 'dx_partition', 'dy_partition')
+        ], axis=1).astype(np.float64)
+        # [node, side (0 front, 1 back), (top, bottom, left, right)]
+        self.node_bboxes = np.stack([
+            np.stack([nodes[f'{side}_{edge}'] for edge in ('top', 'bottom', 'left', 'right')], axis=1)
+            for side in ('front', 'back')
+        ], axis=1).astype(np.float64)
+        self.node_children = np.stack(
+            [nodes['front_child_id'], nodes['back_child_id']], axis=1
+        ).astype(np.int64)
+        sub_sectors = map_arrays.sub_sectors
+        self.sub_sector_segs = np.stack(
+            [sub_sectors['first_seg_id'], sub_sectors['seg_count']], axis=1
+        ).astype(np.int64)
+        # [seg, (start, end)] vertex ids
+        self.seg_vertex_ids = np.stack(
+            [map_arrays.seg_start_vertex, map_arrays.seg_end_vertex], axis=1
+        ).astype(np.int64)
+
+        # preallocated, so that a traversal allocates nothing. The stack
+        # holds at most one pending far child per level of the tree, plus
+        # the end of each far subtree being walked. There is at most one
+        # entry per seg and one per far subtree (bbox entries).
+        num_segs = len(map_arrays.segments)
+        self.node_stack = np.empty(2 * len(nodes) + 1, dtype=np.int64)
+        num_entries = num_segs + len(nodes)
+        self.visible_segs = np.empty(num_entries, dtype=np.int64)
+        self.visible_sub_sectors = np.empty(num_entries, dtype=np.int64)
+        self.visible_x1 = np.empty(num_entries, dtype=np.int64)
+        self.visible_x2 = np.empty(num_entries, dtype=np.int64)
+        self.visible_rw_angle1 = np.empty(num_entries, dtype=np.float64)
+        self.visible_skip = np.empty(num_entries, dtype=np.int64)
+        # no words at all when the PVS is off
+        self.no_pvs_row = np.zeros(0, dtype=np.uint64)
 
     @staticmethod 
     def norm(angle):
         return angle % 360
 
-    @staticmethod
-    def angle_to_x(angle):
-        if angle > 0:
-            x = SCREEN_DIST - math.tan(math.radians(angle)) * H_WIDTH
-        else:
-            x = -math.tan(math.radians(angle)) * H_WIDTH + SCREEN_DIST
-        return int(x)
+    angle_to_x = staticmethod(angle_to_x)
 
     def update(self):
         self.is_traverse_bsp = True
-        self.render_bsp_node(node_id=self.root_node_id)
-        pass
+        self.project_vertices()
+        if self.pvs is None and (pvs := self.engine.wad_data.update_pvs()) is not None:
+            self.set_pvs(pvs)
+        if self.pvs is not None:
+            self.pvs_row = self.pvs.rows[self.locate(self.player)]
+        if BSP_ITERATIVE:
+            self.render_bsp_arrays()
+        else:
+            self.render_bsp_node(node_id=self.root_node_id)
+
+    def project_vertices(self):
+        # angle (degrees) and distance of every vertex from the player, in
+        # one pass per frame, for the segs to look up rather than recompute
+        dx = self.vertex_x - self.player.pos.x
+        dy = self.vertex_y - self.player.pos.y
+        self.vertex_angles = np.degrees(np.arctan2(dy, dx))
+        self.vertex_dists = np.hypot(dx, dy)
+
+    def render_bsp_arrays(self):
+        # same visiting order and seg clipping as render_bsp_node, but the
+        # tree is walked by traverse_bsp, which returns the candidate segs
+        # front to back along with their screen columns
+        if self.pvs is not None:
+            pvs_row = self.pvs.words[self.player.sub_sector_id]
+        else:
+            pvs_row = self.no_pvs_row
+        num_visible = traverse_bsp(
+            self.node_partitions, self.node_bboxes, self.node_children,
+            self.sub_sector_segs, self.seg_vertex_ids, self.vertex_angles, self.root_node_id,
+            self.player.pos.x, self.player.pos.y, self.player.angle,
+            self.engine.viewport.params, self.node_pvs_words, pvs_row, OCCLUSION_CULLING, self.node_stack,
+            self.visible_segs, self.visible_sub_sectors,
+            self.visible_x1, self.visible_x2, self.visible_rw_angle1, self.visible_skip,
+        )
+        seg_ids = self.visible_segs[:num_visible].tolist()
+        sub_sector_ids = self.visible_sub_sectors[:num_visible].tolist()
+        x1s = self.visible_x1[:num_visible].tolist()
+        x2s = self.visible_x2[:num_visible].tolist()
+        rw_angle1s = self.visible_rw_angle1[:num_visible].tolist()
+        skips = self.visible_skip[:num_visible].tolist()
+        seg_handler = self.engine.seg_handler
+        last_sub_sector_id = -1
+        i = 0
+        while i < num_visible:
+            seg_id, sub_sector_id = seg_ids[i], sub_sector_ids[i]
+            if seg_id < 0:
+                # bbox of a far subtree
+                if seg_handler.is_range_occluded(x1s[i], x2s[i]):
+                    i = skips[i]
+                else:
+                    i += 1
+                continue
+            # the recursive walk only stops between sub sectors
+            if sub_sector_id != last_sub_sector_id:
+                if not self.is_traverse_bsp:
+                    break
+                last_sub_sector_id = sub_sector_id
+            seg = self.segments[seg_id]
+            seg_handler.classify_segment(seg, x1s[i], x2s[i], rw_angle1s[i])
+            if self.engine.map_mode:
+                self.engine.map_renderer.draw_seg(seg, sub_sector_id)
+            i += 1
 
-    def add_segment_to_fov(self, vertex1, vertex2):
-        angle1 = self.point_to_angle(vertex1)
-        angle2 = self.point_to_angle(vertex2)
+    def add_segment_to_fov(self, vertex1_id, vertex2_id):
+        angle1 = self.vertex_angles[vertex1_id]
+        angle2 = self.vertex_angles[vertex2_id]
         span = self.norm(angle1 - angle2)
         # back face culling
         if span >= 180:
@@ -51,8 +180,9 @@ class BSP:
             if span2 >= span + FOV:
                 return False
             angle2 = -H_FOV
-        x1 = self.angle_to_x(angle1)
-        x2 = self.angle_to_x(angle2)
+        view = self.engine.viewport.params
+        x1 = self.angle_to_x(angle1, view)
+        x2 = self.angle_to_x(angle2, view)
         return x1, x2, rw_angle1
 
 
@@ -95,6 +225,17 @@ class BSP:
             return True
         return False
 
+    def is_bbox_occluded(self, bbox):
+        # whether the walls drawn so far hide every column the box spans
+        if not OCCLUSION_CULLING:
+            return False
+        x1, x2 = bbox_x_range(
+            bbox.top, bbox.bottom, bbox.left, bbox.right,
+            self.player.pos.x, self.player.pos.y, self.player.angle,
+            self.engine.viewport.params,
+        )
+        return self.engine.seg_handler.is_range_occluded(x1, x2)
+
     def point_to_angle(self, vertex):
         delta = vertex - self.player.pos
         return math.degrees(math.atan2(delta.y, delta.x))
@@ -103,15 +244,25 @@ class BSP:
         sub_sector = self.sub_sectors[sub_sector_id]
         for i in range(sub_sector.seg_count):
             seg = self.segments[sub_sector.first_seg_id + i]
-            if result:= self.add_segment_to_fov(seg.start_vertex, seg.end_vertex):
+            if result:= self.add_segment_to_fov(seg.start_vertex_id, seg.end_vertex_id):
                 self.engine.seg_handler.classify_segment(seg, *result)
                 if self.engine.map_mode:
                     self.engine.map_renderer.draw_seg(seg, sub_sector_id)
 
 
+    def is_in_pvs(self, node_id):
+        # whether any sub sector under node_id may be seen from the player's
+        if self.pvs_row is None:
+            return True
+        if node_id >= self.SUB_SECTOR_IDENTIFIER:
+            return (self.pvs_row >> (node_id - self.SUB_SECTOR_IDENTIFIER)) & 1 == 1
+        return self.node_pvs_masks[node_id] & self.pvs_row != 0
+
     def render_bsp_node(self, node_id):
         if not self.is_traverse_bsp:
             return
+        if not self.is_in_pvs(node_id):
+            return
         if node_id >= self.SUB_SECTOR_IDENTIFIER:
             sub_sector_id = node_id - self.SUB_SECTOR_IDENTIFIER
             self.render_sub_sector(sub_sector_id)
@@ -120,11 +271,11 @@ class BSP:
         is_on_back = self.is_on_back_side(node)
         if is_on_back:
             self.render_bsp_node(node.back_child_id)
-            if self.check_bbox(node.bbox['front']):
+            if self.check_bbox(node.bbox['front']) and not self.is_bbox_occluded(node.bbox['front']):
                 self.render_bsp_node(node.front_child_id)
         else:
             self.render_bsp_node(node.front_child_id)
-            if self.check_bbox(node.bbox["back"]):
+            if self.check_bbox(node.bbox["back"]) and not self.is_bbox_occluded(node.bbox['back']):
                 self.render_bsp_node(node.back_child_id)
 
 
@@ -135,7 +286,7 @@ class BSP:
         dy = position.y - node.y_partition
         return dx * node.dy_partition - dy * node.dx_partition <= 0
 
-    def get_sub_sector_height(self, position=None):
+    def get_sub_sector_id(self, position=None):
         sub_sector_id = self.root_node_id
         while not sub_sector_id >= self.SUB_SECTOR_IDENTIFIER:
             node = self.nodes[sub_sector_id]
@@ -145,28 +296,76 @@ class BSP:
                 sub_sector_id = self.nodes[sub_sector_id].back_child_id
             else:
                 sub_sector_id = self.nodes[sub_sector_id].front_child_id
+        return sub_sector_id - self.SUB_SECTOR_IDENTIFIER
+
+    def get_sector_id(self, position=None):
+        return self.sub_sector_sector[self.get_sub_sector_id(position)]
 
-        sub_sector = self.sub_sectors[sub_sector_id - self.SUB_SECTOR_IDENTIFIER]
+    def locate(self, obj):
+        """
+        Sub sector containing obj.pos, cached on obj (as sub_sector_id and
+        located_pos) so that the tree is only walked again once it moves.
+        """
+        pos = obj.pos.x, obj.pos.y
+        if pos != obj.located_pos:
+            obj.sub_sector_id = self.get_sub_sector_id(obj.pos)
+            obj.located_pos = pos
+        return obj.sub_sector_id
+
+    def get_floor_height(self, sub_sector_id):
+        sub_sector = self.sub_sectors[sub_sector_id]
         seg = self.segments[sub_sector.first_seg_id]
         return seg.front_sector.floor_height
+
+    def get_sub_sector_height(self, position=None):
+        return self.get_floor_height(self.get_sub_sector_id(position))
     
     ## collision of player with walls
     def trace_collision(self, start_pos, end_pos):
-        collisions =  self._trace_node(self.root_node_id, end_pos)
-        return collisions
-    
-    def _trace_node(self, node_id, end_pos):
-        if node_id >= self.SUB_SECTOR_IDENTIFIER:
-            return self._check_subsector(node_id - self.SUB_SECTOR_IDENTIFIER, end_pos)
+        """
+        Segs within the player's radius of end_pos, nearest sub sectors
+        first. Only the subtrees whose bounding box overlaps the box swept
+        by the player circle from start_pos to end_pos are visited.
+        """
+        radius = self.player.size
+        left = min(start_pos.x, end_pos.x) - radius
+        right = max(start_pos.x, end_pos.x) + radius
+        bottom = min(start_pos.y, end_pos.y) - radius
+        top = max(start_pos.y, end_pos.y) + radius
+        if SPATIAL_INDEX == 'blockmap':
+            return self._trace_blockmap(end_pos, left, bottom, right, top)
 
-        node = self.nodes[node_id]
-        side = self.is_on_back_side(node, end_pos)
+        collisions = []
+        node_stack = [self.root_node_id]
+        while node_stack:
+            node_id = node_stack.pop()
+            if node_id >= self.SUB_SECTOR_IDENTIFIER:
+                collisions += self._check_subsector(node_id - self.SUB_SECTOR_IDENTIFIER, end_pos)
+                continue
+            node = self.nodes[node_id]
+            if self.is_on_back_side(node, end_pos):
+                near, far = node.back_child_id, node.front_child_id
+                near_bbox, far_bbox = node.bbox['back'], node.bbox['front']
+            else:
+                near, far = node.front_child_id, node.back_child_id
+                near_bbox, far_bbox = node.bbox['front'], node.bbox['back']
+            # pushed far first, so that the near side is popped first
+            for child_id, bbox in ((far, far_bbox), (near, near_bbox)):
+                if (bbox.left <= right and bbox.right >= left
+                        and bbox.bottom <= top and bbox.top >= bottom):
+                    node_stack.append(child_id)
+        return collisions
 
-        front = self._trace_node(node.front_child_id, end_pos)
-        back = self._trace_node(node.back_child_id, end_pos)
+    def _trace_blockmap(self, end, left, bottom, right, top):
+        # the same query answered from the blockmap blocks under the swept box
+        linedefs = self.engine.wad_data.linedefs
+        collisions = []
+        for line_id in self.engine.wad_data.blockmap.linedefs_in_box(left, bottom, right, top):
+            for seg in linedefs[line_id].segs:
+                if circle_segment_collision(end, seg.start_vertex, seg.end_vertex, self.player.size):
+                    collisions.append(seg)
+        return collisions
 
-        return front + back
-    
     def _check_subsector(self, sub_sector_id, end):
         sub_sector = self.sub_sectors[sub_sector_id]
         collisions = []
@@ -201,3 +400,219 @@ def circle_segment_collision(P, A, B, radius):
     dist_squared = (P - D).length_squared()
 
     return dist_squared <= radius**2
+
+
+@njit
+def bbox_in_fov(top, bottom, left, right, px, py, player_angle):
+    # check_bbox without the vec2s: the sides of the box facing the
+    # player, each as (x1, y1, x2, y2), a lone side is repeated to keep
+    # the tuple type fixed
+    if px < left:
+        if py > top:
+            sides = ((left, top, left, bottom), (right, top, left, top))
+        elif py < bottom:
+            sides = ((left, top, left, bottom), (left, bottom, right, bottom))
+        else:
+            sides = ((left, top, left, bottom), (left, top, left, bottom))
+    elif px > right:
+        if py > top:
+            sides = ((right, top, left, top), (right, bottom, right, top))
+        elif py < bottom:
+            sides = ((left, bottom, right, bottom), (right, bottom, right, top))
+        else:
+            sides = ((right, bottom, right, top), (right, bottom, right, top))
+    else:
+        if py > top:
+            sides = ((right, top, left, top), (right, top, left, top))
+        elif py < bottom:
+            sides = ((left, bottom, right, bottom), (left, bottom, right, bottom))
+        else:
+            return True
+    for x1, y1, x2, y2 in sides:
+        angle1 = math.degrees(math.atan2(y1 - py, x1 - px))
+        angle2 = math.degrees(math.atan2(y2 - py, x2 - px))
+        span = (angle1 - angle2) % 360
+        angle1 -= player_angle
+        span1 = (angle1 + H_FOV) % 360
+        if span1 > FOV:
+            if span1 >= span + FOV:
+                continue
+        return True
+    return False
+
+
+# flags a stack entry of traverse_bsp as the far child of a node, stored
+# as FAR_SUBTREE + 2 * node id + side
+FAR_SUBTREE = 1 << 30
+
+
+@njit
+def bbox_x_range(top, bottom, left, right, px, py, player_angle, view):
+    """
+    Screen columns [x1, x2) that a node's bounding box can cover, from the
+    two corners bounding it as seen from the player, as in R_CheckBBox.
+    x1 == x2 when it is out of view.
+    """
+    # which of the 9 areas around the box the player is in
+    if px <= left:
+        box_x = 0
+    elif px < right:
+        box_x = 1
+    else:
+        box_x = 2
+    if py >= top:
+        box_y = 0
+    elif py > bottom:
+        box_y = 1
+    else:
+        box_y = 2
+    if box_x == 1 and box_y == 1:
+        # inside the box
+        return 0, int(view[VIEW_WIDTH])
+    # the corner seen furthest left first
+    if box_y == 0:
+        if box_x == 0:
+            x1, y1, x2, y2 = right, top, left, bottom
+        elif box_x == 1:
+            x1, y1, x2, y2 = right, top, left, top
+        else:
+            x1, y1, x2, y2 = right, bottom, left, top
+    elif box_y == 1:
+        if box_x == 0:
+            x1, y1, x2, y2 = left, top, left, bottom
+        else:
+            x1, y1, x2, y2 = right, bottom, right, top
+    else:
+        if box_x == 0:
+            x1, y1, x2, y2 = left, top, right, bottom
+        elif box_x == 1:
+            x1, y1, x2, y2 = left, bottom, right, bottom
+        else:
+            x1, y1, x2, y2 = left, bottom, right, top
+
+    angle1 = math.degrees(math.atan2(y1 - py, x1 - px))
+    angle2 = math.degrees(math.atan2(y2 - py, x2 - px))
+    span = (angle1 - angle2) % 360
+    if span >= 180:
+        return 0, int(view[VIEW_WIDTH])
+    angle1 -= player_angle
+    angle2 -= player_angle
+    span1 = (angle1 + H_FOV) % 360
+    if span1 > FOV:
+        if span1 >= span + FOV:
+            return 0, 0
+        angle1 = H_FOV
+    span2 = (H_FOV - angle2) % 360
+    if span2 > FOV:
+        if span2 >= span + FOV:
+            return 0, 0
+        angle2 = -H_FOV
+    return angle_to_x(angle1, view), angle_to_x(angle2, view)
+
+
+@njit
+def node_in_pvs(node_id, node_pvs_words, pvs_row):
+    if node_id >= 0x8000:
+        sub_sector_id = node_id - 0x8000
+        return (pvs_row[sub_sector_id >> 6] >> np.uint64(sub_sector_id & 63)) & np.uint64(1) != 0
+    for word in range(len(pvs_row)):
+        if node_pvs_words[node_id, word] & pvs_row[word]:
+            return True
+    return False
+
+
+@njit
+def traverse_bsp(node_partitions, node_bboxes, node_children, sub_sector_segs,
+                 seg_vertex_ids, vertex_angles, root_node_id, px, py, player_angle, view,
+                 node_pvs_words, pvs_row, use_occlusion, node_stack,
+                 out_segs, out_sub_sectors, out_x1, out_x2, out_rw_angle1, out_skip):
+    """
+    Front to back walk of the BSP tree with an explicit stack, doing
+    what add_segment_to_fov and check_bbox do with scalars only. Subtrees
+    with no sub sector in pvs_row (the player's row of the PVS, as uint64
+    words) are skipped, unless pvs_row is empty. Screen columns are
+    those of the framebuffer the Viewport params view describe.
+
+    With use_occlusion, each far subtree is preceded by an entry with seg
+    -1, the screen columns of its bounding box in out_x1, out_x2 and the
+    index just past the subtree's segs in out_skip, so the caller can
+    skip it if walls drawn in the meantime hide those columns.
+
+    Returns
+    =======
+        number of segs written to the out_ arrays, in drawing order
+    """
+    num_visible = 0
+    stack_size = 1
+    node_stack[0] = root_node_id
+    while stack_size:
+        stack_size -= 1
+        node_id = node_stack[stack_size]
+        if node_id < 0:
+            # end of the far subtree of the bbox entry -node_id - 1
+            out_skip[-node_id - 1] = num_visible
+            continue
+        if node_id >= FAR_SUBTREE:
+            # a far subtree (only flagged with use_occlusion)
+            node_id -= FAR_SUBTREE
+            parent_id, far = node_id // 2, node_id % 2
+            node_id = node_children[parent_id, far]
+            top, bottom, left, right = node_bboxes[parent_id, far]
+            x1, x2 = bbox_x_range(top, bottom, left, right, px, py, player_angle, view)
+            out_segs[num_visible] = -1
+            out_sub_sectors[num_visible] = -1
+            out_x1[num_visible] = x1
+            out_x2[num_visible] = x2
+            node_stack[stack_size] = -num_visible - 1
+            stack_size += 1
+            num_visible += 1
+        if len(pvs_row) and not node_in_pvs(node_id, node_pvs_words, pvs_row):
+            continue
+
+        if node_id >= 0x8000:  # SUB_SECTOR_IDENTIFIER
+            sub_sector_id = node_id - 0x8000
+            first_seg_id = sub_sector_segs[sub_sector_id, 0]
+            for seg_id in range(first_seg_id, first_seg_id + sub_sector_segs[sub_sector_id, 1]):
+                angle1 = vertex_angles[seg_vertex_ids[seg_id, 0]]
+                angle2 = vertex_angles[seg_vertex_ids[seg_id, 1]]
+                span = (angle1 - angle2) % 360
+                # back face culling
+                if span >= 180:
+                    continue
+                rw_angle1 = angle1
+                angle1 -= player_angle
+                angle2 -= player_angle
+                span1 = (angle1 + H_FOV) % 360
+                if span1 > FOV:
+                    if span1 >= span + FOV:
+                        continue
+                    angle1 = H_FOV
+                span2 = (H_FOV - angle2) % 360
+                if span2 > FOV:
+                    if span2 >= span + FOV:
+                        continue
+                    angle2 = -H_FOV
+                out_segs[num_visible] = seg_id
+                out_sub_sectors[num_visible] = sub_sector_id
+                out_x1[num_visible] = angle_to_x(angle1, view)
+                out_x2[num_visible] = angle_to_x(angle2, view)
+                out_rw_angle1[num_visible] = rw_angle1
+                num_visible += 1
+            continue
+
+        x, y, dx, dy = node_partitions[node_id]
+        is_on_back = (px - x) * dy - (py - y) * dx <= 0
+        near = 1 if is_on_back else 0
+        far = 1 - near
+        # the far side's bbox only depends on the player, so it can be
+        # checked now rather than after the near side has been walked
+        top, bottom, left, right = node_bboxes[node_id, far]
+        if bbox_in_fov(top, bottom, left, right, px, py, player_angle):
+            if use_occlusion:
+                node_stack[stack_size] = FAR_SUBTREE + 2 * node_id + far
+            else:
+                node_stack[stack_size] = node_children[node_id, far]
+            stack_size += 1
+        node_stack[stack_size] = node_children[node_id, near]
+        stack_size += 1
+    return num_visible
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 
 class Thing:
     __slots__ = [
@@ -54,7 +57,7 @@ class Linedef:
         'front_sidedef_id',
         'back_sidedef_id'
     ]
-    __slots__ += ["front_sidedef", "back_sidedef"]
+    __slots__ += ["front_sidedef", "back_sidedef", "segs"]
 
 class Sector:
     # 26 bytes
@@ -124,4 +127,77 @@ class TextureMap:
         'column_dir',  # unused
         'patch_count',
         'patch_maps',
-    ]
\ No newline at end of file
+    ]
+
+
+# structured dtypes matching the on-disk layout of each map lump,
+# so that a whole lump can be decoded with a single np.frombuffer call
+VERTEX_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2')])  # 4 bytes
+
+LINEDEF_DTYPE = np.dtype([  # 14 bytes
+    ('start_vertex_id', '<u2'),
+    ('end_vertex_id', '<u2'),
+    ('flags', '<u2'),
+    ('line_type', '<u2'),
+    ('sector_tag', '<u2'),
+    ('front_sidedef_id', '<u2'),
+    ('back_sidedef_id', '<u2'),
+])
+
+SIDEDEF_DTYPE = np.dtype([  # 30 bytes
+    ('x_offset', '<i2'),
+    ('y_offset', '<i2'),
+    ('upper_texture', 'S8'),
+    ('lower_texture', 'S8'),
+    ('middle_texture', 'S8'),
+    ('sector_id', '<u2'),
+])
+
+SEG_DTYPE = np.dtype([  # 12 bytes
+    ('start_vertex_id', '<u2'),
+    ('end_vertex_id', '<u2'),
+    ('angle', '<i2'),
+    ('linedef_id', '<u2'),
+    ('direction', '<i2'),
+    ('offset', '<i2'),
+])
+
+SUB_SECTOR_DTYPE = np.dtype([  # 4 bytes
+    ('seg_count', '<u2'),
+    ('first_seg_id', '<u2'),
+])
+
+NODE_DTYPE = np.dtype([  # 28 bytes
+    ('x_partition', '<i2'),
+    ('y_partition', '<i2'),
+    ('dx_partition', '<i2'),
+    ('dy_partition', '<i2'),
+    ('front_top', '<i2'),
+    ('front_bottom', '<i2'),
+    ('front_left', '<i2'),
+    ('front_right', '<i2'),
+    ('back_top', '<i2'),
+    ('back_bottom', '<i2'),
+    ('back_left', '<i2'),
+    ('back_right', '<i2'),
+    ('front_child_id', '<u2'),
+    ('back_child_id', '<u2'),
+])
+
+SECTOR_DTYPE = np.dtype([  # 26 bytes
+    ('floor_height', '<i2'),
+    ('ceil_height', '<i2'),
+    ('floor_texture', 'S8'),
+    ('ceil_texture', 'S8'),
+    ('light_level', '<u2'),
+    ('type', '<u2'),
+    ('tag', '<u2'),
+])
+
+THING_DTYPE = np.dtype([  # 10 bytes
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('angle', '<u2'),
+    ('type', '<u2'),
+    ('flags', '<u2'),
+])
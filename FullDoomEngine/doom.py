@@ -1,15 +1,18 @@
 import sys
+import numpy as np
 import pygame as pg
 
-from wad_data import WADData
+from wad_data import MapPrefetcher, WADData, get_next_map_name
 from map_renderer import MapRenderer
 from player import Player
 from bsp import BSP
 from object_handler import ObjectHandler
 from raycasting import RayCasting
 from seg_handler import SegHandler
+from sight import Sight
 from sounds import SoundEffect
 from view_renderer import ViewRenderer
+from viewport import ResolutionGovernor, Viewport
 
 from events import *
 from doomsettings import *
@@ -21,17 +24,29 @@ class DoomEngine:
         self.debug_mode = False
         self.wad_path = wad_path
         self.screen = pg.display.set_mode(WIN_RES, pg.SCALED)
-        self.framebuffer = pg.surfarray.array3d(self.screen)
+        # the 3D view is rendered at RENDER_RES and scaled to the window
+        self.next_viewport = None
+        self.set_viewport(Viewport(*RENDER_RES, LOW_DETAIL))
+        self.governor = None
+        if TARGET_FRAME_TIME is not None:
+            self.governor = ResolutionGovernor(self, TARGET_FRAME_TIME)
         pg.mouse.set_visible(False)
         self.clock = pg.time.Clock()
         self.running = True
         self.dt = 1 / 60
+        self.map_prefetcher = MapPrefetcher(self)
 
     def load(self, map_name="E1M1", difficulty=1):
-        self.wad_data = WADData(self, map_name)
+        # use the map parsed in the background if it was prefetched
+        self.wad_data = self.map_prefetcher.get(map_name) or WADData(self, map_name)
+        self.wad_data.asset_data.preload(
+            texture_names=self.wad_data.get_texture_names(),
+            sprite_names=WEAPON_SPRITES.values(),
+        )
         self.map_renderer = MapRenderer(self)
         self.player = Player(self)
         self.bsp = BSP(self)
+        self.sight = Sight(self)
         self.raycaster = RayCasting(self)
         self.seg_handler = SegHandler(self)
         self.view_renderer = ViewRenderer(self)
@@ -40,19 +55,49 @@ class DoomEngine:
         self.doors = {}
         # set timer to change doomguy face every 2s
         pg.time.set_timer(DOOMGUY_FACE_CHANGE_EVENT, 2000)
+        next_map_name = get_next_map_name(map_name)
+        if PREFETCH_NEXT_MAP and next_map_name is not None:
+            self.map_prefetcher.prefetch(next_map_name)
+
+    def set_render_resolution(self, width, height, low_detail=False):
+        # takes effect from the next frame, the current one being drawn at the old one
+        self.next_viewport = Viewport(width, height, low_detail)
+
+    def set_viewport(self, viewport):
+        self.viewport = viewport
+        self.framebuffer = np.zeros((*viewport.size, 3), dtype=np.uint8)
+        # surface the framebuffer is copied to before being scaled to the
+        # window, None when it's the window's size
+        self.render_surface = None
+        if viewport.size != WIN_RES:
+            self.render_surface = pg.Surface(viewport.size, 0, self.screen)
+
+    def present(self):
+        # the framebuffer to the window, scaled up if it is smaller
+        if self.render_surface is None:
+            pg.surfarray.blit_array(self.screen, self.framebuffer)
+        else:
+            pg.surfarray.blit_array(self.render_surface, self.framebuffer)
+            pg.transform.scale(self.render_surface, WIN_RES, self.screen)
 
     def update(self):
+        if self.next_viewport is not None:
+            self.set_viewport(self.next_viewport)
+            self.next_viewport = None
         # reset view renderer's clip buffers, used to correctly occlude sprites
         self.view_renderer.reset_clip_buffers()
         self.player.update()
         
         self.seg_handler.update()
         self.bsp.update()
+        self.seg_handler.draw_deferred()
         for door in self.doors.values():
             door.update()
         self.object_handler.update()
         self.view_renderer.update()
         self.dt = self.clock.tick()
+        if self.governor is not None:
+            self.governor.update(self.dt)
         pg.display.set_caption(f"{self.clock.get_fps()}")
         
 
@@ -62,8 +107,8 @@ class DoomEngine:
             self.screen.fill('black')
             self.map_renderer.draw()
         else:
-            pg.surfarray.blit_array(self.screen, self.framebuffer)
-            
+            self.present()
+
             for npc in self.object_handler.npcs:
                 self.view_renderer.draw_sprite(npc)
             for obj in self.object_handler.objects:
@@ -73,7 +118,7 @@ class DoomEngine:
             self.view_renderer.draw_status_bar()
             self.view_renderer.draw_doomguy(self.player.face_img)
             if self.debug_mode:
-                self.view_renderer.draw_z_buffer()
+                self.view_renderer.draw_wall_depths()
                 self.view_renderer.draw_debug_cursor()
             pg.display.flip()  
 
@@ -90,8 +135,9 @@ class DoomEngine:
                 elif e.key == pg.K_n:
                     cursor_x = int(self.view_renderer.debug_cursor[0])
                     cursor_y = int(self.view_renderer.debug_cursor[1])
-                    z_val = self.view_renderer.z_buffer[cursor_x, cursor_y]
-                    print(f"z-buffer {(cursor_x,cursor_y)} {z_val}")
+                    fb_x, _ = self.viewport.to_framebuffer(cursor_x, cursor_y)
+                    depth = self.seg_handler.get_wall_depths()[fb_x]
+                    print(f"wall depth {(cursor_x,cursor_y)} {depth}")
                     barrel_dists = []
                     for obj in self.object_handler.objects:
                         if obj.sprite_name_base == "BAR1" and obj.dist:
@@ -102,6 +148,9 @@ class DoomEngine:
 #                    print(f"player position {self.player.pos}")
                 elif e.key == pg.K_m:
                     self.map_mode = not self.map_mode
+                # toggle low detail, as Doom's F5
+                elif e.key == pg.K_F5:
+                    self.set_render_resolution(*self.viewport.render_res, not self.viewport.low_detail)
                 # toggle map mode
                 elif e.key == pg.K_b:
                     if not self.map_mode:
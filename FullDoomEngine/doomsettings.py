@@ -81,4 +81,57 @@ WAD_THING_FLAGS = {
     4: "Not in DM",
     5: "Not in SP",
     6: "Not in Coop"
-}
\ No newline at end of file
+}
+# map the WAD file into memory instead of seek()+read() per field
+WAD_USE_MMAP = True
+
+# decoded sprites, textures and flats are cached on disk per WAD
+ASSET_CACHE_ENABLED = True
+ASSET_CACHE_DIR = "asset_cache"
+# decoded textures, flats and sprites kept in memory (bytes), the least
+# recently used are dropped beyond this; None for no limit
+ASSET_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# parse the next map on a background thread while the current one is played
+PREFETCH_NEXT_MAP = True
+
+# processes used to decode all patches when building the asset cache,
+# 0 to decode in the main process
+ASSET_DECODE_WORKERS = 0
+
+# walk the BSP tree with the numba-compiled, stack based traversal
+# rather than the recursive one
+BSP_ITERATIVE = True
+
+# spatial index used for player collision and activation rays:
+# 'bsp' walks the node tree, 'blockmap' uses the map's BLOCKMAP grid
+SPATIAL_INDEX = 'bsp'
+
+# skip BSP subtrees holding no sub sector of the potentially visible set
+# of the player's sub sector; the set is built once per map (a few
+# seconds for a large one) by a background process, the map being drawn
+# without it until then, and cached with the assets (off if they aren't)
+PVS_CULLING = True
+
+# skip BSP subtrees whose bounding box only spans screen columns already
+# covered by solid walls
+OCCLUSION_CULLING = True
+
+# threads drawing the wall ranges of a frame in parallel vertical strips,
+# once the BSP walk has clipped them all; 0 draws each range as soon as
+# it is clipped. Capped at numba's thread count (NUMBA_NUM_THREADS).
+RENDER_THREADS = 0
+# strips per thread, smaller strips balance the load better
+RENDER_STRIPS_PER_THREAD = 4
+
+# resolution the 3D view is rendered at, scaled to the window (WIN_RES)
+# when presented: (DOOM_W, DOOM_H) for Doom's native 320x200
+RENDER_RES = WIDTH, HEIGHT
+# Doom's low detail mode: half the columns rendered, each shown double
+# wide. Toggled with F5, as in Doom.
+LOW_DETAIL = False
+# frame time (ms) to hold by lowering or raising the render resolution,
+# None to keep RENDER_RES
+TARGET_FRAME_TIME = None
+# render resolutions the governor steps through, as fractions of RENDER_RES
+RESOLUTION_SCALES = (1, 0.75, 0.5, 0.375, 0.25)
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+import pygame as pg
+
+
+def asset_nbytes(asset):
+    # approximate resident size of a decoded asset
+    if isinstance(asset, np.ndarray):
+        return asset.nbytes
+    if isinstance(asset, pg.Surface):
+        return asset.get_width() * asset.get_height() * asset.get_bytesize()
+    if isinstance(asset, tuple):
+        # e.g. the (pixels, mask) of a patch
+        return sum(asset_nbytes(item) for item in asset)
+    return 0
+
+
+class AssetLRU:
+    """
+    Least-recently-used bookkeeping shared by several LazyAssets mappings.
+    Once the decoded assets add up to more than max_bytes, the least
+    recently used ones are dropped, to be decoded again on next access.
+    max_bytes=None means no limit.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        # (id(mapping), name) -> (mapping, nbytes), oldest first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def add(self, assets, name, nbytes):
+        self.entries[(id(assets), name)] = (assets, nbytes)
+        self.total_bytes += nbytes
+        self.evict()
+
+    def touch(self, assets, name):
+        self.entries.move_to_end((id(assets), name))
+
+    def evict(self):
+        # always keep the most recent asset, however big
+        while (self.max_bytes is not None and self.total_bytes > self.max_bytes
+               and len(self.entries) > 1):
+            (_, name), (assets, nbytes) = self.entries.popitem(last=False)
+            self.total_bytes -= nbytes
+            del assets.loaded[name]
+
+    def clear(self):
+        for assets, _ in self.entries.values():
+            assets.loaded.clear()
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+class LazyAssets(Mapping):
+    """
+    Read-only mapping name -> asset, where each asset is produced by
+    loader(name) the first time it is looked up, and kept until the
+    shared AssetLRU evicts it.
+    """
+    def __init__(self, names, loader, lru=None):
+        self.names = dict.fromkeys(names)  # ordered set of available names
+        self.loader = loader
+        self.lru = lru if lru is not None else AssetLRU()
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        try:
+            asset = self.loaded[name]
+        except KeyError:
+            if name not in self.names:
+                raise
+            asset = self.loaded[name] = self.loader(name)
+            self.lru.add(self, name, asset_nbytes(asset))
+            return asset
+        self.lru.touch(self, name)
+        return asset
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def preload(self, names):
+        # decode the given assets now rather than on first use
+        for name in names:
+            if name in self.names:
+                self[name]
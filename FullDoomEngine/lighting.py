@@ -0,0 +1,88 @@
+import numpy as np
+
+from doomsettings import DOOM_W
+
+# Doom's light diminishing parameters (r_main.h)
+NUM_COLORMAPS = 32  # colormaps 0 (brightest) .. 31 (darkest), 32 is invulnerability
+NUM_COLORMAP_LUMP_MAPS = 34
+LIGHT_LEVELS = 16
+LIGHT_SEG_SHIFT = 4  # sector light level 0..255 -> 0..15
+MAX_LIGHT_SCALE = 48
+MAX_LIGHT_Z = 128
+LIGHT_Z_UNITS = 16  # map units of depth per zlight entry (1 << LIGHTZSHIFT in fixed point)
+DIST_MAP = 2
+
+
+def get_light_scale_multiplier(projection):
+    # Doom's wall scales are relative to a 160 pixel projection, ours to the
+    # viewport's (in rows), and scalelight has 16 entries per unit of scale
+    # (fixed point >> LIGHTSCALESHIFT)
+    return 16 * (DOOM_W / 2) / projection
+
+
+def build_colormaps(palette_array):
+    """
+    Equivalent of the COLORMAP lump for WADs that don't have one: the
+    palette darkened in 32 steps, each colour mapped back to the nearest
+    palette entry, followed by an inverse greyscale map and an all black map.
+
+    Returns
+    =======
+        colormaps: (34, 256) uint8 array of palette indices
+    """
+    palette = palette_array.astype(np.int32)
+    colormaps = np.zeros((NUM_COLORMAP_LUMP_MAPS, 256), dtype=np.uint8)
+
+    def nearest(colours):
+        dist = ((colours[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+        return dist.argmin(axis=1)
+
+    for i in range(NUM_COLORMAPS):
+        colormaps[i] = nearest(palette * (NUM_COLORMAPS - i) // NUM_COLORMAPS)
+    grey = 255 - palette.mean(axis=1).astype(np.int32)
+    colormaps[NUM_COLORMAPS] = nearest(np.repeat(grey[:, None], 3, axis=1))
+    colormaps[NUM_COLORMAPS + 1] = nearest(np.zeros((256, 3), dtype=np.int32))
+    return colormaps
+
+
+def build_scale_light():
+    """
+    scalelight[light_num][scale_index]: colormap for walls, brighter the
+    bigger (closer) the wall is drawn.
+    """
+    scale_light = np.zeros((LIGHT_LEVELS, MAX_LIGHT_SCALE), dtype=np.int64)
+    for i in range(LIGHT_LEVELS):
+        start_map = ((LIGHT_LEVELS - 1 - i) * 2) * NUM_COLORMAPS // LIGHT_LEVELS
+        for j in range(MAX_LIGHT_SCALE):
+            level = start_map - j // DIST_MAP
+            scale_light[i, j] = min(max(level, 0), NUM_COLORMAPS - 1)
+    return scale_light
+
+
+def build_z_light():
+    """
+    zlight[light_num][z_index]: colormap for floors and ceilings, darker
+    the further away (in LIGHT_Z_UNITS steps) the plane is.
+    """
+    z_light = np.zeros((LIGHT_LEVELS, MAX_LIGHT_Z), dtype=np.int64)
+    for i in range(LIGHT_LEVELS):
+        start_map = ((LIGHT_LEVELS - 1 - i) * 2) * NUM_COLORMAPS // LIGHT_LEVELS
+        for j in range(MAX_LIGHT_Z):
+            scale = (DOOM_W // 2) // (j + 1)
+            level = start_map - scale // DIST_MAP
+            z_light[i, j] = min(max(level, 0), NUM_COLORMAPS - 1)
+    return z_light
+
+
+def get_light_num(light_level, seg=None):
+    """
+    Sector light level (0..255) to a row of the scalelight/zlight tables.
+    Walls along the map axes get Doom's "fake contrast".
+    """
+    light_num = light_level >> LIGHT_SEG_SHIFT
+    if seg is not None:
+        if seg.start_vertex.y == seg.end_vertex.y:
+            light_num -= 1
+        elif seg.start_vertex.x == seg.end_vertex.x:
+            light_num += 1
+    return min(max(light_num, 0), LIGHT_LEVELS - 1)
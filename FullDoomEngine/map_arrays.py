@@ -0,0 +1,95 @@
+import numpy as np
+
+from data_types import (
+    LINEDEF_DTYPE,
+    NODE_DTYPE,
+    SECTOR_DTYPE,
+    SEG_DTYPE,
+    SIDEDEF_DTYPE,
+    SUB_SECTOR_DTYPE,
+    THING_DTYPE,
+    VERTEX_DTYPE,
+)
+
+# marks a missing reference (e.g. no back sidedef) in the index columns
+NO_INDEX = -1
+
+
+class MapArrays:
+    """
+    Columnar view of the lumps of one map: each lump is decoded in one go
+    into a structured NumPy array, and the references between records
+    (seg -> linedef -> sidedef -> sector) are resolved into plain integer
+    index columns, so that the map can be processed with vectorized or
+    numba-compiled code instead of walking Python objects.
+    """
+    LUMP_NAMES = [
+        'THINGS', 'LINEDEFS', 'SIDEDEFS', 'VERTEXES', 'SEGS', 'SSECTORS', 'NODES', 'SECTORS'
+    ]
+    SUB_SECTOR_IDENTIFIER = 0x8000
+    TWO_SIDED = 4  # linedef flag
+
+    def __init__(self, reader, lump_indices):
+        """
+        Parameters
+        ==========
+        reader: WADReader
+        lump_indices: dict, map lump name (e.g. "VERTEXES") -> directory index
+        """
+        read = reader.read_lump_array
+        self.vertexes = read(lump_indices['VERTEXES'], VERTEX_DTYPE)
+        self.linedefs = read(lump_indices['LINEDEFS'], LINEDEF_DTYPE)
+        self.sidedefs = read(lump_indices['SIDEDEFS'], SIDEDEF_DTYPE)
+        self.segments = read(lump_indices['SEGS'], SEG_DTYPE)
+        self.sub_sectors = read(lump_indices['SSECTORS'], SUB_SECTOR_DTYPE)
+        self.nodes = read(lump_indices['NODES'], NODE_DTYPE)
+        self.sectors = read(lump_indices['SECTORS'], SECTOR_DTYPE)
+        self.things = read(lump_indices['THINGS'], THING_DTYPE)
+        self.root_node_id = len(self.nodes) - 1
+        self.resolve_references()
+
+    def resolve_references(self):
+        # sidedef -> sector
+        self.sidedef_sector = self.sidedefs['sector_id'].astype(np.int32)
+
+        # linedef -> sidedefs -> sectors
+        front_sidedef = self.linedefs['front_sidedef_id'].astype(np.int32)
+        back_sidedef = self.linedefs['back_sidedef_id'].astype(np.int32)
+        back_sidedef[back_sidedef == 0xFFFF] = NO_INDEX
+        self.linedef_front_sidedef = front_sidedef
+        self.linedef_back_sidedef = back_sidedef
+        self.linedef_front_sector = self.lookup(self.sidedef_sector, front_sidedef)
+        self.linedef_back_sector = self.lookup(self.sidedef_sector, back_sidedef)
+
+        # seg -> linedef -> sidedefs -> sectors, swapped for segs running
+        # against the direction of their linedef
+        segs = self.segments
+        self.seg_linedef = segs['linedef_id'].astype(np.int32)
+        self.seg_start_vertex = segs['start_vertex_id'].astype(np.int32)
+        self.seg_end_vertex = segs['end_vertex_id'].astype(np.int32)
+        is_reversed = segs['direction'] != 0
+        line_front = front_sidedef[self.seg_linedef]
+        line_back = back_sidedef[self.seg_linedef]
+        self.seg_front_sidedef = np.where(is_reversed, line_back, line_front)
+        self.seg_back_sidedef = np.where(is_reversed, line_front, line_back)
+        self.seg_front_sector = self.lookup(self.sidedef_sector, self.seg_front_sidedef)
+        self.seg_back_sector = self.lookup(self.sidedef_sector, self.seg_back_sidedef)
+        # as in WADData.update_segs, only two sided lines have a back sector
+        is_two_sided = (self.linedefs['flags'][self.seg_linedef] & self.TWO_SIDED) != 0
+        self.seg_back_sector[~is_two_sided] = NO_INDEX
+
+        # binary angles to degrees in [0, 360)
+        self.seg_angle = (segs['angle'].astype(np.float64) * (360 / 65536)) % 360
+
+        # sub sector -> sector, taken from its first seg
+        self.sub_sector_sector = self.seg_front_sector[
+            self.sub_sectors['first_seg_id'].astype(np.int32)
+        ]
+
+    @staticmethod
+    def lookup(table, indices):
+        # table[indices], propagating NO_INDEX
+        result = np.full(len(indices), NO_INDEX, dtype=np.int32)
+        valid = indices != NO_INDEX
+        result[valid] = table[indices[valid]]
+        return result
@@ -16,12 +16,24 @@ class NPCState(Enum):
 
 
 class NPC(Thing):
+    is_static = False
+
     def __init__(self, engine, pos, angle):
         super().__init__(engine, pos, angle)
         self.engine = engine
 
         self.state = NPCState.standing
 
+    def update(self):
+        super().update()
+        if self.state == NPCState.standing:
+            self.look_for_player()
+
+    def look_for_player(self):
+        # wake up once the player comes into view
+        if self.engine.sight.can_see(self, self.engine.player):
+            self.state = NPCState.walking
+
 
 class ZombieMan(NPC):
     def __init__(self, engine, pos, angle):
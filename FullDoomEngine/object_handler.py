@@ -14,8 +14,8 @@ class ObjectHandler:
 
 
     def add_objects_npcs(self, difficulty):
-        # store pre-computed scaled sprites
-        self.sprite_cache = {}
+        # store pre-computed scaled sprites, shared by all maps of the WAD
+        self.sprite_cache = self.engine.wad_data.asset_data.scaled_sprites
         # read the csv that maps Thing.type to object/npc info
         with open("thing_index.csv", "r") as thingindex:
             dialect = clevercsv.Sniffer().sniff(thingindex.read(), verbose=False)
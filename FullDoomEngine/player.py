@@ -29,6 +29,9 @@ class Player:
         self.weapon_y_offset = 0
         self.health = 100
         self.face_img = 'STFST00'
+        # set by BSP.locate
+        self.sub_sector_id = None
+        self.located_pos = None
         
 
     def get_view_height(self):
@@ -38,7 +41,8 @@ class Player:
         return self.view_height
 
     def get_height(self):
-        target_height = PLAYER_HEIGHT + self.engine.bsp.get_sub_sector_height()
+        bsp = self.engine.bsp
+        target_height = PLAYER_HEIGHT + bsp.get_floor_height(bsp.locate(self))
         if self.height > target_height:
             # falling
             self.climbing_or_falling = True
@@ -0,0 +1,591 @@
+import hashlib
+import math
+import multiprocessing
+import os
+
+import numpy as np
+from numba import njit
+
+from doomsettings import ASSET_CACHE_DIR
+from map_arrays import MapArrays
+from wad_reader import WADReader
+
+SUB_SECTOR_IDENTIFIER = 0x8000
+# tolerance, in map units, for points lying on a clipping line
+EPSILON = 1e-6
+# portals narrower than this (in map units) are treated as closed
+MIN_PORTAL_WIDTH = 1e-3
+# wall ends this close (in map units) to a portal split it
+VERTEX_SNAP = 1.0
+# points sampled along each piece of a portal to find out if it's open
+PORTAL_SAMPLES = (0.1, 0.5, 0.9)
+
+
+def line_key(ax, ay, bx, by):
+    """
+    Canonical integer equation (A, B, C) of the line through the integer
+    points (ax, ay) and (bx, by), with A x + B y = C, the same for every
+    pair of points on that line whichever way round they are.
+    """
+    a, b = by - ay, ax - bx
+    c = a * ax + b * ay
+    g = math.gcd(math.gcd(a, b), c) or 1
+    if a < 0 or (a == 0 and b < 0):
+        g = -g
+    return a // g, b // g, c // g
+
+
+def clip_right(polygon, ax, ay, bx, by, label):
+    """
+    Clip a convex polygon to the right of the directed line a -> b.
+
+    Parameters
+    ==========
+        polygon: list of (x, y, edge_label), edge_label being the line that
+            the edge from this vertex to the next one lies on
+        label: edge_label given to the new edge along a -> b
+
+    Returns
+    =======
+        the clipped polygon, in the same form
+    """
+    dx, dy = bx - ax, by - ay
+    scale = math.hypot(dx, dy)
+    sides = [(dx * (y - ay) - dy * (x - ax)) / scale for x, y, _ in polygon]
+    clipped = []
+    for i, (x, y, edge_label) in enumerate(polygon):
+        j = (i + 1) % len(polygon)
+        side, next_side = sides[i], sides[j]
+        is_in, next_is_in = side <= EPSILON, next_side <= EPSILON
+        if is_in:
+            clipped.append((x, y, edge_label))
+            if not next_is_in:
+                t = side / (side - next_side)
+                nx, ny = polygon[j][0], polygon[j][1]
+                clipped.append((x + t * (nx - x), y + t * (ny - y), label))
+        elif next_is_in:
+            t = side / (side - next_side)
+            nx, ny = polygon[j][0], polygon[j][1]
+            clipped.append((x + t * (nx - x), y + t * (ny - y), edge_label))
+    return clipped
+
+
+def build_leaf_polygons(map_arrays):
+    """
+    Convex polygon of the region covered by each BSP leaf (sub sector),
+    found by clipping the map's bounding box with the partition lines on
+    the way down the tree. The leaves tile the plane, walls and void
+    included. Edges are labelled with the line_key of the partition (or
+    box side) they lie on, so that shared edges can be matched exactly.
+    """
+    vertexes = map_arrays.vertexes
+    margin = 64
+    left, right = int(vertexes['x'].min()) - margin, int(vertexes['x'].max()) + margin
+    bottom, top = int(vertexes['y'].min()) - margin, int(vertexes['y'].max()) + margin
+    # clockwise, so that the inside is on the right of every edge
+    corners = [(left, bottom), (left, top), (right, top), (right, bottom)]
+    world = [
+        (x, y, line_key(x, y, *corners[(i + 1) % 4])) for i, (x, y) in enumerate(corners)
+    ]
+
+    nodes = map_arrays.nodes.tolist()
+    polygons = [None] * len(map_arrays.sub_sectors)
+    stack = [(map_arrays.root_node_id, world)]
+    while stack:
+        node_id, polygon = stack.pop()
+        if node_id >= SUB_SECTOR_IDENTIFIER:
+            polygons[node_id - SUB_SECTOR_IDENTIFIER] = polygon if len(polygon) >= 3 else None
+            continue
+        x, y, dx, dy = nodes[node_id][:4]
+        front_child_id, back_child_id = nodes[node_id][12:14]
+        label = line_key(x, y, x + dx, y + dy)
+        if len(polygon) >= 3:
+            stack.append((front_child_id, clip_right(polygon, x, y, x + dx, y + dy, label)))
+            stack.append((back_child_id, clip_right(polygon, x + dx, y + dy, x, y, label)))
+        else:
+            stack.append((front_child_id, polygon))
+            stack.append((back_child_id, polygon))
+    return polygons
+
+
+class OpenSpace:
+    """
+    Point in map test against the one sided linedefs, which outline the
+    playable area (two sided ones only separate sectors from each other).
+    """
+    # a direction for the test rays that won't run exactly through vertices
+    RAY_DX, RAY_DY = 1.0, math.pi * 1e-3
+
+    def __init__(self, map_arrays):
+        one_sided = map_arrays.linedefs[map_arrays.linedef_back_sidedef == -1]
+        vertexes = map_arrays.vertexes
+        self.x1 = vertexes['x'][one_sided['start_vertex_id']].astype(np.float64)
+        self.y1 = vertexes['y'][one_sided['start_vertex_id']].astype(np.float64)
+        self.x2 = vertexes['x'][one_sided['end_vertex_id']].astype(np.float64)
+        self.y2 = vertexes['y'][one_sided['end_vertex_id']].astype(np.float64)
+
+    def contains(self, x, y):
+        # odd number of walls crossed by a ray from (x, y): inside the map
+        dx, dy = self.RAY_DX, self.RAY_DY
+        ex, ey = self.x2 - self.x1, self.y2 - self.y1
+        denom = dx * ey - dy * ex
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # ray parameter and position along each wall of the crossing
+            t = ((self.x1 - x) * ey - (self.y1 - y) * ex) / denom
+            u = ((self.x1 - x) * dy - (self.y1 - y) * dx) / denom
+        crossings = (denom != 0) & (t > 0) & (u >= 0) & (u < 1)
+        return np.count_nonzero(crossings) % 2 == 1
+
+    def split_points(self, x1, y1, x2, y2):
+        # positions (0..1) along the segment where it crosses a wall
+        dx, dy = x2 - x1, y2 - y1
+        ex, ey = self.x2 - self.x1, self.y2 - self.y1
+        denom = dx * ey - dy * ex
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((self.x1 - x1) * ey - (self.y1 - y1) * ex) / denom
+            u = ((self.x1 - x1) * dy - (self.y1 - y1) * dx) / denom
+        crossings = (denom != 0) & (t > 0) & (t < 1) & (u >= 0) & (u <= 1)
+        # and where it passes by a wall's end: walls meeting just off the
+        # segment may not cross it, yet still cut it in two
+        length_sq = dx * dx + dy * dy
+        ends_x = np.concatenate((self.x1, self.x2))
+        ends_y = np.concatenate((self.y1, self.y2))
+        t_end = ((ends_x - x1) * dx + (ends_y - y1) * dy) / length_sq
+        dist = np.abs((ends_x - x1) * dy - (ends_y - y1) * dx) / math.sqrt(length_sq)
+        near = (dist <= VERTEX_SNAP) & (t_end > 0) & (t_end < 1)
+        return np.unique(np.concatenate((t[crossings], t_end[near]))).tolist()
+
+
+def trim_portals(portals, open_space):
+    """
+    Cut the portals down to the parts inside the map: leaves also cover
+    the void around it, and their shared edges there are no openings.
+    """
+    # how far either side of a portal the map is sampled
+    offset = 0.05
+    trimmed = []
+    for cell_portals in portals:
+        cell_trimmed = []
+        for neighbour, x1, y1, x2, y2 in cell_portals:
+            length = math.hypot(x2 - x1, y2 - y1)
+            nx, ny = (y1 - y2) / length * offset, (x2 - x1) / length * offset
+            cuts = [0.0] + open_space.split_points(x1, y1, x2, y2) + [1.0]
+            start = None
+            for t1, t2 in zip(cuts, cuts[1:]):
+                # open on both sides of the edge, at any of the samples
+                is_open = False
+                for f in PORTAL_SAMPLES:
+                    t = t1 + f * (t2 - t1)
+                    mx, my = x1 + t * (x2 - x1), y1 + t * (y2 - y1)
+                    if open_space.contains(mx + nx, my + ny) and open_space.contains(mx - nx, my - ny):
+                        is_open = True
+                        break
+                if is_open and start is None:
+                    start = t1
+                if not is_open and start is not None:
+                    cell_trimmed.append(sub_segment(neighbour, x1, y1, x2, y2, start, t1))
+                    start = None
+            if start is not None:
+                cell_trimmed.append(sub_segment(neighbour, x1, y1, x2, y2, start, 1.0))
+        trimmed.append([
+            portal for portal in cell_trimmed
+            if math.hypot(portal[3] - portal[1], portal[4] - portal[2]) > MIN_PORTAL_WIDTH
+        ])
+    return trimmed
+
+
+def sub_segment(neighbour, x1, y1, x2, y2, t1, t2):
+    return (
+        neighbour,
+        x1 + t1 * (x2 - x1), y1 + t1 * (y2 - y1),
+        x1 + t2 * (x2 - x1), y1 + t2 * (y2 - y1),
+    )
+
+
+def find_portals(polygons):
+    """
+    Openings between neighbouring sub sectors: the overlaps of polygon
+    edges that lie on the same line, running in opposite directions.
+
+    Returns
+    =======
+        portals: list, per sub sector, of (neighbour, x1, y1, x2, y2), the
+            segment oriented with the sub sector on its right
+    """
+    # line_key -> [(sub_sector_id, t1, t2, x1, y1, x2, y2)], t measured along the line
+    edges_on_line = {}
+    for sub_sector_id, polygon in enumerate(polygons):
+        if polygon is None:
+            continue
+        for i, (x1, y1, key) in enumerate(polygon):
+            x2, y2 = polygon[(i + 1) % len(polygon)][:2]
+            a, b, _ = key
+            t1, t2 = b * x1 - a * y1, b * x2 - a * y2
+            if abs(t2 - t1) > MIN_PORTAL_WIDTH:
+                edges_on_line.setdefault(key, []).append((sub_sector_id, t1, t2, x1, y1, x2, y2))
+
+    portals = [[] for _ in polygons]
+    for edges in edges_on_line.values():
+        forward = [edge for edge in edges if edge[2] > edge[1]]
+        backward = [edge for edge in edges if edge[2] < edge[1]]
+        for id_a, a1, a2, ax1, ay1, ax2, ay2 in forward:
+            for id_b, b1, b2, bx1, by1, bx2, by2 in backward:
+                if id_a == id_b:
+                    continue
+                start, end = max(a1, b2), min(a2, b1)
+                if end - start <= MIN_PORTAL_WIDTH:
+                    continue
+                # the overlap as points on each edge, keeping each one's direction
+                f1, f2 = (start - a1) / (a2 - a1), (end - a1) / (a2 - a1)
+                portals[id_a].append((
+                    id_b,
+                    ax1 + f1 * (ax2 - ax1), ay1 + f1 * (ay2 - ay1),
+                    ax1 + f2 * (ax2 - ax1), ay1 + f2 * (ay2 - ay1),
+                ))
+                g1, g2 = (b1 - end) / (b1 - b2), (b1 - start) / (b1 - b2)
+                portals[id_b].append((
+                    id_a,
+                    bx1 + g1 * (bx2 - bx1), by1 + g1 * (by2 - by1),
+                    bx1 + g2 * (bx2 - bx1), by1 + g2 * (by2 - by1),
+                ))
+    return portals
+
+
+@njit
+def clip_segment_right(x1, y1, x2, y2, ax, ay, bx, by):
+    """
+    Part of segment (x1, y1) - (x2, y2) to the right of the directed line
+    a -> b, as (is_empty, x1, y1, x2, y2), is_empty when nothing wider
+    than MIN_PORTAL_WIDTH is left.
+    """
+    dx, dy = bx - ax, by - ay
+    length = math.hypot(dx, dy)
+    if length < EPSILON:
+        return False, x1, y1, x2, y2
+    side1 = (dx * (y1 - ay) - dy * (x1 - ax)) / length
+    side2 = (dx * (y2 - ay) - dy * (x2 - ax)) / length
+    if side1 > EPSILON and side2 > EPSILON:
+        return True, x1, y1, x2, y2
+    if side1 <= EPSILON and side2 <= EPSILON:
+        return False, x1, y1, x2, y2
+    t = side1 / (side1 - side2)
+    x, y = x1 + t * (x2 - x1), y1 + t * (y2 - y1)
+    if side1 <= EPSILON:
+        x2, y2 = x, y
+    else:
+        x1, y1 = x, y
+    return math.hypot(x2 - x1, y2 - y1) < MIN_PORTAL_WIDTH, x1, y1, x2, y2
+
+
+@njit
+def position_on(segment, x, y):
+    # how far along segment (0 at its start, 1 at its end) the point (x, y) is
+    dx, dy = segment[2] - segment[0], segment[3] - segment[1]
+    return ((x - segment[0]) * dx + (y - segment[1]) * dy) / (dx * dx + dy * dy)
+
+
+@njit
+def flow_portals(portal_start, portal_cell, portal_segs, visible):
+    """
+    For every sub sector and each of its portals, mark the sub sectors seen
+    through it, following chains of portals while some line can still pass
+    through all of them. This is 2D only: floors, ceilings and doors never
+    block, so the result can only err on the visible side.
+
+    Parameters
+    ==========
+        portal_start: (n + 1,) the portals of sub sector c are
+            portal_start[c]: portal_start[c + 1]
+        portal_cell: the sub sector each portal leads into
+        portal_segs: (x1, y1, x2, y2) of each portal, with the sub sector it
+            belongs to on its right
+        visible: (n, n) bool array to fill in
+    """
+    # flows followed through each portal, as a linked list per portal of
+    # the (source, pass) extents along the source portal and that portal
+    head = np.full(len(portal_cell), -1, dtype=np.int64)
+    spans = [(0.0, 0.0, 0.0, 0.0)]
+    span_next = [-1]
+    for source_cell in range(len(portal_start) - 1):
+        visible[source_cell, source_cell] = True
+        for source in range(portal_start[source_cell], portal_start[source_cell + 1]):
+            source_seg = portal_segs[source]
+            visible[source_cell, portal_cell[source]] = True
+            head[:] = -1
+            spans.clear()
+            span_next.clear()
+
+            # source, pass, the cell the pass leads into and the one it comes from
+            sx1, sy1, sx2, sy2 = source_seg
+            stack = [(sx1, sy1, sx2, sy2, sx1, sy1, sx2, sy2, portal_cell[source], source_cell)]
+            is_first = True
+            while stack:
+                sx1, sy1, sx2, sy2, px1, py1, px2, py2, cell, previous = stack.pop()
+                for portal in range(portal_start[cell], portal_start[cell + 1]):
+                    next_cell = portal_cell[portal]
+                    if next_cell == previous:
+                        continue
+                    x1, y1, x2, y2 = portal_segs[portal]
+                    # beyond the source and the pass, i.e. left of both of them
+                    empty, x1, y1, x2, y2 = clip_segment_right(x1, y1, x2, y2, sx2, sy2, sx1, sy1)
+                    if empty:
+                        continue
+                    if not is_first:
+                        empty, x1, y1, x2, y2 = clip_segment_right(x1, y1, x2, y2, px2, py2, px1, py1)
+                        if empty:
+                            continue
+                        # inside the wedge of lines through both the source and the pass
+                        empty, x1, y1, x2, y2 = clip_segment_right(x1, y1, x2, y2, px2, py2, sx1, sy1)
+                        if empty:
+                            continue
+                        empty, x1, y1, x2, y2 = clip_segment_right(x1, y1, x2, y2, sx2, sy2, px1, py1)
+                        if empty:
+                            continue
+                    # only the part of the source behind this portal can see through it
+                    empty, nx1, ny1, nx2, ny2 = clip_segment_right(sx1, sy1, sx2, sy2, x1, y1, x2, y2)
+                    if empty:
+                        continue
+                    visible[source_cell, next_cell] = True
+
+                    # skip flows no wider than one already followed through this portal
+                    s1 = position_on(source_seg, nx1, ny1)
+                    s2 = position_on(source_seg, nx2, ny2)
+                    p1 = position_on(portal_segs[portal], x1, y1)
+                    p2 = position_on(portal_segs[portal], x2, y2)
+                    is_covered = False
+                    span = head[portal]
+                    while span != -1:
+                        o1, o2, q1, q2 = spans[span]
+                        if (o1 <= s1 + EPSILON and o2 >= s2 - EPSILON
+                                and q1 <= p1 + EPSILON and q2 >= p2 - EPSILON):
+                            is_covered = True
+                            break
+                        span = span_next[span]
+                    if is_covered:
+                        continue
+                    spans.append((s1, s2, p1, p2))
+                    span_next.append(head[portal])
+                    head[portal] = len(spans) - 1
+                    stack.append((nx1, ny1, nx2, ny2, x1, y1, x2, y2, next_cell, cell))
+                is_first = False
+
+
+def build_pvs(map_arrays):
+    """
+    Returns
+    =======
+        visible: (n, n) bool array, visible[a, b] if anything in sub sector
+            b may be seen from somewhere in sub sector a
+    """
+    polygons = build_leaf_polygons(map_arrays)
+    portals = trim_portals(find_portals(polygons), OpenSpace(map_arrays))
+    num_sub_sectors = len(polygons)
+    portal_start = np.zeros(num_sub_sectors + 1, dtype=np.int64)
+    np.cumsum([len(cell_portals) for cell_portals in portals], out=portal_start[1:])
+    flat_portals = [portal for cell_portals in portals for portal in cell_portals]
+    portal_cell = np.array([portal[0] for portal in flat_portals], dtype=np.int64)
+    portal_segs = np.array([portal[1:] for portal in flat_portals], dtype=np.float64).reshape(-1, 4)
+    visible = np.zeros((num_sub_sectors, num_sub_sectors), dtype=bool)
+    flow_portals(portal_start, portal_cell, portal_segs, visible)
+    # sub sectors whose shape couldn't be worked out see and are seen by everything
+    unknown = np.array([polygon is None for polygon in polygons], dtype=bool)
+    visible[unknown, :] = True
+    visible[:, unknown] = True
+    # visibility goes both ways, which covers for any pair missed in one direction
+    return visible | visible.T
+
+
+def find_missed_pairs(map_arrays, visible, num_samples=100000, seed=0):
+    """
+    Check a PVS against ray sampling: pairs of random points inside the
+    map, in random sub sectors, with no one sided wall between them must
+    have their sub sectors marked visible.
+
+    Returns
+    =======
+        missed: set of (from_sub_sector_id, sub_sector_id) pairs seen by a
+            ray but not in visible
+    """
+    polygons = build_leaf_polygons(map_arrays)
+    open_space = OpenSpace(map_arrays)
+    ax, ay, bx, by = open_space.x1, open_space.y1, open_space.x2, open_space.y2
+    cells = [i for i, polygon in enumerate(polygons) if polygon is not None]
+    rng = np.random.default_rng(seed)
+
+    def random_point(polygon):
+        weights = rng.dirichlet(np.ones(len(polygon)))
+        return weights @ np.array([vertex[:2] for vertex in polygon])
+
+    missed = set()
+    for _ in range(num_samples):
+        a, b = rng.choice(cells, size=2)
+        (px, py), (qx, qy) = random_point(polygons[a]), random_point(polygons[b])
+        if not (open_space.contains(px, py) and open_space.contains(qx, qy)):
+            continue
+        # does p -> q properly cross any wall
+        dx, dy = qx - px, qy - py
+        side_a = dx * (ay - py) - dy * (ax - px)
+        side_b = dx * (by - py) - dy * (bx - px)
+        side_p = (bx - ax) * (py - ay) - (by - ay) * (px - ax)
+        side_q = (bx - ax) * (qy - ay) - (by - ay) * (qx - ax)
+        if np.any((side_a * side_b < 0) & (side_p * side_q < 0)):
+            continue
+        if not visible[a, b]:
+            missed.add((int(a), int(b)))
+    return missed
+
+
+def build_pvs_worker(wad_path, lump_indices, map_hash, cache_dir):
+    # runs in a worker process, at a low priority so as not to slow the game down
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    reader = WADReader(wad_path)
+    try:
+        PVS.for_map(map_hash, MapArrays(reader, lump_indices), cache_dir)
+    finally:
+        reader.close()
+
+
+class PVS:
+    """
+    Potentially visible set: for each sub sector, the sub sectors that may
+    be seen from anywhere inside it, as rows of packed bits (uint64 words),
+    cached on disk by a hash of the map's geometry lumps.
+    """
+    # bump whenever build_pvs changes, to invalidate old caches
+    VERSION = 2
+    GEOMETRY_LUMPS = ['VERTEXES', 'LINEDEFS', 'SIDEDEFS', 'SEGS', 'SSECTORS', 'NODES']
+    # worker processes started by build_in_background, by cache path
+    builds = {}
+
+    def __init__(self, words, num_sub_sectors):
+        self.num_sub_sectors = num_sub_sectors
+        self.words = words
+        # the same rows as Python ints, for bit tests outside numba
+        self.rows = [int.from_bytes(row.tobytes(), 'little') for row in words]
+
+    @classmethod
+    def from_visible(cls, visible):
+        return cls(cls.pack(visible), len(visible))
+
+    @staticmethod
+    def pack(visible):
+        num_words = (visible.shape[1] + 63) // 64
+        padded = np.zeros((visible.shape[0], num_words * 64), dtype=bool)
+        padded[:, :visible.shape[1]] = visible
+        return np.packbits(padded, axis=1, bitorder='little').view('<u8')
+
+    def unpack(self):
+        bits = np.unpackbits(self.words.view(np.uint8), axis=1, bitorder='little')
+        return bits[:, :self.num_sub_sectors].astype(bool)
+
+    @staticmethod
+    def hash_map(reader, lump_indices):
+        sha1 = hashlib.sha1()
+        for name in PVS.GEOMETRY_LUMPS:
+            sha1.update(reader.read_lump(lump_indices[name]))
+        return sha1.hexdigest()
+
+    @classmethod
+    def cache_path(cls, map_hash, cache_dir=ASSET_CACHE_DIR):
+        return os.path.join(cache_dir, 'pvs', f"{map_hash}-v{cls.VERSION}.npy")
+
+    @classmethod
+    def from_cache(cls, map_hash, num_sub_sectors, cache_dir=ASSET_CACHE_DIR):
+        # None if it isn't cached (yet)
+        path = cls.cache_path(map_hash, cache_dir)
+        if not os.path.exists(path):
+            return None
+        return cls(np.load(path), num_sub_sectors)
+
+    @classmethod
+    def for_map(cls, map_hash, map_arrays, cache_dir=ASSET_CACHE_DIR):
+        # cache_dir=None builds it without touching the disk
+        if cache_dir is None:
+            return cls.from_visible(build_pvs(map_arrays))
+        pvs = cls.from_cache(map_hash, len(map_arrays.sub_sectors), cache_dir)
+        if pvs is not None:
+            return pvs
+        path = cls.cache_path(map_hash, cache_dir)
+        pvs = cls.from_visible(build_pvs(map_arrays))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written under a temporary name and renamed, as in AssetCache.save
+        tmp_path = f"{path[:-len('.npy')]}.tmp{os.getpid()}.npy"
+        np.save(tmp_path, pvs.words)
+        os.replace(tmp_path, path)
+        return pvs
+
+    @classmethod
+    def build_in_background(cls, wad_path, lump_indices, map_hash, cache_dir=ASSET_CACHE_DIR):
+        """
+        Build and cache the PVS of a map in a worker process, for
+        from_cache to find once it's done: building it takes seconds, and
+        on a thread it would hold the GIL for most of them. Started once
+        per map, and killed if the game quits first.
+
+        Parameters
+        ==========
+            lump_indices: dict, MapArrays.LUMP_NAMES -> directory index
+        """
+        path = cls.cache_path(map_hash, cache_dir)
+        if path in cls.builds:
+            return
+        # spawned rather than forked, as the game has threads running
+        process = multiprocessing.get_context('spawn').Process(
+            target=build_pvs_worker, args=(wad_path, lump_indices, map_hash, cache_dir), daemon=True,
+        )
+        process.start()
+        cls.builds[path] = process
+
+    def subtree_masks(self, nodes, root_node_id):
+        """
+        Bits of the sub sectors under each node of the BSP tree, for
+        skipping whole subtrees out of the PVS.
+
+        Returns
+        =======
+            list of Python int masks, one per node
+        """
+        masks = [0] * len(nodes)
+        # children before their parent, whatever order the nodes are in
+        stack = [(root_node_id, False)]
+        while stack:
+            node_id, is_done = stack.pop()
+            children = int(nodes[node_id]['front_child_id']), int(nodes[node_id]['back_child_id'])
+            if is_done:
+                for child_id in children:
+                    if child_id >= SUB_SECTOR_IDENTIFIER:
+                        masks[node_id] |= 1 << (child_id - SUB_SECTOR_IDENTIFIER)
+                    else:
+                        masks[node_id] |= masks[child_id]
+                continue
+            stack.append((node_id, True))
+            stack.extend((child_id, False) for child_id in children if child_id < SUB_SECTOR_IDENTIFIER)
+        return masks
+
+    def to_words(self, masks):
+        # Python int masks as rows of uint64 words, like self.words
+        num_bytes = self.words.shape[1] * 8
+        data = b''.join(mask.to_bytes(num_bytes, 'little') for mask in masks)
+        return np.frombuffer(data, dtype='<u8').reshape(len(masks), self.words.shape[1]).copy()
+
+    def is_visible(self, from_sub_sector_id, sub_sector_id):
+        return (self.rows[from_sub_sector_id] >> sub_sector_id) & 1 == 1
+
+
+if __name__ == '__main__':
+    # python pvs.py [wad_path] [map_name]: check build_pvs against ray sampling
+    import sys
+
+    wad_path = sys.argv[1] if len(sys.argv) > 1 else 'wad/DOOM1.wad'
+    map_name = sys.argv[2] if len(sys.argv) > 2 else 'E1M1'
+    reader = WADReader(wad_path)
+    map_index = reader.get_lump_index(map_name)
+    map_arrays = MapArrays(reader, {
+        name: reader.find_lump(name, map_index + 1, map_index + 12) for name in MapArrays.LUMP_NAMES
+    })
+    missed = find_missed_pairs(map_arrays, build_pvs(map_arrays))
+    print(f"{map_name}: {len(missed)} visible pairs missing from the PVS")
+    for pair in sorted(missed)[:10]:
+        print(*pair)
+    sys.exit(1 if missed else 0)
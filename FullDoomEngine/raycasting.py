@@ -14,6 +14,9 @@ class RayCasting:
         """
         Traverse the BSP tree, find the first segment intersected by ray.
         """
+        if SPATIAL_INDEX == 'blockmap':
+            return self.cast_ray_blockmap(start_pos, direction, distance)
+
         def recurse(node_id):
             if node_id >= self.bsp.SUB_SECTOR_IDENTIFIER:
                 sub_id = node_id - self.bsp.SUB_SECTOR_IDENTIFIER
@@ -45,6 +48,26 @@ class RayCasting:
             return recurse(second)
         return recurse(self.bsp.root_node_id)
 
+    def cast_ray_blockmap(self, start_pos, direction, distance):
+        """
+        Nearest segment intersected by the ray within distance, testing
+        only the linedefs in the blockmap blocks along it.
+        """
+        end_pos = start_pos + direction * distance
+        linedefs = self.engine.wad_data.linedefs
+        closest_hit = None
+        closest_t = distance + 1
+        for line_id in self.engine.wad_data.blockmap.linedefs_along_line(
+                start_pos.x, start_pos.y, end_pos.x, end_pos.y):
+            for seg in linedefs[line_id].segs:
+                result = self.intersect_ray_segment(start_pos, direction, seg.start_vertex, seg.end_vertex)
+                if result:
+                    _, t = result
+                    if t < closest_t and t <= distance:
+                        closest_hit = seg
+                        closest_t = t
+        return closest_hit
+
     def find_activatable_surface(self):
         ray_start = self.player.pos
         angle_rad = math.radians(self.player.angle)
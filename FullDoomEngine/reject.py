@@ -0,0 +1,21 @@
+class RejectTable:
+    """
+    The REJECT lump: one bit per (sector, sector) pair, set when nothing
+    in the first sector can possibly see into the second, so that sight
+    checks between them can be skipped without tracing a line.
+    """
+    def __init__(self, bits, num_sectors):
+        self.bits = bits  # packed, bit i of byte j is pair 8 * j + i
+        self.num_sectors = num_sectors
+
+    @classmethod
+    def from_lump(cls, data, num_sectors):
+        # a missing or short lump (some map editors write an empty one)
+        # is padded with zeros, i.e. nothing rejected
+        num_bytes = (num_sectors * num_sectors + 7) // 8
+        bits = bytes(data[:num_bytes])
+        return cls(bits.ljust(num_bytes, b'\0'), num_sectors)
+
+    def is_rejected(self, sector_a, sector_b):
+        pair = sector_a * self.num_sectors + sector_b
+        return (self.bits[pair >> 3] >> (pair & 7)) & 1 == 1
@@ -1,6 +1,12 @@
 import math
+import numba
+from numba.typed import List
 import numpy as np
 from doomsettings import *
+from lighting import LIGHT_SEG_SHIFT, get_light_num
+from solid_segs import SolidSegs
+from visplanes import Visplanes, draw_planes
+from wall_renderer import *
 
 class SegHandler:
     MAX_SCALE = 64.0
@@ -10,35 +16,66 @@ class SegHandler:
         self.engine = engine
         self.wad_data = engine.wad_data
         self.player = engine.player
-        self.framebuffer = engine.framebuffer
         self.textures = self.wad_data.asset_data.textures
         self.sky_id = self.wad_data.asset_data.sky_id
         self.seg = None
         self.rw_angle1 = None
-        self.screen_range: set = None
-        self.x_to_angle = self.get_x_to_angle_table()
-        self.upper_clip, self.lower_clip = [], []
+        # stands in for the textures of the parts of a wall that aren't
+        # drawn: never read, but one of the WAD's, so that draw_wall_range
+        # is always called with the same array types
+        self.no_texture_id = self.sky_id
+
+        # the buffers sized for the engine's render resolution
+        self.viewport = None
+        self.resize()
+
+        # the wall ranges packed this frame, kept as the drawsegs sprites
+        # are clipped with. With RENDER_THREADS they are only packed while
+        # the BSP is walked, and drawn at the end of it in parallel strips
+        self.num_render_threads = min(RENDER_THREADS, numba.config.NUMBA_NUM_THREADS)
+        numba.set_num_threads(max(self.num_render_threads, 1))
+        self.wall_ranges, self.wall_texture_ids = [], []
+        self.drawsegs = np.empty((0, WALL_PARAMS))
+        # the textures drawn this frame, as numba needs them in a typed
+        # List. Emptied every frame, so as not to keep evicted ones alive
+        self.texture_list = List.empty_list(numba.typeof(self.textures[self.sky_id]))
+        self.texture_indices = {}
+
+    def resize(self):
+        self.viewport = self.engine.viewport
+        self.framebuffer = self.engine.framebuffer
+        width = self.viewport.width
+        # columns already covered by solid walls this frame
+        self.solid_segs = SolidSegs(width)
+        self.x_to_angle = self.viewport.x_to_angle
+        # per column, the last row drawn from the top and the first from the bottom
+        self.upper_clip = np.empty(width, dtype=np.int64)
+        self.lower_clip = np.empty(width, dtype=np.int64)
+        # floors and ceilings, drawn once all the walls are
+        self.visplanes = Visplanes(width)
+        # the sprite clip arrays of the drawsegs, as Doom's openings
+        self.openings = np.empty(8 * width, dtype=np.int64)
+        self.num_openings = 0
 
     def update(self):
+        if self.viewport is not self.engine.viewport:
+            self.resize()
         self.init_floor_ceil_clip_height()
-        self.init_screen_range()
+        self.solid_segs.reset()
+        self.visplanes.reset()
+        self.num_openings = 0
+        self.wall_ranges.clear()
+        self.wall_texture_ids.clear()
+        self.texture_list.clear()
+        self.texture_indices.clear()
 
     def init_floor_ceil_clip_height(self):
-        self.upper_clip = [-1 for _ in range(WIDTH)]
-        self.lower_clip = [HEIGHT for _ in range(WIDTH)]
-
-
-    @staticmethod
-    def get_x_to_angle_table():
-        x_to_angle = []
-        for i in range(0, WIDTH +1):
-            angle = math.degrees(math.atan((H_WIDTH -i) / SCREEN_DIST))
-            x_to_angle.append(angle)
-        return x_to_angle
-    
+        self.upper_clip.fill(-1)
+        self.lower_clip.fill(self.viewport.height)
+
     def scale_from_global_angle(self, x, rw_normal_angle, rw_distance):
         x_angle = self.x_to_angle[x]
-        num = SCREEN_DIST * math.cos(math.radians(rw_normal_angle - x_angle - self.player.angle))
+        num = self.viewport.projection_y * math.cos(math.radians(rw_normal_angle - x_angle - self.player.angle))
         den = rw_distance * math.cos(math.radians(x_angle))
 
         scale = num / den
@@ -47,19 +84,10 @@ class SegHandler:
 
 
     def draw_solid_wall_range(self, x1, x2):
-        seg=self.seg
+        seg = self.seg
         front_sector = seg.front_sector
         line = seg.linedef
         side = line.front_sidedef
-        renderer = self.engine.view_renderer
-        upper_clip = self.upper_clip
-        lower_clip = self.lower_clip
-        framebuffer = self.framebuffer
-
-        wall_texture_id = side.middle_texture
-        ceil_texture_id = front_sector.ceil_texture
-        floor_texture_id = front_sector.floor_texture
-        light_level = front_sector.light_level
 
         world_front_z1 = front_sector.ceil_height - self.player.view_height
         world_front_z2 = front_sector.floor_height - self.player.view_height
@@ -69,91 +97,24 @@ class SegHandler:
         b_draw_ceil = world_front_z1 > 0
         b_draw_floor = world_front_z2 < 0
 
-        # Wall segment vector and length in world space
-        wall_dx = seg.end_vertex[0] - seg.start_vertex[0]
-        wall_dy = seg.end_vertex[1] - seg.start_vertex[1]
-        wall_len = math.hypot(wall_dx, wall_dy)
-        wall_dir = (wall_dx / wall_len, wall_dy / wall_len)
-
-        # calculate scaling factors for left and right edges of the wall range
-        rw_normal_angle = seg.angle + 90
-        offset_angle = rw_normal_angle - self.rw_angle1
-
-        hypoteneuse = math.dist(self.player.pos, seg.start_vertex)
-        rw_distance = hypoteneuse * math.cos(math.radians(offset_angle))
-        rw_scale1 = self.scale_from_global_angle(x1, rw_normal_angle, rw_distance)
-
-        if math.isclose(offset_angle % 360, 90, abs_tol=1):
-            rw_scale1 *= 0.01
-
-        if x1 < x2:
-            scale2 = self.scale_from_global_angle(x2, rw_normal_angle, rw_distance)
-            rw_scale_step = (scale2 - rw_scale1) / (x2 - x1)
-        else:
-            rw_scale_step = 0
-
         # determine how the wall texture are vertically aligned
-        wall_texture = self.textures[wall_texture_id]
+        wall_texture_id = side.middle_texture if b_draw_wall else self.no_texture_id
         if line.flags & self.wad_data.LINEDEF_FLAGS['DONT_PEG_BOTTOM']:
-            v_top = front_sector.floor_height + wall_texture.shape[1]
+            v_top = front_sector.floor_height + self.textures[wall_texture_id].shape[1]
             middle_tex_alt = v_top - self.player.view_height
         else:
             middle_tex_alt = world_front_z1
         middle_tex_alt += side.y_offset
 
-        # determine how the wall textures are horizontally aligned
-        rw_offset = hypoteneuse * math.sin(math.radians(offset_angle))
-        rw_offset += seg.offset + side.x_offset
-        rw_center_angle = rw_normal_angle - self.player.angle
-
-        # determine where on the screen the wall is drawn:
-        wall_y1 = H_HEIGHT - world_front_z1 * rw_scale1
-        wall_y1_step = -rw_scale_step * world_front_z1
-        wall_y2 = H_HEIGHT - world_front_z2 * rw_scale1
-        wall_y2_step = -rw_scale_step * world_front_z2
-
-        # player position
-        player_x, player_y = self.player.pos
-
-        # render loop
-        for x in range(x1, x2+1):
-            draw_wall_y1 = wall_y1 - 1
-            draw_wall_y2 = wall_y2
-            # Update clipping buffers
-
-            if b_draw_ceil:
-                cy1 = upper_clip[x] + 1
-                cy2 = int(min(draw_wall_y1 - 1, lower_clip[x] - 1))
-                renderer.draw_flat(ceil_texture_id, light_level, x, cy1, cy2, world_front_z1)
-
-            if b_draw_wall:
-                wy1 = int(max(draw_wall_y1, upper_clip[x] + 1))
-                wy2 = int(min(draw_wall_y2, lower_clip[x] -1))
-                if wy1 < wy2:
-                    angle = rw_center_angle - self.x_to_angle[x]
-                    # Get horizontal distance along wall from texture coordinate logic
-                    wall_offset_along = rw_distance * math.tan(math.radians(angle)) - rw_offset 
-                    # Convert wall offset to wall/ray intersection world coords
-                    intersect_x = seg.start_vertex[0] + wall_dir[0] * wall_offset_along
-                    intersect_y = seg.start_vertex[1] + wall_dir[1] * wall_offset_along
-                    # Raw distance from player to intersection
-                    hit_dist = math.hypot(intersect_x - player_x, intersect_y - player_y)                
-                    inv_scale = 1.0 / rw_scale1
-                    # update wall_depth buffer
-                    renderer.z_buffer[x, wy1:wy2] = hit_dist
-                    renderer.draw_wall_col(
-                        framebuffer, wall_texture, wall_offset_along, x, wy1, wy2,
-                        middle_tex_alt, inv_scale, light_level,
-                    )
-                
-            if b_draw_floor:
-                fy1 = int(max(draw_wall_y2 + 1, upper_clip[x] + 1))
-                fy2 = lower_clip[x] -1
-                renderer.draw_flat(floor_texture_id, light_level, x, fy1, fy2, world_front_z2)
-
-            rw_scale1 += rw_scale_step
-            wall_y1 += wall_y1_step
-            wall_y2 += wall_y2_step
+        flags = IS_SOLID
+        flags |= DRAW_UPPER if b_draw_wall else 0
+        flags |= DRAW_CEIL if b_draw_ceil else 0
+        flags |= DRAW_FLOOR if b_draw_floor else 0
+        wall = self.pack_wall_range(
+            x1, x2, flags, world_front_z1, world_front_z2, 0, 0, middle_tex_alt, 0,
+            SIL_SOLID, 0, 0,
+        )
+        self.draw_wall_range(wall, wall_texture_id, self.no_texture_id)
 
     def draw_portal_wall_range(self, x1, x2):
         seg = self.seg
@@ -161,24 +122,6 @@ class SegHandler:
         back_sector = seg.back_sector
         line = seg.linedef
         side = line.front_sidedef
-        renderer = self.engine.view_renderer
-        upper_clip = self.upper_clip
-        lower_clip = self.lower_clip
-        framebuffer = self.framebuffer
-
-        upper_wall_texture = side.upper_texture
-        lower_wall_texture = side.lower_texture
-        tex_ceil_id = front_sector.ceil_texture
-        tex_floor_id = front_sector.floor_texture
-        light_level = front_sector.light_level
-
-        player_x, player_y = self.player.pos
-
-        # Wall segment vector and length in world space
-        wall_dx = seg.end_vertex[0] - seg.start_vertex[0]
-        wall_dy = seg.end_vertex[1] - seg.start_vertex[1]
-        wall_len = math.hypot(wall_dx, wall_dy)
-        wall_dir = (wall_dx / wall_len, wall_dy / wall_len)
 
         # calculate relative plane heights of front and back sector
         world_front_z1 = front_sector.ceil_height - self.player.view_height
@@ -186,6 +129,24 @@ class SegHandler:
         world_front_z2 = front_sector.floor_height - self.player.view_height
         world_back_z2 = back_sector.floor_height - self.player.view_height
 
+        # which of the portal's edges hide sprites behind it, and from
+        # which heights, as in R_StoreWallRange
+        silhouette = 0
+        bottom_sil_z, top_sil_z = math.inf, -math.inf
+        if world_front_z2 > world_back_z2:
+            silhouette |= SIL_BOTTOM
+            bottom_sil_z = world_front_z2
+        elif world_back_z2 > 0:
+            silhouette |= SIL_BOTTOM
+        if world_front_z1 < world_back_z1:
+            silhouette |= SIL_TOP
+            top_sil_z = world_front_z1
+        elif world_back_z1 < 0:
+            silhouette |= SIL_TOP
+        # closed doors hide everything
+        if world_back_z1 <= world_front_z2 or world_back_z2 >= world_front_z1:
+            silhouette = SIL_SOLID
+
         # sky hack
         if front_sector.ceil_texture == back_sector.ceil_texture == self.sky_id:
             world_front_z1 = world_back_z1
@@ -212,35 +173,22 @@ class SegHandler:
         # if nothing to be rendered, return early
         if (not b_draw_upper_wall and not b_draw_ceil and not b_draw_lower_wall and not b_draw_floor):
             return None
-        # calculate scaling factors of left and right edges
-        rw_normal_angle = seg.angle + 90
-        offset_angle = rw_normal_angle - self.rw_angle1
-
-        hypoteneuse = math.dist(self.player.pos, seg.start_vertex)
-        rw_distance = hypoteneuse * math.cos(math.radians(offset_angle))
-
-        rw_scale1 = self.scale_from_global_angle(x1, rw_normal_angle, rw_distance)
-        if math.isclose(offset_angle % 360, 90, abs_tol=1):
-            rw_scale1 *= 0.01
-        if x2 > x1:
-            scale2 = self.scale_from_global_angle(x2, rw_normal_angle, rw_distance)
-            rw_scale_step = (scale2 - rw_scale1) / (x2 - x1)
-        else:
-            rw_scale_step = 0
 
         # determine how the wall textures are vertically aligned
+        upper_wall_texture = lower_wall_texture = self.no_texture_id
+        upper_tex_alt = lower_tex_alt = 0
         if b_draw_upper_wall:
-            upper_wall_texture = self.textures[side.upper_texture]
+            upper_wall_texture = side.upper_texture
 
             if line.flags & self.wad_data.LINEDEF_FLAGS['DONT_PEG_TOP']:
                 upper_tex_alt = world_front_z1
             else:
-                v_top = back_sector.ceil_height + upper_wall_texture.shape[1]
+                v_top = back_sector.ceil_height + self.textures[upper_wall_texture].shape[1]
                 upper_tex_alt = v_top - self.player.view_height
             upper_tex_alt += side.y_offset
 
         if b_draw_lower_wall:
-            lower_wall_texture = self.textures[side.lower_texture]
+            lower_wall_texture = side.lower_texture
 
             if line.flags & self.wad_data.LINEDEF_FLAGS['DONT_PEG_BOTTOM']:
                 lower_tex_alt = world_front_z1
@@ -248,172 +196,198 @@ class SegHandler:
                 lower_tex_alt = world_back_z2
             lower_tex_alt += side.y_offset
 
-        # determine how the wall textures are horizontally aligned
-        if seg_textured:= b_draw_upper_wall or b_draw_lower_wall:
-            rw_offset = hypoteneuse * math.sin(math.radians(offset_angle))
-            rw_offset += seg.offset + side.x_offset
-            
-            rw_center_angle = rw_normal_angle - self.player.angle
+        flags = 0
+        flags |= DRAW_UPPER if b_draw_upper_wall else 0
+        flags |= DRAW_LOWER if b_draw_lower_wall else 0
+        flags |= DRAW_CEIL if b_draw_ceil else 0
+        flags |= DRAW_FLOOR if b_draw_floor else 0
+        wall = self.pack_wall_range(
+            x1, x2, flags, world_front_z1, world_front_z2, world_back_z1, world_back_z2,
+            upper_tex_alt, lower_tex_alt, silhouette, bottom_sil_z, top_sil_z,
+        )
+        self.draw_wall_range(wall, upper_wall_texture, lower_wall_texture)
+
+    def pack_wall_range(self, x1, x2, flags, front_z1, front_z2, back_z1, back_z2,
+                        upper_tex_alt, lower_tex_alt, silhouette, bottom_sil_z, top_sil_z):
+        """
+        The current seg's columns x1 to x2 as the float64 array of
+        WALL_PARAMS values draw_wall_range takes, adding what is common to
+        solid and portal walls: scale, texture offsets, lighting and the
+        room for its sprite clip arrays.
+        """
+        seg = self.seg
+        side = seg.linedef.front_sidedef
+        front_sector = seg.front_sector
 
+        # Wall segment vector and length in world space
+        wall_dx = seg.end_vertex[0] - seg.start_vertex[0]
+        wall_dy = seg.end_vertex[1] - seg.start_vertex[1]
+        wall_len = math.hypot(wall_dx, wall_dy)
 
-        # y positions of the top/bottom edges on the screen
-        wall_y1 = H_HEIGHT - world_front_z1 * rw_scale1
-        wall_y1_step = -rw_scale_step * world_front_z1
-        wall_y2 = H_HEIGHT - world_front_z2 * rw_scale1
-        wall_y2_step = -rw_scale_step * world_front_z2
+        # calculate scaling factors of left and right edges
+        rw_normal_angle = seg.angle + 90
+        offset_angle = rw_normal_angle - self.rw_angle1
 
-        # the y position of the top edge of the portal
-        if b_draw_upper_wall:
-            if world_back_z1 > world_front_z2:
-                portal_y1 = H_HEIGHT - world_back_z1 * rw_scale1
-                portal_y1_step = -rw_scale_step * world_back_z1
-            else:
-                portal_y1 = wall_y2
-                portal_y1_step = wall_y2_step
+        hypoteneuse = self.engine.bsp.vertex_dists[seg.start_vertex_id]
+        rw_distance = hypoteneuse * math.cos(math.radians(offset_angle))
 
-        if b_draw_lower_wall:
-            if world_back_z2 < world_front_z1:
-                portal_y2 = H_HEIGHT - world_back_z2 * rw_scale1
-                portal_y2_step = -rw_scale_step * world_back_z2
-            else:
-                portal_y2 = wall_y1
-                portal_y2_step = wall_y1_step
-
-        upper_clip = self.upper_clip
-        lower_clip = self.lower_clip
-
-        # rendering 
-        for x in range(x1, x2 + 1):
-            draw_wall_y1 = wall_y1 - 1
-            draw_wall_y2 = wall_y2
-            # for z_buffer
-            hit_dist = np.inf
-
-            if seg_textured:
-                angle = rw_center_angle - self.x_to_angle[x]
-                wall_offset_along = rw_distance * math.tan(math.radians(angle)) - rw_offset
-                # Convert wall offset to intersection world coords
-                intersect_x = seg.start_vertex[0] + wall_dir[0] * wall_offset_along
-                intersect_y = seg.start_vertex[1] + wall_dir[1] * wall_offset_along
-                # Raw distance from player to intersection
-                hit_dist = math.hypot(intersect_x - player_x, intersect_y - player_y)
-
-                inv_scale = 1.0 / rw_scale1
-
-
-            if b_draw_upper_wall:
-                draw_upper_wall_y1 = wall_y1 - 1
-                draw_upper_wall_y2 = portal_y1
-                if b_draw_ceil:
-                    cy1 = upper_clip[x] + 1
-                    cy2 = int(min(draw_wall_y1 - 1, lower_clip[x] - 1))
-                    renderer.draw_flat(tex_ceil_id, light_level, x, cy1, cy2, world_front_z1)
-                
-                wy1 = int(max(draw_upper_wall_y1, upper_clip[x] + 1))
-                wy2 = int(min(draw_upper_wall_y2, lower_clip[x] - 1))
-                # clamp to screen
-                wy1 = max(0, min(wy1, HEIGHT))
-                wy2 = max(0, min(wy2, HEIGHT))
-                # check that wy2 is bigger than wy1
-                if wy1 < wy2:
-                    # update wall_depth buffer
-                    renderer.z_buffer[x, wy1:wy2] = hit_dist
-                    # draw the column
-                    renderer.draw_wall_col(
-                        framebuffer, upper_wall_texture, wall_offset_along, x, wy1, wy2,
-                        upper_tex_alt, inv_scale, light_level,
-                    )
-                
-                if upper_clip[x] < wy2:
-                    upper_clip[x] = wy2
-                
-                portal_y1 += portal_y1_step
-            if b_draw_ceil:
-                cy1 = upper_clip[x] + 1
-                cy2 = int(min(draw_wall_y1 - 1, lower_clip[x] - 1))
-                renderer.draw_flat(tex_ceil_id, light_level, x, cy1, cy2, world_front_z1)
-                
-                
-                if upper_clip[x] < cy2:
-                    upper_clip[x] = cy2
-
-            if b_draw_lower_wall:
-                
-                if b_draw_floor:
-                    fy1 = int(max(draw_wall_y2 + 1, upper_clip[x] + 1))
-                    fy2 = lower_clip[x] - 1
-                    renderer.draw_flat(tex_floor_id, light_level, x, fy1, fy2, world_front_z2)
-                
-                draw_lower_wall_y1 = portal_y2 - 1
-                draw_lower_wall_y2 = wall_y2
-                
-                wy1 = int(max(draw_lower_wall_y1, upper_clip[x] + 1))
-                wy2 = int(min(draw_lower_wall_y2, lower_clip[x] - 1))
-                # clamp to screen height
-                wy1 = max(0, min(wy1, HEIGHT))
-                wy2 = max(0, min(wy2, HEIGHT))
-                # check that wy2 is bigger than wy1
-                if wy1 < wy2:                    
-                    # update z buffer
-                    renderer.z_buffer[x, wy1:wy2] = hit_dist
-                    # draw the wall column
-                    renderer.draw_wall_col(
-                        framebuffer, lower_wall_texture, wall_offset_along, x, wy1, wy2,
-                        lower_tex_alt, inv_scale, light_level,
-                    )
-                if lower_clip[x] > wy1:
-                    lower_clip[x] = wy1
-                portal_y2 += portal_y2_step
-
-            if b_draw_floor:
-                fy1 = int(max(draw_wall_y2 + 1, upper_clip[x] + 1))
-                fy2 = lower_clip[x] - 1
-                renderer.draw_flat(tex_floor_id, light_level, x, fy1, fy2, world_front_z2)
-                if lower_clip[x] > draw_wall_y2 + 1:
-                    lower_clip[x] = fy1
-
-            rw_scale1 += rw_scale_step
-            wall_y1 += wall_y1_step
-            wall_y2 += wall_y2_step
-
-
-    def init_screen_range(self):
-        self.screen_range = set(range(WIDTH))
+        scale1 = rw_scale1 = self.scale_from_global_angle(x1, rw_normal_angle, rw_distance)
+        if math.isclose(offset_angle % 360, 90, abs_tol=1):
+            rw_scale1 *= 0.01
+        if x2 > x1:
+            scale2 = self.scale_from_global_angle(x2, rw_normal_angle, rw_distance)
+            rw_scale_step = (scale2 - rw_scale1) / (x2 - x1)
+        else:
+            scale2 = scale1
+            rw_scale_step = 0
 
-    def clip_solid_walls(self, x_start, x_end):
-        if self.screen_range:
-            curr_wall = set(range(x_start, x_end))
-            if intersection := curr_wall & self.screen_range:
-                if len(intersection) == len(curr_wall):
-                    self.draw_solid_wall_range(x_start, x_end -1)
-                else:
-                    arr = sorted(intersection)
-                    x, x2 = arr[0], arr[-1]
-                    for x1, x2 in zip(arr, arr[1:]):
-                        if x2 - x1 > 1:
-                            self.draw_solid_wall_range(x, x1)
-                            x = x2
-                    self.draw_solid_wall_range(x, x2)
-
-                self.screen_range -= intersection
+        # determine how the wall textures are horizontally aligned
+        rw_offset = hypoteneuse * math.sin(math.radians(offset_angle))
+        rw_offset += seg.offset + side.x_offset
+        rw_center_angle = rw_normal_angle - self.player.angle
+
+        # visplanes of the ceiling and floor, -1 for those not drawn
+        z_light_num = front_sector.light_level >> LIGHT_SEG_SHIFT
+        ceil_plane = floor_plane = -1
+        if flags & DRAW_CEIL:
+            ceil_plane = self.find_plane(front_z1, front_sector.ceil_texture, z_light_num, x1, x2)
+        if flags & DRAW_FLOOR:
+            floor_plane = self.find_plane(front_z2, front_sector.floor_texture, z_light_num, x1, x2)
+
+        # upper then lower clip of each column, for portals clipping sprites
+        clip_offset = -1
+        if silhouette & (SIL_TOP | SIL_BOTTOM):
+            clip_offset = self.alloc_openings(2 * (x2 - x1 + 1))
+
+        wall = np.empty(WALL_PARAMS)
+        wall[WALL_X1], wall[WALL_X2] = x1, x2
+        wall[WALL_SCALE1], wall[WALL_SCALE_STEP] = rw_scale1, rw_scale_step
+        wall[WALL_DISTANCE], wall[WALL_OFFSET] = rw_distance, rw_offset
+        wall[WALL_CENTER_ANGLE] = rw_center_angle
+        wall[WALL_START_X], wall[WALL_START_Y] = seg.start_vertex
+        wall[WALL_DIR_X], wall[WALL_DIR_Y] = wall_dx / wall_len, wall_dy / wall_len
+        wall[WALL_FRONT_Z1], wall[WALL_FRONT_Z2] = front_z1, front_z2
+        wall[WALL_BACK_Z1], wall[WALL_BACK_Z2] = back_z1, back_z2
+        wall[WALL_UPPER_TEX_ALT], wall[WALL_LOWER_TEX_ALT] = upper_tex_alt, lower_tex_alt
+        wall[WALL_LIGHT_NUM] = get_light_num(front_sector.light_level, seg)
+        wall[WALL_CEIL_PLANE], wall[WALL_FLOOR_PLANE] = ceil_plane, floor_plane
+        wall[WALL_SILHOUETTE] = silhouette
+        wall[WALL_BOTTOM_SIL_Z], wall[WALL_TOP_SIL_Z] = bottom_sil_z, top_sil_z
+        wall[WALL_CLIP_OFFSET] = clip_offset
+        wall[WALL_FLAGS] = flags
+        wall[WALL_SIL_SCALE1], wall[WALL_SIL_SCALE2] = scale1, scale2
+        return wall
+
+    def find_plane(self, height, texture_id, z_light_num, x1, x2):
+        is_sky = texture_id == self.sky_id
+        return self.visplanes.find_plane(
+            height, self.get_texture_index(texture_id), z_light_num, is_sky, x1, x2,
+        )
+
+    def alloc_openings(self, size):
+        # index of size values in openings, grown as needed
+        offset = self.num_openings
+        self.num_openings += size
+        if self.num_openings > len(self.openings):
+            extra = max(self.num_openings, len(self.openings))
+            self.openings = np.concatenate([self.openings, np.empty(extra, dtype=np.int64)])
+        return offset
+
+    def draw_wall_range(self, wall, upper_texture_id, lower_texture_id):
+        self.wall_ranges.append(wall)
+        if self.num_render_threads:
+            self.wall_texture_ids.append([
+                self.get_texture_index(upper_texture_id), self.get_texture_index(lower_texture_id),
+            ])
+            return
+        renderer = self.engine.view_renderer
+        draw_wall_range(
+            wall, self.viewport.params, self.framebuffer,
+            self.upper_clip, self.lower_clip, self.openings,
+            self.textures[upper_texture_id], self.textures[lower_texture_id],
+            self.visplanes.plane_top, self.visplanes.plane_bottom,
+            self.x_to_angle, renderer.light_palettes, renderer.scale_light,
+            0, self.viewport.width - 1,
+        )
+
+    def get_texture_index(self, texture_id):
+        if texture_id not in self.texture_indices:
+            self.texture_indices[texture_id] = len(self.texture_list)
+            self.texture_list.append(self.textures[texture_id])
+        return self.texture_indices[texture_id]
+
+    def draw_deferred(self):
+        """
+        What is left to draw once the BSP has been walked: the wall ranges
+        packed with RENDER_THREADS, then the visplanes. The wall ranges
+        are then kept as the frame's drawsegs.
+        """
+        renderer = self.engine.view_renderer
+        visplanes = self.visplanes
+        if self.wall_ranges:
+            self.drawsegs = np.stack(self.wall_ranges)
         else:
-            self.engine.bsp.is_traverse_bsp = False
+            self.drawsegs = np.empty((0, WALL_PARAMS))
+        # strips and planes are handed out one at a time, to balance the load
+        with numba.parallel_chunksize(1):
+            if self.num_render_threads and self.wall_ranges:
+                draw_wall_ranges(
+                    self.drawsegs, np.array(self.wall_texture_ids, dtype=np.int64),
+                    self.texture_list, self.num_render_threads * RENDER_STRIPS_PER_THREAD,
+                    self.viewport.params, self.framebuffer,
+                    self.upper_clip, self.lower_clip, self.openings,
+                    visplanes.plane_top, visplanes.plane_bottom,
+                    self.x_to_angle, renderer.light_palettes, renderer.scale_light,
+                )
+            draw_planes(
+                visplanes.plane_top, visplanes.plane_bottom, visplanes.min_x, visplanes.max_x,
+                visplanes.heights, visplanes.texture_ids, visplanes.z_light_nums,
+                visplanes.is_sky, visplanes.num_planes, self.texture_list, renderer.sky_tex,
+                self.viewport.params, self.framebuffer, self.x_to_angle, renderer.light_palettes,
+                renderer.z_light, self.player.pos.x, self.player.pos.y, self.player.angle,
+            )
+
+    def clip_sprite(self, thing, x1, x2):
+        """
+        Rows the sprite of a thing shows between in columns x1 to x2,
+        clipped by the drawsegs in front of it (see clip_sprite).
+        """
+        return clip_sprite(
+            self.drawsegs, self.openings, x1, x2,
+            self.viewport.projection_y / thing.depth, thing.pos.x, thing.pos.y,
+            thing.bottom_z, thing.top_z, self.player.pos.x, self.player.pos.y,
+            self.viewport.height,
+        )
+
+    def get_wall_depths(self):
+        """
+        Per column, the depth of the nearest wall hiding everything behind
+        it, from the drawsegs (inf where there is none). For debugging.
+        """
+        depths = np.full(self.viewport.width, np.inf)
+        for ds in self.drawsegs:
+            if ds[WALL_SILHOUETTE] != SIL_SOLID:
+                continue
+            x1, x2 = int(ds[WALL_X1]), int(ds[WALL_X2])
+            scales = np.linspace(ds[WALL_SIL_SCALE1], ds[WALL_SIL_SCALE2], x2 - x1 + 1)
+            depths[x1:x2 + 1] = np.minimum(depths[x1:x2 + 1], self.viewport.projection_y / scales)
+        return depths
+
+    def is_range_occluded(self, x_start, x_end):
+        # whether solid walls already cover every column in [x_start, x_end)
+        return self.solid_segs.is_covered(x_start, x_end - 1)
 
+    def clip_solid_walls(self, x_start, x_end):
+        if self.solid_segs.is_full():
+            self.engine.bsp.is_traverse_bsp = False
+            return
+        for x1, x2 in self.solid_segs.visible_spans(x_start, x_end - 1):
+            self.draw_solid_wall_range(x1, x2)
+        self.solid_segs.add(x_start, x_end - 1)
 
     def clip_portal_walls(self, x_start, x_end):
-        curr_wall = set(range(x_start, x_end))
-
-        if intersection := curr_wall & self.screen_range:
-            if len(intersection) == len(curr_wall):
-                self.draw_portal_wall_range(x_start, x_end -1)
-            else:
-                arr = sorted(intersection)
-                x = arr[0]
-                for x1, x2 in zip(arr, arr[1:]):
-                    if x2 - x1 > 1:
-                        self.draw_portal_wall_range(x, x1)
-                        x = x2
-                self.draw_portal_wall_range(x, arr[-1])
+        for x1, x2 in self.solid_segs.visible_spans(x_start, x_end - 1):
+            self.draw_portal_wall_range(x1, x2)
 
     def classify_segment(self, segment, x1, x2, rw_angle1):
         self.seg = segment
@@ -0,0 +1,94 @@
+from doomsettings import *
+
+
+def lines_cross(ax, ay, bx, by, cx, cy, dx, dy):
+    # whether segment a-b properly crosses segment c-d (touching doesn't count)
+    abx, aby = bx - ax, by - ay
+    cdx, cdy = dx - cx, dy - cy
+    side_c = abx * (cy - ay) - aby * (cx - ax)
+    side_d = abx * (dy - ay) - aby * (dx - ax)
+    if (side_c > 0) == (side_d > 0) or side_c == 0 or side_d == 0:
+        return False
+    side_a = cdx * (ay - cy) - cdy * (ax - cx)
+    side_b = cdx * (by - cy) - cdy * (bx - cx)
+    return (side_a > 0) != (side_b > 0) and side_a != 0 and side_b != 0
+
+
+class Sight:
+    """
+    Line of sight between things (or the player): first the REJECT table,
+    which rules out most pairs of sectors in O(1), then a trace of the
+    sight line through the BSP tree or the blockmap (SPATIAL_INDEX),
+    blocked by one sided lines and by two sided ones with no opening
+    between floor and ceiling, e.g. closed doors.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.bsp = engine.bsp
+        self.reject = engine.wad_data.reject
+        self.blockmap = engine.wad_data.blockmap
+        self.linedefs = engine.wad_data.linedefs
+
+    def can_see(self, thing_a, thing_b):
+        # thing_a and thing_b are things or the player, located with BSP.locate
+        sector_a = self.bsp.sub_sector_sector[self.bsp.locate(thing_a)]
+        sector_b = self.bsp.sub_sector_sector[self.bsp.locate(thing_b)]
+        if self.reject.is_rejected(sector_a, sector_b):
+            return False
+        if SPATIAL_INDEX == 'blockmap':
+            return self.trace_blockmap(thing_a.pos, thing_b.pos)
+        return self.trace_bsp(thing_a.pos, thing_b.pos)
+
+    def is_blocking(self, linedef):
+        if linedef.back_sidedef is None:
+            return True
+        front, back = linedef.front_sidedef.sector, linedef.back_sidedef.sector
+        return min(front.ceil_height, back.ceil_height) <= max(front.floor_height, back.floor_height)
+
+    def crosses_linedef(self, start, end, linedef):
+        v1, v2 = self.linedef_vertices(linedef)
+        return lines_cross(start.x, start.y, end.x, end.y, v1.x, v1.y, v2.x, v2.y)
+
+    def linedef_vertices(self, linedef):
+        vertexes = self.engine.wad_data.vertexes
+        return vertexes[linedef.start_vertex_id], vertexes[linedef.end_vertex_id]
+
+    def trace_blockmap(self, start, end):
+        for line_id in self.blockmap.linedefs_along_line(start.x, start.y, end.x, end.y):
+            linedef = self.linedefs[line_id]
+            if self.is_blocking(linedef) and self.crosses_linedef(start, end, linedef):
+                return False
+        return True
+
+    def trace_bsp(self, start, end):
+        # only the sub sectors the sight line passes through: a node's far
+        # side is entered only if the line crosses its partition
+        checked = set()
+        node_stack = [self.bsp.root_node_id]
+        while node_stack:
+            node_id = node_stack.pop()
+            if node_id >= self.bsp.SUB_SECTOR_IDENTIFIER:
+                sub_sector = self.bsp.sub_sectors[node_id - self.bsp.SUB_SECTOR_IDENTIFIER]
+                for i in range(sub_sector.seg_count):
+                    seg = self.bsp.segments[sub_sector.first_seg_id + i]
+                    if seg.linedef_id in checked:
+                        continue
+                    checked.add(seg.linedef_id)
+                    if self.is_blocking(seg.linedef) and self.crosses_linedef(start, end, seg.linedef):
+                        return False
+                continue
+            node = self.bsp.nodes[node_id]
+            start_side = self.point_side(node, start)
+            end_side = self.point_side(node, end)
+            start_child = node.back_child_id if start_side else node.front_child_id
+            if start_side != end_side:
+                node_stack.append(node.front_child_id if start_side else node.back_child_id)
+            node_stack.append(start_child)
+        return True
+
+    @staticmethod
+    def point_side(node, position):
+        # as BSP.is_on_back_side, but without treating (0, 0) as the player's position
+        dx = position.x - node.x_partition
+        dy = position.y - node.y_partition
+        return dx * node.dy_partition - dy * node.dx_partition <= 0
@@ -0,0 +1,68 @@
+from bisect import bisect_left, bisect_right
+
+# sentinels either side of the screen, so that every column has a range
+# at or before it and after it
+FAR_LEFT = -(1 << 31)
+FAR_RIGHT = 1 << 31
+
+
+class SolidSegs:
+    """
+    Screen columns already covered by solid walls, as Doom's solidsegs:
+    a sorted list of disjoint, non touching ranges [first, last] of
+    columns (both included), kept as two parallel lists. Columns off
+    either side of the screen count as covered.
+    """
+    def __init__(self, width):
+        self.width = width
+        self.reset()
+
+    def reset(self):
+        self.firsts = [FAR_LEFT, self.width]
+        self.lasts = [-1, FAR_RIGHT]
+
+    def is_full(self):
+        # every column covered, the two sentinels having merged
+        return len(self.firsts) == 1
+
+    def is_covered(self, x1, x2):
+        # whether columns x1 to x2 (included) are all covered
+        if x2 < x1:
+            return True
+        i = bisect_right(self.firsts, x1) - 1
+        return self.lasts[i] >= x2
+
+    def visible_spans(self, x1, x2):
+        """
+        The uncovered parts of columns x1 to x2 (included), left to right,
+        as (first, last) pairs.
+        """
+        firsts, lasts = self.firsts, self.lasts
+        spans = []
+        # range i is the last one starting at or before x
+        i = bisect_right(firsts, x1) - 1
+        x = x1
+        while x <= x2:
+            if lasts[i] >= x:
+                # inside range i: carry on past it
+                x = lasts[i] + 1
+            else:
+                # in the gap before range i + 1
+                last = min(firsts[i + 1] - 1, x2)
+                spans.append((x, last))
+                x = last + 1
+                i += 1
+        return spans
+
+    def add(self, x1, x2):
+        # cover columns x1 to x2 (included), merging the ranges they overlap or touch
+        if x2 < x1:
+            return
+        firsts, lasts = self.firsts, self.lasts
+        lo = bisect_left(lasts, x1 - 1)
+        hi = bisect_right(firsts, x2 + 1)
+        if lo < hi:
+            x1 = min(x1, firsts[lo])
+            x2 = max(x2, lasts[hi - 1])
+        firsts[lo:hi] = [x1]
+        lasts[lo:hi] = [x2]
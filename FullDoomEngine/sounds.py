@@ -1,32 +1,77 @@
 import io
+import struct
 import wave
 import pygame as pg
 
 from doomsettings import SAMPLE_RATE
+from lazy_assets import LazyAssets
+
+# DMX sound lump header: format (3), sample rate, number of samples
+SOUND_HEADER = struct.Struct('<HHI')
+SOUND_FORMAT = 3
+# the samples are padded with 16 bytes at each end
+SOUND_PADDING = 16
+
+
+def decode_sound(byte_data):
+    """
+    Parameters
+    ==========
+        byte_data: bytes of a DS* sound lump
+
+    Returns
+    =======
+        sample_rate, 8-bit unsigned mono samples (bytes)
+    """
+    sound_format, sample_rate, num_samples = SOUND_HEADER.unpack_from(byte_data)
+    if sound_format != SOUND_FORMAT:
+        raise ValueError(f'Unknown sound format {sound_format}')
+    samples = byte_data[SOUND_HEADER.size: SOUND_HEADER.size + num_samples]
+    if len(samples) > 2 * SOUND_PADDING:
+        samples = samples[SOUND_PADDING: -SOUND_PADDING]
+    return sample_rate or SAMPLE_RATE, bytes(samples)
+
+
+def convert_to_wav(samples, sample_rate=SAMPLE_RATE):
+    # Convert to a WAV in memory, so the mixer resamples it to its own format
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(1)  # 8-bit unsigned
+        wf.setframerate(sample_rate)
+        wf.writeframes(samples)
+
+    wav_buffer.seek(0)
+    return wav_buffer
+
+
+class SoundBank(LazyAssets):
+    """
+    Every DS* sound lump in the WAD, each decoded into a pg.mixer.Sound
+    the first time it is looked up and kept from then on, so playing it
+    again only costs a mixer channel.
+    """
+    def __init__(self, reader):
+        self.reader = reader
+        names = [name for name in reader.lump_indices if name.startswith('DS')]
+        super().__init__(names, self.load_sound)
+
+    def load_sound(self, name):
+        if not pg.mixer.get_init():
+            pg.mixer.init()
+        byte_data = self.reader.read_lump(self.reader.get_lump_index(name))
+        sample_rate, samples = decode_sound(byte_data)
+        return pg.mixer.Sound(convert_to_wav(samples, sample_rate))
+
+    def play(self, name):
+        self[name].play()
+
 
 class SoundEffect:
 
     def __init__(self, name, engine):
-        byte_data = engine.wad_data.sound_effects[name]
-        num_samples = byte_data[1] + (byte_data[2] << 8)
-        self.raw_samples = byte_data[8:8 + num_samples]
-        pg.mixer.init()
-        self.wav_buffer = self.convert_to_wav()
-
-    def convert_to_wav(self):
-        # Convert to a WAV in memory
-        wav_buffer = io.BytesIO()
-        with wave.open(wav_buffer, 'wb') as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(1)  # 8-bit unsigned
-            wf.setframerate(SAMPLE_RATE)
-            wf.writeframes(self.raw_samples)
-
-        wav_buffer.seek(0)
-        return wav_buffer
-    
-    def play(self):
-        wav_buffer = self.convert_to_wav()
-        sound = pg.mixer.Sound(wav_buffer)
-        sound.play()
+        # shared by everything that makes this sound
+        self.sound = engine.wad_data.sounds[name]
 
+    def play(self):
+        self.sound.play()
@@ -6,6 +6,9 @@ from doomsettings import *
 
 
 class Thing:
+    # things that never move are located in the BSP tree once, at spawn
+    is_static = True
+
     def __init__(self, engine, pos, angle):
         self.engine = engine
         self.pos = pos
@@ -18,6 +21,10 @@ class Thing:
         self.orig_image_size = None
         self.clip_top = [0] * WIDTH
         self.clip_bottom = [HEIGHT -1] * WIDTH
+        # set by BSP.locate
+        self.sub_sector_id = None
+        self.located_pos = None
+        self.engine.bsp.locate(self)
 
     def pre_cache(self):
         """
@@ -30,7 +37,9 @@ class Thing:
             return
         # otherwise, find all angles and scales, and store in object handler's sprite cache
         sprite_cache = {}
-        sprites = {k: v for k, v in self.engine.view_renderer.asset_data.sprites.items() if k.startswith(self.sprite_name_base)}
+        # sprites are decoded on access, so only look up the matching names
+        all_sprites = self.engine.view_renderer.asset_data.sprites
+        sprites = {k: all_sprites[k] for k in all_sprites if k.startswith(self.sprite_name_base)}
         for k, v in sprites.items():
             img_size = v.get_size()
             aspect_ratio = img_size[0]/img_size[1]
@@ -74,7 +83,7 @@ class Thing:
         return rotation_index
     
     def update(self):
-        self.scaled_sprite, self.blit_pos, self.dist = self.scale_and_position()
+        self.scaled_sprite, self.blit_pos, self.dist, self.depth = self.scale_and_position()
         
 
     def get_y_offset(self, proj_plane_dist, view_y):
@@ -82,10 +91,14 @@ class Thing:
         y position to be rendered on screen depends on floor height and 
         player's eye height, as well as the sprite size.
         """
-        floor_height = self.engine.bsp.get_sub_sector_height(self.pos)
+        sub_sector_id = self.sub_sector_id if self.is_static else self.engine.bsp.locate(self)
+        floor_height = self.engine.bsp.get_floor_height(sub_sector_id)
         # player eye height takes into account the head bob animation
         player_eye_height = self.engine.player.get_view_height()
         vertical_offset = floor_height  - player_eye_height + self.world_height - self.extra_y_offset
+        # bottom and top relative to the player's eyes, to clip the sprite with wall silhouettes
+        self.bottom_z = floor_height - player_eye_height
+        self.top_z = self.bottom_z + self.world_height
         screen_vertical_offset = (vertical_offset / view_y) * proj_plane_dist
         return int(screen_vertical_offset) 
 
@@ -104,7 +117,7 @@ class Thing:
 
         # don't render if behind the player
         if view_y <= 0:
-            return None, None, None
+            return None, None, None, None
         
         # distance from player to sprite (for scaling)
         dist = math.hypot(view_x, view_y)
@@ -124,7 +137,8 @@ class Thing:
         blit_x = screen_x - sprite_width // 2
         blit_y = HEIGHT // 2 - sprite_height // 2 - y_offset
 
-        return sprite, (blit_x, blit_y), dist
+        # view_y is the depth the sprite is clipped against the walls with
+        return sprite, (blit_x, blit_y), dist, view_y
 
     def retrieve_cached_sprite(self, angle, scale):
         """ 
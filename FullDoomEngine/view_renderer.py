@@ -7,13 +7,50 @@ from random import randrange as rnd
 import pygame as pg
 import pygame.gfxdraw as gfx
 from pygame.math import Vector2 as vec2
+from lighting import LIGHT_SEG_SHIFT, build_scale_light, build_z_light
+from viewport import VIEW_H_HEIGHT, VIEW_SKY_INV_SCALE
+
+# the sky texture is drawn 2.2 columns per degree of view angle, with its
+# 100th row at the horizon and 160 rows over the height of the screen
+# (VIEW_SKY_INV_SCALE)
+SKY_TEX_ALT = 100
+
+
+@njit
+def draw_column(framebuffer, x, y1, y2, colour):
+    for iy in range(y1, y2+1):
+        framebuffer[x, iy] = colour
+
+
+@njit(fastmath=True)
+def draw_wall_col(framebuffer, tex, tex_col, x, y1, y2, tex_alt, inv_scale, h_height,
+                  light_palettes, colormap):
+    if y1 < y2:
+        tex_w, tex_h = tex.shape
+        tex_col = int(tex_col) % tex_w
+        tex_y = tex_alt + (float(y1) - h_height) * inv_scale
+        light_palette = light_palettes[colormap]
+
+        for iy in range(y1, y2 + 1):
+            framebuffer[x, iy] = light_palette[tex[tex_col, int(tex_y) % tex_h]]
+            tex_y += inv_scale
+
+
+@njit(fastmath=True)
+def draw_sky_col(framebuffer, sky_tex, x, y1, y2, x_angle, player_angle, light_palettes, view):
+    # the sky is always drawn full bright
+    tex_column = 2.2 * (player_angle + x_angle)
+    draw_wall_col(
+        framebuffer, sky_tex, tex_column, x, y1, y2,
+        SKY_TEX_ALT, view[VIEW_SKY_INV_SCALE], view[VIEW_H_HEIGHT], light_palettes, 0,
+    )
+
 
 class ViewRenderer:
     def __init__(self,engine):
         self.engine = engine
         self.player = engine.player
         self.screen = engine.screen
-        self.framebuffer = engine.framebuffer
         self.colours = {}
         self.asset_data = engine.wad_data.asset_data
         self.palette = self.asset_data.palette
@@ -23,24 +60,30 @@ class ViewRenderer:
         self.textures = self.asset_data.textures
         self.sky_id = self.asset_data.sky_id
         self.sky_tex = self.asset_data.sky_tex
-        self.sky_inv_scale = 160 / HEIGHT
-        self.sky_tex_alt = 100
-        # z-distance clipping buffer:
-        # - a 2D array WIDTHxHEIGHT with each entry being the 
-        # distance from the player to the nearest drawn wall at that
-        # screen position.
-        self.z_buffer = np.full((WIDTH, HEIGHT), np.inf)
+        self.sky_tex_alt = SKY_TEX_ALT
+        # textures are palette-indexed and lit through the colormaps:
+        # light_palettes[colormap, texel] is the RGB colour, and the
+        # colormap is picked from the sector light level and the distance
+        self.light_palettes = self.asset_data.light_palettes
+        self.scale_light = build_scale_light()
+        self.z_light = build_z_light()
+        self.viewport = None
+        self.resize()
         # debug cursor - position of a cursor that can be moved around
-        # the screen, and, on demand, give e.g. z-buffer information for
+        # the screen, and, on demand, give e.g. wall depth information for
         # that screen location.
         self.debug_cursor = (WIDTH//2, HEIGHT //2)
 
-    # reset clip buffers every frame
+    def resize(self):
+        # follow the engine's render resolution
+        self.viewport = self.engine.viewport
+        self.framebuffer = self.engine.framebuffer
+
+    # sprites are clipped with the seg handler's drawsegs, rebuilt every
+    # frame, so there is nothing to reset but the resolution to follow
     def reset_clip_buffers(self):
-        self.z_buffer.fill(np.inf)
-        # self.clip_top = [0] * WIDTH
-        # self.clip_bottom = [HEIGHT - 1] * WIDTH
-       # self.wall_depth = [math.inf] * WIDTH
+        if self.viewport is not self.engine.viewport:
+            self.resize()
 
 
     def update(self):
@@ -53,7 +96,8 @@ class ViewRenderer:
             tex_id = hash(tex)
             random.seed(tex_id)
             colour = self.palette[rnd(0, 256)]
-            colour = colour[0] * light_level, colour[1] * light_level, colour[2] * light_level
+            light = light_level / 255
+            colour = colour[0] * light, colour[1] * light, colour[2] * light
             self.colours[tex + str_light] = colour
         return self.colours[tex + str_light] 
 
@@ -66,66 +110,29 @@ class ViewRenderer:
         if not sprite.scaled_sprite:
             return
 
-        sprite_width = sprite.scaled_sprite.get_width()
-        sprite_height = sprite.scaled_sprite.get_height()
+        img = sprite.scaled_sprite
+        sprite_width, sprite_height = img.get_size()
         blit_x, blit_y = sprite.blit_pos
+        # sprites are drawn on the window, clipped in framebuffer columns
+        scale_x, scale_y = self.viewport.scale_x, self.viewport.scale_y
+        x1 = max(0, int(blit_x / scale_x))
+        x2 = min(self.viewport.width - 1, int((blit_x + sprite_width - 1) / scale_x))
+        if x1 > x2:
+            return
+        clip_top, clip_bottom = self.engine.seg_handler.clip_sprite(sprite, x1, x2)
 
         for i in range(sprite_width):
             screen_column = blit_x + i
             if not (0 <= screen_column < WIDTH):
                 continue
+            x = int(screen_column / scale_x) - x1
+            # the rows between the clips, in window rows
+            y1 = max(blit_y, math.ceil((clip_top[x] + 1) * scale_y))
+            y2 = min(blit_y + sprite_height, math.ceil(clip_bottom[x] * scale_y))
+            if y1 < y2:
+                # transparent pixels are left out by the sprite's colour key
+                self.screen.blit(img, (screen_column, y1), (i, y1 - blit_y, 1, y2 - y1))
 
-            sprite_col_y1 = blit_y
-            sprite_col_y2 = blit_y + sprite_height
-
-            for j in range(sprite_height):
-                screen_row = blit_y + j
-                if not (0 <= screen_row < HEIGHT):
-                    continue
-
-                # Check if sprite is closer than geometry at this pixel
-                if sprite.dist < self.z_buffer[screen_column, screen_row]:
-                    # Get the pixel colour from the sprite column
-                    pixel_colour = sprite.scaled_sprite.get_at((i, j))
-
-                    # Skip fully transparent pixels (alpha == 0)
-                    if pixel_colour[:3] == COLOUR_KEY:
-                    
-                        continue
-
-                    # Draw the pixel
-                    self.screen.set_at((screen_column, screen_row), pixel_colour)
-
-            # # Occlusion check: only check center y
-            # y_check = blit_y + sprite_height // 2
-            # if not (0 <= y_check < HEIGHT):
-            #     continue
-            
-            # # Depth test against geometry
-            # if sprite.dist > self.z_buffer[screen_column, y_check]:
-            #     continue
-            # col_rect = pg.Rect(i, 0, 1, sprite_height)
-            # sprite_col = sprite.scaled_sprite.subsurface(col_rect)
-            # self.screen.blit(sprite_col, (screen_column, blit_y))
-
-    def draw_flat(self, tex_id, light_level, x, y1, y2, world_z):
-        if y1 < y2:
-            if tex_id == self.sky_id:
-                tex_column = 2.2 * (self.player.angle + self.engine.seg_handler.x_to_angle[x])
-
-                self.draw_wall_col(
-                    self.framebuffer, self.sky_tex, tex_column, x, y1, y2,
-                    self.sky_tex_alt, self.sky_inv_scale, light_level=1.0,
-                )
-            else:
-                flat_tex = self.textures[tex_id]
-                # Pass a *view* of the z-buffer column for this x
-                z_col = self.z_buffer[x, y1:y2+1]
-                self.draw_flat_col(self.framebuffer, flat_tex,
-                                   x, y1, y2, light_level, world_z,
-                                   self.player.angle, self.player.pos.x, self.player.pos.y,
-                                   z_col)
-                
     # draw currently selected weapon at the bottom of the screen, but above status bar.
     def draw_weapon(self, sprite_name):
         img = self.sprites[sprite_name]
@@ -186,72 +193,22 @@ class ViewRenderer:
         pg.draw.circle(self.engine.screen, 'red', (self.debug_cursor), 4)
 
 
-    def draw_z_buffer(self):
+    def draw_wall_depths(self):
         """
         For debugging
         """
-        zb = self.z_buffer.copy()
-        zb[np.isinf(zb)] = 999.
+        depths = self.engine.seg_handler.get_wall_depths()
+        depths[np.isinf(depths)] = 999.
 
         # normalize to 0..255
-        max_depth = np.max(zb)
-        norm = (zb / max_depth) * 255
+        max_depth = np.max(depths)
+        norm = (depths / max_depth) * 255
         # invert
         norm = 255 - norm
-        img = norm.astype(np.uint8)
+        img = np.repeat(norm.astype(np.uint8)[:, None], self.viewport.height, axis=1)
         rgb = np.repeat(img[:,:, None], 3, axis=2)
         surf = pg.surfarray.make_surface(rgb)
-        self.screen.blit(surf, (0,0))
-
-
-
-
-    @staticmethod
-    @njit
-    def draw_column(framebuffer, x, y1, y2, colour):
-        for iy in range(y1, y2+1):
-            framebuffer[x, iy] = colour
-
-
-    @staticmethod
-    @njit(fastmath=True)
-    def draw_wall_col(framebuffer, tex, tex_col, x, y1, y2, tex_alt, inv_scale, light_level):
-        if y1 < y2:
-            tex_w, tex_h = len(tex), len(tex[0])
-            tex_col = int(tex_col) % tex_w
-            tex_y = tex_alt + (float(y1) - H_HEIGHT) * inv_scale
-
-            for iy in range(y1, y2 + 1):
-                col = tex[tex_col, int(tex_y) % tex_h]
-                col = col[0] * light_level, col[1] * light_level, col[2] * light_level
-                framebuffer[x, iy] = col
-                tex_y += inv_scale
-
-    @staticmethod
-    @njit(fastmath=True)
-    def draw_flat_col(screen, flat_tex, x, y1, y2, light_level, world_z,
-                      player_angle, player_x, player_y, z_col):
-        player_dir_x = math.cos(math.radians(player_angle))
-        player_dir_y = math.sin(math.radians(player_angle))
-
-        for i, iy in enumerate(range(y1, y2 + 1)):
-            z = H_WIDTH * world_z / (H_HEIGHT - iy)
-            z_col[i] = z  # store the depth in the z-buffer
-
-            px = player_dir_x * z + player_x
-            py = player_dir_y * z + player_y
-
-            left_x = -player_dir_y * z + px
-            left_y = player_dir_x * z + py
-            right_x = player_dir_y * z + px
-            right_y = -player_dir_x * z + py
-
-            dx = (right_x - left_x) / WIDTH
-            dy = (right_y - left_y) / WIDTH
-
-            tx = int(left_x + dx * x) & 63
-            ty = int(left_y + dy * x) & 63
+        self.screen.blit(pg.transform.scale(surf, WIN_RES), (0,0))
 
-            col = flat_tex[tx, ty]
-            col = col[0] * light_level, col[1] * light_level, col[2] * light_level
-            screen[x, iy] = col
\ No newline at end of file
+    draw_column = staticmethod(draw_column)
+    draw_wall_col = staticmethod(draw_wall_col)
@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+
+from doomsettings import *
+from lighting import get_light_scale_multiplier
+
+# the view parameters the kernels take, packed into a float64 array:
+# size of the framebuffer and of its halves
+VIEW_WIDTH, VIEW_HEIGHT = 0, 1
+VIEW_H_WIDTH, VIEW_H_HEIGHT = 2, 3
+# distance to the projection plane, in columns across and in rows down:
+# they differ when the pixels aren't square, e.g. in low detail
+VIEW_SCREEN_DIST, VIEW_PROJECTION_Y = 4, 5
+# wall scale to scalelight column
+VIEW_LIGHT_SCALE = 6
+# sky texture rows per screen row
+VIEW_SKY_INV_SCALE = 7
+VIEW_PARAMS = 8
+
+
+class Viewport:
+    """
+    Resolution the 3D view is rendered at, independent of the window's:
+    the framebuffer is scaled to the window when presented. In low
+    detail, as in Doom, only half the columns are rendered and each one
+    is shown double wide.
+
+    The kernels take the resolution as arguments (params), so changing
+    it doesn't recompile them.
+    """
+    def __init__(self, width, height, low_detail=False):
+        self.render_res = width, height
+        self.low_detail = low_detail
+        self.width = width // 2 if low_detail else width
+        self.height = height
+        self.h_width, self.h_height = self.width // 2, self.height // 2
+        self.screen_dist = self.h_width / math.tan(math.radians(H_FOV))
+        # window pixels per framebuffer pixel, across and down
+        self.scale_x = WIDTH / self.width
+        self.scale_y = HEIGHT / self.height
+        self.projection_y = self.screen_dist * self.scale_x / self.scale_y
+
+        self.params = np.empty(VIEW_PARAMS)
+        self.params[VIEW_WIDTH], self.params[VIEW_HEIGHT] = self.width, self.height
+        self.params[VIEW_H_WIDTH], self.params[VIEW_H_HEIGHT] = self.h_width, self.h_height
+        self.params[VIEW_SCREEN_DIST] = self.screen_dist
+        self.params[VIEW_PROJECTION_Y] = self.projection_y
+        self.params[VIEW_LIGHT_SCALE] = get_light_scale_multiplier(self.projection_y)
+        self.params[VIEW_SKY_INV_SCALE] = 160 / self.height
+        self.x_to_angle = self.get_x_to_angle_table()
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def get_x_to_angle_table(self):
+        # view angle (degrees) of each column's left edge, and of the right edge of the last
+        return np.array([
+            math.degrees(math.atan((self.h_width - x) / self.screen_dist))
+            for x in range(self.width + 1)
+        ])
+
+    def to_framebuffer(self, x, y):
+        # window position to framebuffer position
+        return int(x / self.scale_x), int(y / self.scale_y)
+
+
+class ResolutionGovernor:
+    """
+    Holds a target frame time by stepping the render resolution through
+    RESOLUTION_SCALES (fractions of RENDER_RES): down when the average
+    frame time is over the target, up when the next step's pixel count,
+    by the same average, would still fit under it.
+    """
+    # weight of the newest frame in the average
+    SMOOTHING = 0.1
+    # frames to wait after a change before the next one, for the average to settle
+    SETTLE_FRAMES = 30
+    # slack either side of the target, so the resolution doesn't flicker
+    STEP_DOWN_MARGIN = 1.1
+    STEP_UP_MARGIN = 0.9
+
+    def __init__(self, engine, target_frame_time):
+        self.engine = engine
+        self.target_frame_time = target_frame_time
+        self.level = 0
+        self.avg_frame_time = target_frame_time
+        self.frames_since_change = 0
+
+    def update(self, frame_time):
+        self.avg_frame_time += self.SMOOTHING * (frame_time - self.avg_frame_time)
+        self.frames_since_change += 1
+        if self.frames_since_change < self.SETTLE_FRAMES:
+            return
+        if self.avg_frame_time > self.target_frame_time * self.STEP_DOWN_MARGIN:
+            self.set_level(self.level + 1)
+        elif self.level > 0:
+            pixel_ratio = (RESOLUTION_SCALES[self.level - 1] / RESOLUTION_SCALES[self.level]) ** 2
+            if self.avg_frame_time * pixel_ratio < self.target_frame_time * self.STEP_UP_MARGIN:
+                self.set_level(self.level - 1)
+
+    def set_level(self, level):
+        level = min(max(level, 0), len(RESOLUTION_SCALES) - 1)
+        if level == self.level:
+            return
+        self.level = level
+        self.frames_since_change = 0
+        scale = RESOLUTION_SCALES[level]
+        width, height = RENDER_RES
+        self.engine.set_render_resolution(
+            max(2, round(width * scale)), max(2, round(height * scale)),
+            self.engine.viewport.low_detail,
+        )
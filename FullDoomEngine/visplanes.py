@@ -0,0 +1,207 @@
+import math
+
+from numba import njit, prange
+import numpy as np
+
+from doomsettings import *
+from view_renderer import draw_sky_col
+from viewport import VIEW_H_HEIGHT, VIEW_HEIGHT, VIEW_PROJECTION_Y, VIEW_WIDTH
+
+# plane_top value of a column a plane doesn't cover (plane_bottom is -1)
+NO_TOP = 1 << 30
+# planes allocated up front, more are added if a frame needs them
+INITIAL_VISPLANES = 128
+
+
+class Visplanes:
+    """
+    Floors and ceilings as Doom's visplanes: the walls only record, per
+    screen column, the rows each plane shows through (mark_plane_col),
+    and the planes are filled afterwards by draw_planes, as horizontal
+    spans along which the flat's texture coordinates change linearly.
+
+    A plane is a (height, flat, light) triple, the sky being a single
+    plane whatever its height and light. Each plane holds at most one
+    extent per column, so find_plane opens a new one for a wall range
+    whose columns overlap those of the ranges the plane already has.
+    """
+    def __init__(self, width):
+        self.width = width
+        self.plane_top = np.empty((0, width + 2), dtype=np.int32)
+        self.plane_bottom = np.empty((0, width + 2), dtype=np.int32)
+        self.heights = np.empty(0)
+        self.texture_ids = np.empty(0, dtype=np.int64)
+        self.z_light_nums = np.empty(0, dtype=np.int64)
+        self.is_sky = np.empty(0, dtype=np.bool_)
+        self.min_x = np.empty(0, dtype=np.int64)
+        self.max_x = np.empty(0, dtype=np.int64)
+        self.grow(INITIAL_VISPLANES)
+        self.num_planes = 0
+        # (height, flat, light) -> ids of the planes with that key
+        self.planes_by_key = {}
+        # per plane, the column ranges (x1, x2) of the wall ranges using it
+        self.plane_ranges = []
+
+    def grow(self, num_planes):
+        # more room, keeping the planes there are
+        extra = num_planes - len(self.heights)
+        self.plane_top = np.concatenate([self.plane_top, np.full((extra, self.width + 2), NO_TOP, dtype=np.int32)])
+        self.plane_bottom = np.concatenate([self.plane_bottom, np.full((extra, self.width + 2), -1, dtype=np.int32)])
+        self.heights = np.concatenate([self.heights, np.zeros(extra)])
+        self.texture_ids = np.concatenate([self.texture_ids, np.zeros(extra, dtype=np.int64)])
+        self.z_light_nums = np.concatenate([self.z_light_nums, np.zeros(extra, dtype=np.int64)])
+        self.is_sky = np.concatenate([self.is_sky, np.zeros(extra, dtype=np.bool_)])
+        self.min_x = np.concatenate([self.min_x, np.zeros(extra, dtype=np.int64)])
+        self.max_x = np.concatenate([self.max_x, np.zeros(extra, dtype=np.int64)])
+
+    def reset(self):
+        # clear the columns the last frame's planes used
+        for plane in range(self.num_planes):
+            x1, x2 = self.min_x[plane] + 1, self.max_x[plane] + 2
+            self.plane_top[plane, x1:x2] = NO_TOP
+            self.plane_bottom[plane, x1:x2] = -1
+        self.num_planes = 0
+        self.planes_by_key.clear()
+        self.plane_ranges.clear()
+
+    def find_plane(self, height, texture_id, z_light_num, is_sky, x1, x2):
+        """
+        Plane to mark columns x1 to x2 of a floor or ceiling in, as R_FindPlane
+        and R_CheckPlane.
+
+        Parameters
+        ==========
+            height: of the plane relative to the player's eyes
+            texture_id: index of the flat in the textures given to draw_planes
+            z_light_num: row of the zlight table to light it with
+        """
+        key = (0.0, 0, 0, True) if is_sky else (height, texture_id, z_light_num, False)
+        plane_ids = self.planes_by_key.setdefault(key, [])
+        for plane in plane_ids:
+            ranges = self.plane_ranges[plane]
+            if all(x2 < range_x1 or x1 > range_x2 for range_x1, range_x2 in ranges):
+                ranges.append((x1, x2))
+                self.min_x[plane] = min(self.min_x[plane], x1)
+                self.max_x[plane] = max(self.max_x[plane], x2)
+                return plane
+
+        plane = self.num_planes
+        if plane == len(self.heights):
+            self.grow(2 * plane)
+        self.num_planes += 1
+        plane_ids.append(plane)
+        self.plane_ranges.append([(x1, x2)])
+        self.heights[plane], self.texture_ids[plane] = key[:2]
+        self.z_light_nums[plane], self.is_sky[plane] = key[2:]
+        self.min_x[plane], self.max_x[plane] = x1, x2
+        return plane
+
+
+@njit
+def mark_plane_col(plane_top, plane_bottom, plane, x, y1, y2):
+    # rows y1 to y2 of column x show the plane (only drawn if y1 < y2, as before)
+    if y1 < y2:
+        x += 1
+        if plane_top[plane, x] <= plane_bottom[plane, x]:
+            plane_top[plane, x] = min(plane_top[plane, x], y1)
+            plane_bottom[plane, x] = max(plane_bottom[plane, x], y2)
+        else:
+            plane_top[plane, x] = y1
+            plane_bottom[plane, x] = y2
+
+
+@njit
+def get_row_tables(view, player_dir_x, player_dir_y):
+    """
+    What the spans of a row have in common whatever the plane, per unit
+    of the plane's height (relative to the player's eyes), as Doom's
+    yslope and basexscale/baseyscale: made once a frame.
+
+    Returns
+    =======
+        row_dist: (height,) distance to the plane along the view direction
+        row_steps: (height, 4) offset from the player of the row's left end
+            (x, y), and the change in texture coordinates per column (x, y)
+    """
+    num_rows = int(view[VIEW_HEIGHT])
+    row_dist = np.zeros(num_rows)
+    row_steps = np.zeros((num_rows, 4))
+    for y in range(num_rows):
+        # the horizon row only ever shows planes at eye level, never drawn
+        if y == view[VIEW_H_HEIGHT]:
+            continue
+        z = view[VIEW_PROJECTION_Y] / (view[VIEW_H_HEIGHT] - y)
+        row_dist[y] = z
+        row_steps[y, 0] = (player_dir_x - player_dir_y) * z
+        row_steps[y, 1] = (player_dir_y + player_dir_x) * z
+        row_steps[y, 2] = 2 * player_dir_y * z / view[VIEW_WIDTH]
+        row_steps[y, 3] = -2 * player_dir_x * z / view[VIEW_WIDTH]
+    return row_dist, row_steps
+
+
+@njit(fastmath=True)
+def draw_span(framebuffer, flat_tex, y, x1, x2, height, row_dist, row_steps,
+              light_palettes, z_light, player_x, player_y):
+    # row y of a flat from column x1 to x2: one distance and colormap for the
+    # whole row, texture coordinates linear in x
+    left_x = player_x + row_steps[y, 0] * height
+    left_y = player_y + row_steps[y, 1] * height
+    dx, dy = row_steps[y, 2] * height, row_steps[y, 3] * height
+
+    # darker with distance, z_light is indexed in 16 map unit steps
+    z_index = min(int(abs(row_dist[y] * height)) >> 4, len(z_light) - 1)
+    light_palette = light_palettes[z_light[z_index]]
+    for x in range(x1, x2 + 1):
+        tx = int(left_x + dx * x) & 63
+        ty = int(left_y + dy * x) & 63
+        framebuffer[x, y] = light_palette[flat_tex[tx, ty]]
+
+
+@njit(fastmath=True, parallel=True)
+def draw_planes(plane_top, plane_bottom, min_x, max_x, heights, texture_ids, z_light_nums,
+                is_sky, num_planes, textures, sky_tex, view, framebuffer,
+                x_to_angle, light_palettes, z_light, player_x, player_y, player_angle):
+    """
+    Fill the marked planes, each one on its own thread: planes never share
+    pixels. Flats are drawn as horizontal spans, following R_MakeSpans,
+    the sky as columns, with the angle of each one from x_to_angle.
+    """
+    player_dir_x = math.cos(math.radians(player_angle))
+    player_dir_y = math.sin(math.radians(player_angle))
+    row_dist, row_steps = get_row_tables(view, player_dir_x, player_dir_y)
+    for plane in prange(num_planes):
+        top, bottom = plane_top[plane], plane_bottom[plane]
+        if is_sky[plane]:
+            for x in range(min_x[plane], max_x[plane] + 1):
+                if top[x + 1] <= bottom[x + 1]:
+                    draw_sky_col(
+                        framebuffer, sky_tex, x, top[x + 1], bottom[x + 1],
+                        x_to_angle[x], player_angle, light_palettes, view,
+                    )
+            continue
+
+        flat_tex = textures[texture_ids[plane]]
+        height = heights[plane]
+        z_light_row = z_light[z_light_nums[plane]]
+        # the column each open span of a row started at
+        span_start = np.empty(int(view[VIEW_HEIGHT]), dtype=np.int64)
+        # columns min_x - 1 and max_x + 1 are empty, so every span is closed
+        for x in range(min_x[plane], max_x[plane] + 2):
+            t1, b1 = top[x], bottom[x]
+            t2, b2 = top[x + 1], bottom[x + 1]
+            # close the spans of rows the previous column had and this one hasn't
+            while t1 < t2 and t1 <= b1:
+                draw_span(framebuffer, flat_tex, t1, span_start[t1], x - 1, height, row_dist,
+                          row_steps, light_palettes, z_light_row, player_x, player_y)
+                t1 += 1
+            while b1 > b2 and b1 >= t1:
+                draw_span(framebuffer, flat_tex, b1, span_start[b1], x - 1, height, row_dist,
+                          row_steps, light_palettes, z_light_row, player_x, player_y)
+                b1 -= 1
+            # and open those of rows this column starts
+            while t2 < t1 and t2 <= b2:
+                span_start[t2] = x
+                t2 += 1
+            while b2 > b1 and b2 >= t2:
+                span_start[b2] = x
+                b2 -= 1
@@ -1,4 +1,13 @@
+import re
+import threading
+from concurrent.futures import Future
+
 from asset_data import AssetData
+from blockmap import Blockmap
+from doomsettings import ASSET_CACHE_DIR, ASSET_CACHE_ENABLED, PVS_CULLING
+from map_arrays import MapArrays
+from pvs import PVS
+from reject import RejectTable
 from wad_reader import WADReader
 
 class WADData:
@@ -12,63 +21,83 @@ class WADData:
         "SECRET": 32, "DONT_DRAW": 128, "MAPPED": 256
     }
 
-    SOUND_EFFECT_NAMES = [
-        "DSDOROPN"
-    ]
-
     def __init__(self, engine, map_name):
+        # WAD-wide assets are decoded once and shared between maps,
+        # only the map's own lumps are parsed here
+        self.asset_data = AssetData.for_wad(engine.wad_path)
+        self.map_name = map_name
         self.reader = WADReader(engine.wad_path)
         self.map_index = self.get_lump_index(lump_name=map_name)
+        self.map_end = self.get_map_end()
         self.vertexes = self.get_lump_data(
             reader_func=self.reader.read_vertex,
-            lump_index = self.map_index + self.LUMP_INDICES['VERTEXES'],
+            lump_index = self.get_map_lump_index('VERTEXES'),
             num_bytes=4
         )
         self.linedefs = self.get_lump_data(
             reader_func = self.reader.read_linedef,
-            lump_index = self.map_index + self.LUMP_INDICES["LINEDEFS"],
+            lump_index = self.get_map_lump_index("LINEDEFS"),
             num_bytes = 14
         )
         self.nodes = self.get_lump_data(
             reader_func = self.reader.read_node,
-            lump_index = self.map_index + self.LUMP_INDICES["NODES"],
+            lump_index = self.get_map_lump_index("NODES"),
             num_bytes = 28
         )
         self.things = self.get_lump_data(
             reader_func = self.reader.read_thing,
-            lump_index = self.map_index + self.LUMP_INDICES["THINGS"],
+            lump_index = self.get_map_lump_index("THINGS"),
             num_bytes = 10
         )
 
         self.sub_sectors = self.get_lump_data(
             reader_func = self.reader.read_sub_sector,
-            lump_index = self.map_index + self.LUMP_INDICES["SSECTORS"],
+            lump_index = self.get_map_lump_index("SSECTORS"),
             num_bytes=4
         )
 
         self.segments = self.get_lump_data(
             reader_func = self.reader.read_segment,
-            lump_index = self.map_index + self.LUMP_INDICES["SEGS"],
+            lump_index = self.get_map_lump_index("SEGS"),
             num_bytes=12
         )
 
         self.sidedefs = self.get_lump_data(
             reader_func = self.reader.read_sidedef,
-            lump_index = self.map_index+ self.LUMP_INDICES["SIDEDEFS"],
+            lump_index = self.get_map_lump_index("SIDEDEFS"),
             num_bytes=30
         )
         self.sectors = self.get_lump_data(
             reader_func = self.reader.read_sector,
-            lump_index = self.map_index + self.LUMP_INDICES["SECTORS"],
+            lump_index = self.get_map_lump_index("SECTORS"),
             num_bytes=26
         )
 
-        self.sound_effects = { name: self.get_sound_effect(name)  for name in self.SOUND_EFFECT_NAMES}
+        # the same lumps as structured arrays, for vectorized code
+        self.map_arrays = MapArrays(self.reader, {
+            name: self.get_map_lump_index(name) for name in MapArrays.LUMP_NAMES
+        })
+
+        self.blockmap = self.load_blockmap()
+        self.reject = self.load_reject()
+        self.pvs_hash = None
+        self.pvs = self.load_pvs() if PVS_CULLING else None
+
+        self.sounds = self.asset_data.sounds
 
         self.update_data()
-        self.asset_data = AssetData(self)
         self.reader.close()
 
+    def get_texture_names(self):
+        # every wall and flat texture referenced by the map, for preloading
+        names = set()
+        for sidedef in self.sidedefs:
+            names.update((sidedef.upper_texture, sidedef.middle_texture, sidedef.lower_texture))
+        for sector in self.sectors:
+            names.update((sector.floor_texture, sector.ceil_texture))
+        names.discard('-')
+        return names
+
     def update_data(self):
         self.update_sidedefs()
         self.update_linedefs()
@@ -80,6 +109,7 @@ class WADData:
 
     def update_linedefs(self):
         for linedef in self.linedefs:
+            linedef.segs = []  # filled in by update_segs
             linedef.front_sidedef = self.sidedefs[linedef.front_sidedef_id]
             if linedef.back_sidedef_id == 0xFFFF: # undefined
                 linedef.back_sidedef = None
@@ -92,6 +122,7 @@ class WADData:
             seg.start_vertex = self.vertexes[seg.start_vertex_id]
             seg.end_vertex = self.vertexes[seg.end_vertex_id]
             seg.linedef = self.linedefs[seg.linedef_id]
+            seg.linedef.segs.append(seg)
             if seg.direction:
                 front_sidedef = seg.linedef.back_sidedef
                 back_sidedef = seg.linedef.front_sidedef
@@ -107,27 +138,122 @@ class WADData:
             seg.angle = (seg.angle << 16) * 8.38190317e-8
             seg.angle = seg.angle + 360 if seg.angle < 0 else seg.angle
 
+    def load_blockmap(self):
+        # build one if the map has no BLOCKMAP lump, or an empty one
+        try:
+            lump_index = self.get_map_lump_index('BLOCKMAP')
+        except ValueError:
+            lump_index = None
+        if lump_index is None or not self.reader.directory[lump_index]['lump_size']:
+            return Blockmap.build(self.map_arrays)
+        return Blockmap.from_lump(self.reader.read_lump(lump_index))
+
+    def load_reject(self):
+        try:
+            data = self.reader.read_lump(self.get_map_lump_index('REJECT'))
+        except ValueError:
+            data = b''
+        return RejectTable.from_lump(data, len(self.sectors))
+
+    def load_pvs(self):
+        # read back from the cache, or None (no culling) until a worker
+        # process has built it there, the first time the map is seen
+        if not ASSET_CACHE_ENABLED:
+            return None
+        self.pvs_hash = PVS.hash_map(self.reader, {
+            name: self.get_map_lump_index(name) for name in PVS.GEOMETRY_LUMPS
+        })
+        pvs = PVS.from_cache(self.pvs_hash, len(self.sub_sectors))
+        if pvs is None:
+            PVS.build_in_background(self.reader.wad_path, {
+                name: self.get_map_lump_index(name) for name in MapArrays.LUMP_NAMES
+            }, self.pvs_hash)
+        return pvs
+
+    def update_pvs(self):
+        # the PVS, picked up from the cache once the worker process has built it
+        if self.pvs is None and self.pvs_hash is not None:
+            self.pvs = PVS.from_cache(self.pvs_hash, len(self.sub_sectors))
+        return self.pvs
+
     def get_lump_data(self, reader_func, lump_index, num_bytes, header_length=0):
-        lump_info = self.reader.directory[lump_index]
-        count = lump_info['lump_size'] // num_bytes
-        data = []
-        for i in range(count):
-            offset = lump_info['lump_offset'] + i * num_bytes + header_length
-            data.append(reader_func(offset)) 
-        return data
+        return self.reader.read_lump_records(reader_func, lump_index, num_bytes, header_length)
 
 
     def get_lump_index(self, lump_name):
-        for index, lump_info in enumerate(self.reader.directory):
-            if lump_name in lump_info.values():
-                return index
-            
-    def get_sound_effect(self, name):
-        for entry in self.reader.directory:
-            if entry["lump_name"].upper() == name.upper():
-                offset = entry['lump_offset']
-                size = entry["lump_size"]             
-                self.reader.wad_file.seek(offset)
-                return self.reader.wad_file.read(size)
-        raise ValueError(f'Lump {name} not found')
-        
\ No newline at end of file
+        return self.reader.get_lump_index(lump_name)
+
+    def get_map_end(self):
+        # index of the first lump after the map marker that isn't one of the
+        # map's (the next map's marker, or any other lump), so that a map
+        # missing a lump never gets the next one's
+        directory = self.reader.directory
+        index = self.map_index + 1
+        while index < len(directory) and directory[index]['lump_name'] in self.LUMP_INDICES:
+            index += 1
+        return index
+
+    def get_map_lump_index(self, lump_name):
+        # map lumps normally follow the map marker in a fixed order, but
+        # fall back to searching the map's lumps by name
+        index = self.map_index + self.LUMP_INDICES[lump_name]
+        if index < self.map_end and self.reader.directory[index]['lump_name'] == lump_name:
+            return index
+        index = self.reader.find_lump(lump_name, start=self.map_index + 1, end=self.map_end)
+        if index is None:
+            raise ValueError(f'Lump {lump_name} not found for map')
+        return index
+
+
+def get_next_map_name(map_name):
+    # E1M1 -> E1M2, MAP01 -> MAP02, None for names in neither form
+    match = re.fullmatch(r'MAP(\d+)', map_name)
+    if match:
+        return f"MAP{int(match[1]) + 1:02d}"
+    match = re.fullmatch(r'E(\d+)M(\d+)', map_name)
+    if match:
+        return f"E{match[1]}M{int(match[2]) + 1}"
+    return None
+
+
+class MapPrefetcher:
+    """
+    Parses the lumps of a map on a background thread, e.g. the next map
+    while the current one is being played, so that loading it is instant.
+    Each request gets its own Future, so a thread still parsing a map no
+    longer wanted can't hand its result to a later request.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.map_name = None
+        self.future = None
+
+    def prefetch(self, map_name):
+        if map_name == self.map_name:
+            return
+        if self.engine.wad_data.asset_data.get_lump_index(map_name) is None:
+            return
+        self.map_name = map_name
+        self.future = Future()
+        thread = threading.Thread(target=self.load, args=(map_name, self.future), daemon=True)
+        thread.start()
+
+    def load(self, map_name, future):
+        try:
+            future.set_result(WADData(self.engine, map_name))
+        except Exception as e:
+            future.set_exception(e)
+
+    def get(self, map_name):
+        """
+        Returns
+        =======
+            the prefetched WADData for map_name, waiting for it if it's
+            still being parsed, or None if map_name was not prefetched.
+        """
+        if map_name != self.map_name:
+            return None
+        future = self.future
+        self.map_name = self.future = None
+        # raises whatever parsing the map raised
+        return future.result()
@@ -1,4 +1,7 @@
+import bisect
+import mmap
 import struct
+import numpy as np
 from pygame.math import Vector2 as vec2
 
 from data_types import (
@@ -16,48 +19,99 @@ from data_types import (
     Thing
 )
 
-class WADReader:
+from doomsettings import WAD_USE_MMAP
 
-    def __init__(self, wad_path):
+class WADReader:
+    # fixed-size records, decoded with a single unpack per record
+    # (explicit little-endian so no alignment padding is inserted)
+    THING_STRUCT = struct.Struct('<hhHHH')  # 10 bytes
+    SEG_STRUCT = struct.Struct('<hhhhhh')  # 12 bytes
+    SUB_SECTOR_STRUCT = struct.Struct('<hh')  # 4 bytes
+    NODE_STRUCT = struct.Struct('<hhhh4h4hHH')  # 28 bytes
+    LINEDEF_STRUCT = struct.Struct('<HHHHHHH')  # 14 bytes
+    SECTOR_STRUCT = struct.Struct('<hh8s8sHHH')  # 26 bytes
+    SIDEDEF_STRUCT = struct.Struct('<hh8s8s8sH')  # 30 bytes
+    VERTEX_STRUCT = struct.Struct('<hh')  # 4 bytes
+    PATCH_MAP_STRUCT = struct.Struct('<hhHHH')  # 10 bytes
+    PATCH_HEADER_STRUCT = struct.Struct('<HHhh')  # 8 bytes
+    TEXTURE_MAP_STRUCT = struct.Struct('<8sIHHIH')  # 22 bytes
+    LUMP_INFO_STRUCT = struct.Struct('<ii8s')  # 16 bytes
+
+    def __init__(self, wad_path, use_mmap=WAD_USE_MMAP):
+        self.wad_path = wad_path
         self.wad_file = open(wad_path, 'rb')
+        # map the whole WAD into memory: fields are then decoded straight
+        # out of the mapping with unpack_from, without any per-field I/O
+        self.buffer = None
+        self.view = None
+        if use_mmap:
+            self.buffer = mmap.mmap(self.wad_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.buffer)
         self.header = self.read_header()
         print(f"header {self.header}")
+        # lump name -> ordered list of directory indices (names can repeat,
+        # e.g. THINGS once per map), built together with the directory
+        self.lump_indices = {}
         self.directory = self.read_directory()
 
     def read_directory(self):
         directory = []
-        for i in range(self.header['lump_count']):
-            offset = self.header["init_offset"] + i * 16
+        lump_count = self.header['lump_count']
+        # the whole directory is one contiguous block of 16-byte entries
+        data = self.read_raw(self.header['init_offset'], lump_count * 16)
+        lump_indices = self.lump_indices
+        for index, (lump_offset, lump_size, lump_name) in enumerate(
+            self.LUMP_INFO_STRUCT.iter_unpack(data)
+        ):
             lump_info = {
-                'lump_offset': self.read_4_bytes(offset),
-                'lump_size': self.read_4_bytes(offset+4),
-                'lump_name': self.read_string(offset+8, num_bytes=8),
+                'lump_offset': lump_offset,
+                'lump_size': lump_size,
+                'lump_name': self.decode_string(lump_name),
             }
             directory.append(lump_info)
+            lump_indices.setdefault(lump_info['lump_name'], []).append(index)
         return directory
 
+    def get_lump_index(self, lump_name):
+        # index of the first lump with this name, None if there isn't one
+        indices = self.lump_indices.get(lump_name.upper())
+        return indices[0] if indices else None
+
+    def find_lump(self, lump_name, start=0, end=None):
+        # index of the first lump with this name in directory[start:end],
+        # e.g. to look up a lump relative to a map marker
+        indices = self.lump_indices.get(lump_name.upper())
+        if not indices:
+            return None
+        i = bisect.bisect_left(indices, start)
+        if i < len(indices) and (end is None or indices[i] < end):
+            return indices[i]
+        return None
+
+    def read_lump(self, lump_index):
+        # raw contents of a whole lump
+        lump_info = self.directory[lump_index]
+        return self.read_raw(lump_info['lump_offset'], lump_info['lump_size'])
+
     def read_palette(self, offset):
         # 3 bytes B+B+B
-        read_1_byte = self.read_1_byte
+        data = self.read_raw(offset, 256 * 3)
         palette = []
         for i in range(256):
-            r = read_1_byte(offset + 3*i + 0)
-            g = read_1_byte(offset + 3*i + 1)
-            b = read_1_byte(offset + 3*i + 2)
-            palette.append((r,g,b),)
+            palette.append((data[3*i], data[3*i + 1], data[3*i + 2]),)
         return palette
 
 
     def read_patch_map(self, offset):
         # defining how the patch should be drawn inside the texture
-        read_2_bytes = self.read_2_bytes
-
         patch_map = PatchMap()
-        patch_map.x_offset = read_2_bytes(offset + 0, byte_format='h')
-        patch_map.y_offset = read_2_bytes(offset + 2, byte_format='h')
-        patch_map.p_name_index = read_2_bytes(offset + 4, byte_format='H')
-        patch_map.step_dir = read_2_bytes(offset + 6, byte_format='H')  # unused
-        patch_map.color_map = read_2_bytes(offset + 8, byte_format='H')  # unused
+        (
+            patch_map.x_offset,
+            patch_map.y_offset,
+            patch_map.p_name_index,
+            patch_map.step_dir,  # unused
+            patch_map.color_map,  # unused
+        ) = self.read_struct(self.PATCH_MAP_STRUCT, offset)
         return patch_map
 
 
@@ -71,148 +125,159 @@ class WADReader:
             patch_column.length = read_1_byte(offset + 1)
             patch_column.padding_pre = read_1_byte(offset + 2)  # unused
 
-            patch_column.data = []
-            for i in range(patch_column.length):
-                patch_column.data.append(read_1_byte(offset + 3 + i))
+            patch_column.data = list(self.read_raw(offset + 3, patch_column.length))
             patch_column.padding_post = read_1_byte(offset + 3 + patch_column.length)  # unused
 
             return patch_column, offset + 4 + patch_column.length
 
         return patch_column, offset + 1
 
-    def read_patch_header(self, offset):
-        read_2_bytes = self.read_2_bytes
-        read_4_bytes = self.read_4_bytes
+    def read_patch_pixels(self, offset):
+        # decode a whole patch into a palette-indexed (width, height) array
+        # and a mask of the pixels covered by posts, one slice per post
+        patch_header = self.read_patch_header(offset)
+        width, height = patch_header.width, patch_header.height
+        pixels = np.zeros((width, height), dtype=np.uint8)
+        mask = np.zeros((width, height), dtype=bool)
+
+        read_1_byte = self.read_1_byte
+        for ix in range(width):
+            offs = offset + patch_header.column_offset[ix]
+            while (top_delta := read_1_byte(offs)) != 0xFF:
+                length = read_1_byte(offs + 1)
+                # posts running off the bottom of the patch are clipped
+                y2 = min(top_delta + length, height)
+                if top_delta < y2:
+                    data = self.read_raw(offs + 3, y2 - top_delta)
+                    pixels[ix, top_delta:y2] = np.frombuffer(data, dtype=np.uint8)
+                    mask[ix, top_delta:y2] = True
+                offs += 4 + length
+        return patch_header, pixels, mask
 
+    def read_patch_header(self, offset):
         patch_header = PatchHeader()
-        patch_header.width = read_2_bytes(offset + 0, byte_format='H')
-        patch_header.height = read_2_bytes(offset + 2, byte_format='H')
-        patch_header.left_offset = read_2_bytes(offset + 4, byte_format='h')
-        patch_header.top_offset = read_2_bytes(offset + 6, byte_format='h')
-
-        patch_header.column_offset = []
-        for i in range(patch_header.width):
-            patch_header.column_offset.append(read_4_bytes(offset + 8 + 4 * i, byte_format='I'))
+        (
+            patch_header.width,
+            patch_header.height,
+            patch_header.left_offset,
+            patch_header.top_offset,
+        ) = self.read_struct(self.PATCH_HEADER_STRUCT, offset)
+
+        patch_header.column_offset = list(
+            self.read_bytes(offset + 8, 4 * patch_header.width, byte_format=f'<{patch_header.width}I')
+        )
         return patch_header
 
     def read_thing(self, offset):
-        read_2_bytes = self.read_2_bytes
         thing = Thing()
-        x = read_2_bytes(offset, byte_format="h")
-        y = read_2_bytes(offset+2, byte_format="h")
-        thing.angle = read_2_bytes(offset+4, byte_format="H")
-        thing.type = read_2_bytes(offset+6, byte_format="H")
-        thing.flags = read_2_bytes(offset+8,byte_format="H")
+        x, y, thing.angle, thing.type, thing.flags = self.read_struct(self.THING_STRUCT, offset)
         thing.pos = vec2(x,y)
 
         return thing
 
     def read_segment(self,offset):
-        read_2_bytes = self.read_2_bytes
         seg = Seg()
-        seg.start_vertex_id = read_2_bytes(offset, byte_format="h")
-        seg.end_vertex_id = read_2_bytes(offset+2, byte_format="h")
-        seg.angle = read_2_bytes(offset+4, byte_format="h")
-        seg.linedef_id = read_2_bytes(offset+6, byte_format="h")
-        seg.direction = read_2_bytes(offset+8, byte_format="h")
-        seg.offset = read_2_bytes(offset+10, byte_format="h")
+        (
+            seg.start_vertex_id,
+            seg.end_vertex_id,
+            seg.angle,
+            seg.linedef_id,
+            seg.direction,
+            seg.offset,
+        ) = self.read_struct(self.SEG_STRUCT, offset)
         return seg
 
 
     def read_sub_sector(self, offset):
-        read_2_bytes = self.read_2_bytes
-
         sub_sector = SubSector()
-        sub_sector.seg_count = read_2_bytes(offset, byte_format="h")
-        sub_sector.first_seg_id = read_2_bytes(offset+2, byte_format="h")
+        sub_sector.seg_count, sub_sector.first_seg_id = self.read_struct(self.SUB_SECTOR_STRUCT, offset)
         return sub_sector
 
 
     def read_node(self, offset):
         # 28 bytes
-        read_2_bytes = self.read_2_bytes
         node = Node()
-        node.x_partition = read_2_bytes(offset, byte_format="h")
-        node.y_partition = read_2_bytes(offset+2, byte_format="h")
-        node.dx_partition = read_2_bytes(offset+4, byte_format="h")
-        node.dy_partition = read_2_bytes(offset+6, byte_format="h")
-
-        node.bbox["front"].top = read_2_bytes(offset+8, byte_format="h")
-        node.bbox["front"].bottom = read_2_bytes(offset+10, byte_format="h")
-        node.bbox["front"].left = read_2_bytes(offset+12, byte_format="h")
-        node.bbox["front"].right = read_2_bytes(offset+14, byte_format="h")
-        node.bbox["back"].top = read_2_bytes(offset+16, byte_format="h")
-        node.bbox["back"].bottom = read_2_bytes(offset+18, byte_format="h")
-        node.bbox["back"].left = read_2_bytes(offset+20, byte_format="h")
-        node.bbox["back"].right = read_2_bytes(offset+22, byte_format="h")
-
-        node.front_child_id = read_2_bytes(offset+24, byte_format="H")
-        node.back_child_id = read_2_bytes(offset+26, byte_format="H")
+        front, back = node.bbox["front"], node.bbox["back"]
+        (
+            node.x_partition,
+            node.y_partition,
+            node.dx_partition,
+            node.dy_partition,
+            front.top, front.bottom, front.left, front.right,
+            back.top, back.bottom, back.left, back.right,
+            node.front_child_id,
+            node.back_child_id,
+        ) = self.read_struct(self.NODE_STRUCT, offset)
         return node
 
     def read_linedef(self, offset):
         # 14 bytes = 2H * 7
-        read_2_bytes = self.read_2_bytes
-
         linedef = Linedef()
-        linedef.start_vertex_id = read_2_bytes(offset, byte_format="H")
-        linedef.end_vertex_id = read_2_bytes(offset+2, byte_format="H")
-        linedef.flags = read_2_bytes(offset+4, byte_format="H")
-        linedef.line_type = read_2_bytes(offset+6, byte_format="H")
-        linedef.sector_tag = read_2_bytes(offset+8, byte_format="H")
-        linedef.front_sidedef_id = read_2_bytes(offset+10, byte_format="H")
-        linedef.back_sidedef_id = read_2_bytes(offset+12, byte_format="H")
+        (
+            linedef.start_vertex_id,
+            linedef.end_vertex_id,
+            linedef.flags,
+            linedef.line_type,
+            linedef.sector_tag,
+            linedef.front_sidedef_id,
+            linedef.back_sidedef_id,
+        ) = self.read_struct(self.LINEDEF_STRUCT, offset)
         return linedef
 
     def read_sector(self, offset):
         # 26 bytes = 2h + 2h + 8c +8c + 2Hx3
-        read_2_bytes = self.read_2_bytes
-        read_string = self.read_string
+        decode_string = self.decode_string
 
         sector = Sector()
-        sector.floor_height = read_2_bytes(offset, byte_format="h")
-        sector.ceil_height = read_2_bytes(offset+2, byte_format="h")
-        sector.floor_texture = read_string(offset+4, num_bytes=8)
-        sector.ceil_texture = read_string(offset+12, num_bytes=8)
-        sector.light_level = read_2_bytes(offset+20, byte_format="H") / 255.0
-        sector.type = read_2_bytes(offset+22, byte_format="H")
-        sector.tag = read_2_bytes(offset+24, byte_format="H")
+        (
+            sector.floor_height,
+            sector.ceil_height,
+            floor_texture,
+            ceil_texture,
+            sector.light_level,
+            sector.type,
+            sector.tag,
+        ) = self.read_struct(self.SECTOR_STRUCT, offset)
+        sector.floor_texture = decode_string(floor_texture)
+        sector.ceil_texture = decode_string(ceil_texture)
         return sector
 
     def read_sidedef(self, offset):
         # 30 bytes = 2h + 2h + 8c + 8c + 8c + 2H
-        read_2_bytes = self.read_2_bytes
-        read_string = self.read_string
+        decode_string = self.decode_string
 
         sidedef = Sidedef()
-        sidedef.x_offset = read_2_bytes(offset, byte_format="h")
-        sidedef.y_offset = read_2_bytes(offset+2, byte_format="h")
-        sidedef.upper_texture = read_string(offset+4, num_bytes=8)
-        sidedef.lower_texture = read_string(offset+12, num_bytes=8)
-        sidedef.middle_texture = read_string(offset+20, num_bytes=8)
-        sidedef.sector_id = read_2_bytes(offset+28, byte_format="H")
+        (
+            sidedef.x_offset,
+            sidedef.y_offset,
+            upper_texture,
+            lower_texture,
+            middle_texture,
+            sidedef.sector_id,
+        ) = self.read_struct(self.SIDEDEF_STRUCT, offset)
+        sidedef.upper_texture = decode_string(upper_texture)
+        sidedef.lower_texture = decode_string(lower_texture)
+        sidedef.middle_texture = decode_string(middle_texture)
 
         return sidedef
 
     def read_vertex(self, offset):
         # 4 bytes, x and y
-        x = self.read_2_bytes(offset, 'h')
-        y = self.read_2_bytes(offset+2, 'h')
+        x, y = self.read_struct(self.VERTEX_STRUCT, offset)
         return vec2(x,y)
 
 
     def read_texture_map(self, offset):
-        read_2_bytes = self.read_2_bytes
-        read_4_bytes = self.read_4_bytes
-        read_string = self.read_string
-
         tex_map = TextureMap()
-        tex_map.name = read_string(offset + 0, num_bytes=8)
-        tex_map.flags = read_4_bytes(offset + 8, byte_format='I')
-        tex_map.width = read_2_bytes(offset + 12, byte_format='H')
-        tex_map.height = read_2_bytes(offset + 14, byte_format='H')
-        tex_map.column_dir = read_4_bytes(offset + 16, byte_format='I')  # unused
-        tex_map.patch_count = read_2_bytes(offset + 20, byte_format='H')
+        (
+            name,
+            tex_map.flags,
+            tex_map.width,
+            tex_map.height,
+            tex_map.column_dir,  # unused
+            tex_map.patch_count,
+        ) = self.read_struct(self.TEXTURE_MAP_STRUCT, offset)
+        tex_map.name = self.decode_string(name)
 
         tex_map.patch_maps = []
         for i in range(tex_map.patch_count):
@@ -230,11 +295,12 @@ class WADReader:
         tex_header.texture_count = read_4_bytes(offset + 0, byte_format='I')
         tex_header.texture_offset = read_4_bytes(offset + 4, byte_format='I')
 
-        tex_header.texture_data_offset = []
-        for i in range(tex_header.texture_count):
-            tex_header.texture_data_offset.append(
-                read_4_bytes(offset + 4 + i * 4, byte_format='I')
+        tex_header.texture_data_offset = list(
+            self.read_bytes(
+                offset + 4, 4 * tex_header.texture_count,
+                byte_format=f'<{tex_header.texture_count}I'
             )
+        )
         return tex_header
 
 
@@ -259,14 +325,67 @@ class WADReader:
 
 
     def read_string(self, offset, num_bytes=8):
-        return ''.join(b.decode('ascii') for b in 
-                       self.read_bytes(offset, num_bytes, byte_format='c'*num_bytes)
-                       if ord(b) != 0).upper()
+        return self.decode_string(self.read_raw(offset, num_bytes))
+
+    @staticmethod
+    def decode_string(raw):
+        return bytes(raw).replace(b'\x00', b'').decode('ascii').upper()
 
     def read_bytes(self, offset, num_bytes, byte_format):
+        if self.buffer is not None:
+            return struct.unpack_from(byte_format, self.buffer, offset)
         self.wad_file.seek(offset)
         buffer = self.wad_file.read(num_bytes)
         return struct.unpack(byte_format, buffer)
 
+    def read_struct(self, record_struct, offset):
+        # decode a whole fixed-size record in one go
+        if self.buffer is not None:
+            return record_struct.unpack_from(self.buffer, offset)
+        self.wad_file.seek(offset)
+        return record_struct.unpack(self.wad_file.read(record_struct.size))
+
+    def read_lump_records(self, reader_func, lump_index, num_bytes, header_length=0):
+        # decode a lump made of fixed-size records, one reader_func call per record
+        lump_info = self.directory[lump_index]
+        count = lump_info['lump_size'] // num_bytes
+        data = []
+        for i in range(count):
+            offset = lump_info['lump_offset'] + i * num_bytes + header_length
+            data.append(reader_func(offset))
+        return data
+
+    def read_lump_array(self, lump_index, dtype):
+        # decode a whole lump of fixed-size records into a structured array.
+        # The array is copied out of the mapping so that the reader can be closed.
+        lump_info = self.directory[lump_index]
+        count = lump_info['lump_size'] // dtype.itemsize
+        data = self.read_raw(lump_info['lump_offset'], count * dtype.itemsize)
+        return np.frombuffer(data, dtype=dtype, count=count).copy()
+
+    def read_lumps_stacked(self, lumps_info, lump_size):
+        # contents of several equally sized lumps as one (count, lump_size) array,
+        # read as a single slice when the lumps are stored back to back
+        offsets = [lump_info['lump_offset'] for lump_info in lumps_info]
+        count = len(offsets)
+        if all(b - a == lump_size for a, b in zip(offsets, offsets[1:])):
+            data = self.read_raw(offsets[0], count * lump_size) if count else b''
+            return np.frombuffer(data, dtype=np.uint8).reshape(count, lump_size).copy()
+        stacked = np.empty((count, lump_size), dtype=np.uint8)
+        for i, offset in enumerate(offsets):
+            stacked[i] = np.frombuffer(self.read_raw(offset, lump_size), dtype=np.uint8)
+        return stacked
+
+    def read_raw(self, offset, num_bytes):
+        # raw bytes, a zero-copy slice of the mapping in mmap mode
+        if self.buffer is not None:
+            return self.view[offset: offset + num_bytes]
+        self.wad_file.seek(offset)
+        return self.wad_file.read(num_bytes)
+
     def close(self):
+        if self.buffer is not None:
+            self.view.release()
+            self.buffer.close()
+            self.view = self.buffer = None
         self.wad_file.close()
\ No newline at end of file
@@ -0,0 +1,333 @@
+import math
+
+from numba import njit, prange
+import numpy as np
+
+from doomsettings import *
+from lighting import MAX_LIGHT_SCALE
+from view_renderer import draw_wall_col
+from viewport import VIEW_H_HEIGHT, VIEW_HEIGHT, VIEW_LIGHT_SCALE, VIEW_WIDTH
+from visplanes import mark_plane_col
+
+# a wall range is packed into a float64 array, by SegHandler.pack_wall_range:
+# its first and last screen columns
+WALL_X1, WALL_X2 = 0, 1
+# scale at x1 and per column
+WALL_SCALE1, WALL_SCALE_STEP = 2, 3
+# perpendicular distance to the wall's line, texture offset along it and
+# the angle of its normal relative to the view direction (degrees)
+WALL_DISTANCE, WALL_OFFSET, WALL_CENTER_ANGLE = 4, 5, 6
+# start vertex and unit direction of the seg
+WALL_START_X, WALL_START_Y, WALL_DIR_X, WALL_DIR_Y = 7, 8, 9, 10
+# heights of the front and back sector ceilings (z1) and floors (z2),
+# relative to the player's eyes
+WALL_FRONT_Z1, WALL_FRONT_Z2, WALL_BACK_Z1, WALL_BACK_Z2 = 11, 12, 13, 14
+# texture altitudes of the upper (or middle, for solid walls) and lower textures
+WALL_UPPER_TEX_ALT, WALL_LOWER_TEX_ALT = 15, 16
+# row of scalelight to light the walls with
+WALL_LIGHT_NUM = 17
+# visplanes the ceiling and floor columns are marked in
+WALL_CEIL_PLANE, WALL_FLOOR_PLANE = 18, 19
+# the range is also the drawseg sprites are clipped with: which of its
+# silhouettes hide sprites (SIL_ flags), the heights (relative to the
+# player's eyes) below and above which they do, and the index in the
+# openings of its sprite clip arrays, -1 if it has none
+WALL_SILHOUETTE, WALL_BOTTOM_SIL_Z, WALL_TOP_SIL_Z, WALL_CLIP_OFFSET = 20, 21, 22, 23
+WALL_FLAGS = 24
+# the true scales at x1 and x2, for sorting sprites against the drawseg:
+# WALL_SCALE1 is shrunk for walls seen edge on, to draw them sensibly
+WALL_SIL_SCALE1, WALL_SIL_SCALE2 = 25, 26
+WALL_PARAMS = 27
+
+# WALL_FLAGS bits
+IS_SOLID = 1
+DRAW_UPPER = 2  # the middle texture, for solid walls
+DRAW_LOWER = 4
+DRAW_CEIL = 8
+DRAW_FLOOR = 16
+
+# WALL_SILHOUETTE values: a portal's lower and upper walls, and walls that
+# hide everything behind them (solid walls and closed doors)
+SIL_BOTTOM = 1
+SIL_TOP = 2
+SIL_SOLID = 4
+
+
+@njit(fastmath=True)
+def draw_wall_range(wall, view, framebuffer, upper_clip, lower_clip, openings,
+                    upper_tex, lower_tex, plane_top, plane_bottom,
+                    x_to_angle, light_palettes, scale_light, x_lo, x_hi):
+    """
+    Draw the columns of a wall range, solid or portal, and mark those of
+    its ceiling and floor in their visplanes, updating, for portals, the
+    clip arrays and storing them in openings for sprites to be clipped
+    with. Only columns x_lo to x_hi are drawn, the others are stepped
+    over so that a strip draws exactly what a full pass would.
+
+    Parameters
+    ==========
+        wall: the range packed as a float64 array of WALL_PARAMS values
+        view: the Viewport params
+        upper_clip, lower_clip: int arrays, per column the last row drawn
+            from the top and the first row drawn from the bottom
+        upper_tex, lower_tex: the textures of the range, the middle
+            texture being upper_tex for solid walls. Any array will do
+            for those that aren't drawn.
+        openings: int array holding the sprite clip arrays of the
+            drawsegs, from WALL_CLIP_OFFSET: the upper clip of each
+            column, then the lower clip of each column
+        plane_top, plane_bottom: the Visplanes arrays
+    """
+    flags = int(wall[WALL_FLAGS])
+    x1, x2 = int(wall[WALL_X1]), int(wall[WALL_X2])
+    rw_scale = wall[WALL_SCALE1]
+    rw_scale_step = wall[WALL_SCALE_STEP]
+    rw_distance = wall[WALL_DISTANCE]
+    rw_offset = wall[WALL_OFFSET]
+    rw_center_angle = wall[WALL_CENTER_ANGLE]
+    front_z1, front_z2 = wall[WALL_FRONT_Z1], wall[WALL_FRONT_Z2]
+    back_z1, back_z2 = wall[WALL_BACK_Z1], wall[WALL_BACK_Z2]
+    upper_tex_alt, lower_tex_alt = wall[WALL_UPPER_TEX_ALT], wall[WALL_LOWER_TEX_ALT]
+    scale_light_row = scale_light[int(wall[WALL_LIGHT_NUM])]
+    ceil_plane, floor_plane = int(wall[WALL_CEIL_PLANE]), int(wall[WALL_FLOOR_PLANE])
+    height, h_height = int(view[VIEW_HEIGHT]), view[VIEW_H_HEIGHT]
+    light_scale = view[VIEW_LIGHT_SCALE]
+    clip_offset = int(wall[WALL_CLIP_OFFSET])
+    num_cols = x2 - x1 + 1
+
+    is_solid = flags & IS_SOLID != 0
+    b_draw_upper = flags & DRAW_UPPER != 0
+    b_draw_lower = flags & DRAW_LOWER != 0
+    b_draw_ceil = flags & DRAW_CEIL != 0
+    b_draw_floor = flags & DRAW_FLOOR != 0
+    seg_textured = b_draw_upper or b_draw_lower
+
+    # y positions of the top/bottom edges on the screen
+    wall_y1 = h_height - front_z1 * rw_scale
+    wall_y1_step = -rw_scale_step * front_z1
+    wall_y2 = h_height - front_z2 * rw_scale
+    wall_y2_step = -rw_scale_step * front_z2
+
+    # the y positions of the top and bottom edges of a portal
+    portal_y1 = portal_y1_step = portal_y2 = portal_y2_step = 0.0
+    if not is_solid and b_draw_upper:
+        if back_z1 > front_z2:
+            portal_y1 = h_height - back_z1 * rw_scale
+            portal_y1_step = -rw_scale_step * back_z1
+        else:
+            portal_y1 = wall_y2
+            portal_y1_step = wall_y2_step
+    if not is_solid and b_draw_lower:
+        if back_z2 < front_z1:
+            portal_y2 = h_height - back_z2 * rw_scale
+            portal_y2_step = -rw_scale_step * back_z2
+        else:
+            portal_y2 = wall_y1
+            portal_y2_step = wall_y1_step
+
+    for x in range(x1, min(x2, x_hi) + 1):
+        if x < x_lo:
+            rw_scale += rw_scale_step
+            wall_y1 += wall_y1_step
+            wall_y2 += wall_y2_step
+            portal_y1 += portal_y1_step
+            portal_y2 += portal_y2_step
+            continue
+        draw_wall_y1 = wall_y1 - 1
+        draw_wall_y2 = wall_y2
+        x_angle = x_to_angle[x]
+
+        # where along the wall the column's ray meets it, for the texture column
+        wall_offset_along = inv_scale = 0.0
+        colormap = 0
+        if seg_textured:
+            angle = rw_center_angle - x_angle
+            wall_offset_along = rw_distance * math.tan(math.radians(angle)) - rw_offset
+            inv_scale = 1.0 / rw_scale
+            colormap = scale_light_row[min(int(rw_scale * light_scale), MAX_LIGHT_SCALE - 1)]
+
+        if is_solid:
+            if b_draw_ceil:
+                cy1 = upper_clip[x] + 1
+                cy2 = int(min(draw_wall_y1 - 1, lower_clip[x] - 1))
+                mark_plane_col(plane_top, plane_bottom, ceil_plane, x, cy1, cy2)
+            if b_draw_upper:
+                wy1 = int(max(draw_wall_y1, upper_clip[x] + 1))
+                wy2 = int(min(draw_wall_y2, lower_clip[x] - 1))
+                if wy1 < wy2:
+                    draw_wall_col(
+                        framebuffer, upper_tex, wall_offset_along, x, wy1, wy2,
+                        upper_tex_alt, inv_scale, h_height, light_palettes, colormap,
+                    )
+            if b_draw_floor:
+                fy1 = int(max(draw_wall_y2 + 1, upper_clip[x] + 1))
+                fy2 = lower_clip[x] - 1
+                mark_plane_col(plane_top, plane_bottom, floor_plane, x, fy1, fy2)
+        else:
+            if b_draw_upper:
+                if b_draw_ceil:
+                    cy1 = upper_clip[x] + 1
+                    cy2 = int(min(draw_wall_y1 - 1, lower_clip[x] - 1))
+                    mark_plane_col(plane_top, plane_bottom, ceil_plane, x, cy1, cy2)
+                wy1 = int(max(wall_y1 - 1, upper_clip[x] + 1))
+                wy2 = int(min(portal_y1, lower_clip[x] - 1))
+                # clamp to screen
+                wy1 = max(0, min(wy1, height))
+                wy2 = max(0, min(wy2, height))
+                if wy1 < wy2:
+                    draw_wall_col(
+                        framebuffer, upper_tex, wall_offset_along, x, wy1, wy2,
+                        upper_tex_alt, inv_scale, h_height, light_palettes, colormap,
+                    )
+                if upper_clip[x] < wy2:
+                    upper_clip[x] = wy2
+                portal_y1 += portal_y1_step
+
+            if b_draw_ceil:
+                cy1 = upper_clip[x] + 1
+                cy2 = int(min(draw_wall_y1 - 1, lower_clip[x] - 1))
+                mark_plane_col(plane_top, plane_bottom, ceil_plane, x, cy1, cy2)
+                if upper_clip[x] < cy2:
+                    upper_clip[x] = cy2
+
+            if b_draw_lower:
+                if b_draw_floor:
+                    fy1 = int(max(draw_wall_y2 + 1, upper_clip[x] + 1))
+                    fy2 = lower_clip[x] - 1
+                    mark_plane_col(plane_top, plane_bottom, floor_plane, x, fy1, fy2)
+                wy1 = int(max(portal_y2 - 1, upper_clip[x] + 1))
+                wy2 = int(min(wall_y2, lower_clip[x] - 1))
+                # clamp to screen height
+                wy1 = max(0, min(wy1, height))
+                wy2 = max(0, min(wy2, height))
+                if wy1 < wy2:
+                    draw_wall_col(
+                        framebuffer, lower_tex, wall_offset_along, x, wy1, wy2,
+                        lower_tex_alt, inv_scale, h_height, light_palettes, colormap,
+                    )
+                if lower_clip[x] > wy1:
+                    lower_clip[x] = wy1
+                portal_y2 += portal_y2_step
+
+            if b_draw_floor:
+                fy1 = int(max(draw_wall_y2 + 1, upper_clip[x] + 1))
+                fy2 = lower_clip[x] - 1
+                mark_plane_col(plane_top, plane_bottom, floor_plane, x, fy1, fy2)
+                if lower_clip[x] > draw_wall_y2 + 1:
+                    lower_clip[x] = fy1
+
+            if clip_offset >= 0:
+                openings[clip_offset + x - x1] = upper_clip[x]
+                openings[clip_offset + num_cols + x - x1] = lower_clip[x]
+
+        rw_scale += rw_scale_step
+        wall_y1 += wall_y1_step
+        wall_y2 += wall_y2_step
+
+
+@njit(fastmath=True, parallel=True)
+def draw_wall_ranges(walls, texture_ids, textures, num_strips, view,
+                     framebuffer, upper_clip, lower_clip, openings, plane_top, plane_bottom,
+                     x_to_angle, light_palettes, scale_light):
+    """
+    Draw a frame's wall ranges, in order, split into num_strips vertical
+    strips drawn in parallel. Columns are independent once the ranges
+    are clipped, and each strip only touches its own columns of the
+    framebuffer, clip arrays, openings and visplanes.
+
+    Parameters
+    ==========
+        walls: (n, WALL_PARAMS) array, the packed wall ranges
+        texture_ids: (n, 2) indices in textures of the upper and lower
+            textures of each range
+        textures: numba typed List of texture arrays
+    """
+    width = int(view[VIEW_WIDTH])
+    for strip in prange(num_strips):
+        x_lo = strip * width // num_strips
+        x_hi = (strip + 1) * width // num_strips - 1
+        for i in range(len(walls)):
+            wall = walls[i]
+            if wall[WALL_X2] < x_lo or wall[WALL_X1] > x_hi:
+                continue
+            draw_wall_range(
+                wall, view, framebuffer, upper_clip, lower_clip, openings,
+                textures[texture_ids[i, 0]], textures[texture_ids[i, 1]],
+                plane_top, plane_bottom, x_to_angle, light_palettes, scale_light,
+                x_lo, x_hi,
+            )
+
+
+@njit
+def clip_sprite(drawsegs, openings, x1, x2, scale, sprite_x, sprite_y, bottom_z, top_z,
+                player_x, player_y, height):
+    """
+    Rows a sprite shows between in screen columns x1 to x2, as in
+    R_DrawSprite: the drawsegs in front of the sprite clip it, the
+    furthest one first, as its clip arrays already hold those of the
+    walls nearer to the player.
+
+    Parameters
+    ==========
+        drawsegs: (n, WALL_PARAMS) array, the frame's wall ranges in drawing order
+        scale: of the sprite, as the walls' (projection over depth)
+        sprite_x, sprite_y: position of the sprite in the map
+        bottom_z, top_z: its bottom and top relative to the player's eyes
+
+    Returns
+    =======
+        clip_top, clip_bottom: per column, the last row hidden from the
+            top and the first hidden from the bottom
+    """
+    num_cols = x2 - x1 + 1
+    # -2 until a drawseg clips the column
+    clip_top = np.full(num_cols, -2, dtype=np.int64)
+    clip_bottom = np.full(num_cols, -2, dtype=np.int64)
+    for i in range(len(drawsegs) - 1, -1, -1):
+        ds = drawsegs[i]
+        silhouette = int(ds[WALL_SILHOUETTE])
+        ds_x1, ds_x2 = int(ds[WALL_X1]), int(ds[WALL_X2])
+        if ds_x1 > x2 or ds_x2 < x1 or silhouette == 0:
+            continue
+
+        # skip the walls behind the sprite: further at both ends, or at one
+        # end with the sprite on the player's side of them
+        scale1, scale2 = ds[WALL_SIL_SCALE1], ds[WALL_SIL_SCALE2]
+        if max(scale1, scale2) < scale:
+            continue
+        if min(scale1, scale2) < scale:
+            start_x, start_y = ds[WALL_START_X], ds[WALL_START_Y]
+            dir_x, dir_y = ds[WALL_DIR_X], ds[WALL_DIR_Y]
+            player_side = dir_x * (player_y - start_y) - dir_y * (player_x - start_x) > 0
+            sprite_side = dir_x * (sprite_y - start_y) - dir_y * (sprite_x - start_x) > 0
+            if player_side == sprite_side:
+                continue
+
+        r1, r2 = max(ds_x1, x1), min(ds_x2, x2)
+        if silhouette == SIL_SOLID:
+            for x in range(r1 - x1, r2 - x1 + 1):
+                if clip_top[x] == -2:
+                    clip_top[x] = height
+                if clip_bottom[x] == -2:
+                    clip_bottom[x] = -1
+            continue
+
+        # a silhouette only hides the sprite if it reaches over it
+        if bottom_z >= ds[WALL_BOTTOM_SIL_Z]:
+            silhouette &= ~SIL_BOTTOM
+        if top_z <= ds[WALL_TOP_SIL_Z]:
+            silhouette &= ~SIL_TOP
+        clip_offset = int(ds[WALL_CLIP_OFFSET])
+        ds_num_cols = ds_x2 - ds_x1 + 1
+        for x in range(r1, r2 + 1):
+            if silhouette & SIL_TOP and clip_top[x - x1] == -2:
+                clip_top[x - x1] = openings[clip_offset + x - ds_x1]
+            if silhouette & SIL_BOTTOM and clip_bottom[x - x1] == -2:
+                clip_bottom[x - x1] = openings[clip_offset + ds_num_cols + x - ds_x1]
+
+    for x in range(num_cols):
+        if clip_top[x] == -2:
+            clip_top[x] = -1
+        if clip_bottom[x] == -2:
+            clip_bottom[x] = height
+    return clip_top, clip_bottom